@@ -1,20 +1,53 @@
+import os
+from typing import Any, Dict, Optional
 from flask import Flask, render_template, request
 from app.services import db_service
 
-def create_app():
+def _env_flag(name: str) -> bool:
+    return os.environ.get(name, '').lower() in ('1', 'true', 'yes', 'on')
+
+def _env_int(name: str) -> Optional[int]:
+    value = os.environ.get(name, '').strip()
+    return int(value) if value else None
+
+def create_app(config: Optional[Dict[str, Any]] = None):
     app = Flask(__name__)
+    # 配置：默认值 <- 环境变量 <- create_app(config) 参数
+    app.config.from_mapping(
+        PROFILING_ENABLED=_env_flag('NOVEL_PROFILING'),
+        PROFILE_DIR=os.environ.get('NOVEL_PROFILE_DIR') or os.path.join(db_service.project_root, 'profiles'),
+        PROFILING_TOKEN=os.environ.get('NOVEL_PROFILING_TOKEN') or None,
+        # 每个 worker 进程同时执行的模型调用请求上限（见 api/ai_pool.py），未设置时不限制
+        AI_MAX_CONCURRENT=_env_int('NOVEL_AI_MAX_CONCURRENT'),
+        # 批量冲突检测同时执行的模型调用数上限，未设置时为 API key 数（见 services/conflict_scan_service.py）
+        CONFLICT_SCAN_CONCURRENCY=_env_int('NOVEL_CONFLICT_SCAN_CONCURRENCY'),
+        # 冲突检测的本地预筛，默认关闭：开启后没有疑似冲突的章节不调用模型，
+        # 也可由单次请求的 prefilter 参数开启或关闭（见 services/conflict_filter_service.py）
+        CONFLICT_PREFILTER=_env_flag('NOVEL_CONFLICT_PREFILTER'),
+    )
+    if config:
+        app.config.update(config)
     
     # Initialize DB (ensure tables exist)
     with app.app_context():
         db_service.init_db()
     
     # Register Blueprints
-    from app.api import novel_routes, chapter_routes, setting_routes, visualization_routes, search_routes
+    from app.api import novel_routes, chapter_routes, setting_routes, visualization_routes, search_routes, metrics_routes
+    # 指标：请求耗时 / SQL 次数 / Server-Timing 响应头，jsonify 编码耗时，/metrics 端点
+    app.json = metrics_routes.TimedJSONProvider(app)
+    app.register_blueprint(metrics_routes.bp)
     app.register_blueprint(novel_routes.bp)
     app.register_blueprint(chapter_routes.bp)
     app.register_blueprint(setting_routes.bp)
     app.register_blueprint(visualization_routes.bp)
     app.register_blueprint(search_routes.bp)
+    # 按需剖析单个请求：只在配置开启时注册（未开启时没有任何请求钩子）
+    if app.config['PROFILING_ENABLED']:
+        from app.api import profiling_routes
+        from app.services.profiling_service import profiling_service
+        profiling_service.configure(app.config['PROFILE_DIR'])
+        app.register_blueprint(profiling_routes.bp)
     
     # Frontend Routes (Simple)
     @app.route('/')
@@ -0,0 +1,91 @@
+import threading
+from functools import wraps
+from typing import Dict, Iterable, Iterator
+from flask import current_app, jsonify, make_response
+from ..services.metrics_service import metrics_service
+
+# 超出并发上限时建议客户端重试的间隔（秒）
+RETRY_AFTER_SECONDS = 5
+
+
+class AIRequestPool:
+    """
+    每个 worker 进程内同时执行的模型调用请求（设定提取、冲突检测、问答）数量上限。
+    多线程 worker 中，模型调用一次要占用线程几秒到几分钟；把其中一部分线程留给只读接口，
+    提取进行时章节列表、设定快照、知识图谱等请求仍有空闲线程处理。
+    上限由配置 AI_MAX_CONCURRENT 指定（未设置时不限制，开发服务器即如此）。
+    超出上限的请求立即返回 503 与 Retry-After，而不是排队占住线程。
+    """
+    def __init__(self):
+        self._active = 0
+        self._lock = threading.Lock()
+        self._stats = {"admitted": 0, "rejected": 0, "peak": 0}
+
+    def try_acquire(self, limit: int) -> bool:
+        with self._lock:
+            if self._active >= limit:
+                self._stats["rejected"] += 1
+                return False
+            self._active += 1
+            self._stats["admitted"] += 1
+            self._stats["peak"] = max(self._stats["peak"], self._active)
+            return True
+
+    def release(self):
+        with self._lock:
+            self._active -= 1
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self._stats, "active": self._active}
+
+# 单例
+ai_pool = AIRequestPool()
+
+
+def _ai_pool_metrics():
+    stats = ai_pool.get_stats()
+    lines = ['# HELP ai_pool_active 正在执行的模型调用请求数', '# TYPE ai_pool_active gauge',
+             f'ai_pool_active {stats["active"]}',
+             '# HELP ai_pool_requests_total 模型调用请求的准入结果', '# TYPE ai_pool_requests_total counter']
+    for outcome in ('admitted', 'rejected'):
+        lines.append(f'ai_pool_requests_total{{outcome="{outcome}"}} {stats[outcome]}')
+    return lines
+
+metrics_service.register_collector(_ai_pool_metrics)
+
+
+def _release_after_stream(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """分块输出的响应在输出结束（或客户端断开）后才归还名额"""
+    try:
+        yield from chunks
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+        ai_pool.release()
+
+
+def ai_bound(view):
+    """标记调用模型的视图，受 AI_MAX_CONCURRENT 限制"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        limit = current_app.config.get('AI_MAX_CONCURRENT')
+        if not limit:
+            return view(*args, **kwargs)
+        if not ai_pool.try_acquire(limit):
+            response = jsonify({"error": "AI requests are at capacity, please retry later"})
+            response.status_code = 503
+            response.headers['Retry-After'] = str(RETRY_AFTER_SECONDS)
+            return response
+        try:
+            response = make_response(view(*args, **kwargs))
+        except BaseException:
+            ai_pool.release()
+            raise
+        if response.is_streamed:
+            response.response = _release_after_stream(response.response)
+        else:
+            ai_pool.release()
+        return response
+    return wrapper
@@ -1,8 +1,14 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, current_app, request, jsonify
 import json
+import time
 from app.services.chapter_service import chapter_service
+from app.services.chapter_cache_service import chapter_cache_service
 from app.services.setting_service import setting_service
 from app.services.ai_service import ai_service
+from app.services.conflict_scan_service import conflict_scan_service
+from app.api.ai_pool import ai_bound
+from app.api.http_cache import cached_response
+from app.api.streaming import stream_events, stream_json, wants_event_stream
 
 bp = Blueprint('chapters', __name__, url_prefix='/api/novels')
 
@@ -53,18 +59,21 @@ def import_next_chapter(novel_id):
         return jsonify({"error": str(e)}), 500
 
 @bp.route('/<int:novel_id>/chapters', methods=['GET'])
+@cached_response
 def get_chapters(novel_id):
-    chapters = chapter_service.get_chapters(novel_id)
     latest_extracted = setting_service.get_latest_extracted_chapter(novel_id)
-    
-    for chap in chapters:
-        if chap['number'] <= latest_extracted:
-            chap['status'] = 'extracted'
-        else:
-            chap['status'] = 'not_extracted'
-            
-    return jsonify({
-        "chapters": chapters,
+
+    def chapters():
+        for chap in chapter_service.iter_chapters(novel_id):
+            if chap['number'] <= latest_extracted:
+                chap['status'] = 'extracted'
+            else:
+                chap['status'] = 'not_extracted'
+            yield chap
+
+    # 章节列表逐行读取、分块输出
+    return stream_json({
+        "chapters": chapters(),
         "latest_extracted_chapter": latest_extracted
     })
 
@@ -85,6 +94,7 @@ def delete_latest_chapter_endpoint(novel_id):
         return jsonify({"error": "Failed to delete chapter"}), 500
 
 @bp.route('/<int:novel_id>/extract_next_settings', methods=['POST'])
+@ai_bound
 def extract_next_settings(novel_id):
     try:
         latest_extracted = setting_service.get_latest_extracted_chapter(novel_id)
@@ -158,22 +168,112 @@ def get_chapter_content(novel_id, chapter_num):
             
     return jsonify(response_data)
 
+@bp.route('/chapter_cache/stats', methods=['GET'])
+def get_chapter_cache_stats():
+    """章节缓存的命中率、条目数与占用字节数"""
+    return jsonify(chapter_cache_service.get_stats())
+
+@bp.route('/conflict_prefilter/stats', methods=['GET'])
+def get_conflict_prefilter_stats():
+    """冲突检测预筛的跳过率、平均预筛耗时与估算节省的模型调用时间（本进程）"""
+    from app.services.conflict_filter_service import conflict_filter_service
+    return jsonify(conflict_filter_service.get_stats())
+
+def _prefilter_options(data):
+    """请求体中的 prefilter（默认取配置 CONFLICT_PREFILTER）与 candidates_only"""
+    prefilter = data.get('prefilter')
+    if prefilter is None:
+        prefilter = current_app.config.get('CONFLICT_PREFILTER', False)
+    return bool(prefilter), bool(data.get('candidates_only'))
+
 @bp.route('/<int:novel_id>/chapters/<int:chapter_num>/detect_conflicts', methods=['POST'])
+@ai_bound
 def detect_conflicts(novel_id, chapter_num):
+    """
+    请求体（可选）{"prefilter", "candidates_only"}：prefilter 时先本地预筛，没有疑似冲突则不调用模型；
+    candidates_only 时只把疑似冲突涉及的设定发给模型
+    """
     prev_settings = setting_service.get_settings_at_chapter(novel_id, chapter_num - 1)
     chapter = chapter_service.get_chapter_content(novel_id, chapter_num)
     if not chapter:
         return jsonify({"error": "Chapter content not found"}), 404
-        
-    result = ai_service.detect_conflicts(prev_settings, chapter['content'])
+
+    prefilter, candidates_only = _prefilter_options(request.get_json(silent=True) or {})
+    if prefilter:
+        from app.services.conflict_filter_service import conflict_filter_service
+        result = conflict_filter_service.detect_conflicts(prev_settings, chapter['content'],
+                                                          candidates_only=candidates_only, novel_id=novel_id)
+    else:
+        result = ai_service.detect_conflicts(prev_settings, chapter['content'])
     
     # Save result to database
     chapter_service.update_conflict_result(novel_id, chapter_num, result)
     
     return jsonify(result)
 
+@bp.route('/<int:novel_id>/conflicts', methods=['GET'])
+def query_conflicts(novel_id):
+    """
+    分页查询已保存的冲突：?entity=张三&start_chapter=12&from=100&to=200&limit=50&offset=0，条件均可省略
+    """
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 500)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    result = chapter_service.query_conflicts(
+        novel_id,
+        entity=request.args.get('entity', '').strip() or None,
+        start_chapter=request.args.get('start_chapter', type=int),
+        chapter_from=request.args.get('from', type=int),
+        chapter_to=request.args.get('to', type=int),
+        limit=limit, offset=offset
+    )
+    return jsonify({**result, "limit": limit, "offset": offset})
+
+@bp.route('/<int:novel_id>/conflicts/scan', methods=['POST'])
+@ai_bound
+def scan_conflicts(novel_id):
+    """
+    批量冲突检测：请求体 {"start", "end", "concurrency"（可选，不超过配置的上限）, "skip_checked"（可选）,
+    "prefilter", "candidates_only"（可选，同单章检测）}。
+    请求头 Accept: text/event-stream 时以 Server-Sent Events 逐章输出进度（start / chapter / done），
+    客户端断开即停止；否则全部完成后返回 done 的汇总。
+    """
+    data = request.get_json(silent=True) or {}
+    start = data.get('start')
+    end = data.get('end')
+    if not isinstance(start, int) or not isinstance(end, int) or start < 1 or start > end:
+        return jsonify({"error": "Invalid range"}), 400
+
+    limit = current_app.config.get('CONFLICT_SCAN_CONCURRENCY') or conflict_scan_service.default_concurrency()
+    concurrency = data.get('concurrency') or limit
+    if not isinstance(concurrency, int) or concurrency < 1:
+        return jsonify({"error": "Invalid concurrency"}), 400
+    prefilter, candidates_only = _prefilter_options(data)
+    events = conflict_scan_service.scan(novel_id, start, end, min(concurrency, limit),
+                                        skip_checked=bool(data.get('skip_checked')),
+                                        prefilter=prefilter, candidates_only=candidates_only)
+
+    if wants_event_stream():
+        return stream_events(_scan_events(events))
+    summary = None
+    for event, payload in events:
+        if event == 'done':
+            summary = payload
+    return jsonify(summary)
+
+def _scan_events(events):
+    """批量冲突检测的进度事件；中途出错时以 error 事件结束"""
+    try:
+        yield from events
+    except Exception as e:
+        yield 'error', {"error": f"冲突检测出错: {str(e)}"}
+
 @bp.route('/<int:novel_id>/chapters/<int:chapter_num>/chat', methods=['POST'])
+@ai_bound
 def chat_with_ai(novel_id, chapter_num):
+    """
+    基于设定与本章内容的问答。请求头 Accept: text/event-stream 时以 Server-Sent Events 逐段输出回答，
+    否则等待完整回答后返回 JSON。
+    """
     data = request.get_json()
     user_query = data.get('query')
     if not user_query:
@@ -184,5 +284,25 @@ def chat_with_ai(novel_id, chapter_num):
     if not chapter:
         return jsonify({"error": "Chapter content not found"}), 404
         
+    if wants_event_stream():
+        return stream_events(_chat_events(prev_settings, chapter['content'], user_query))
+
     response = ai_service.chat_with_context(prev_settings, chapter['content'], user_query)
     return jsonify({"response": response})
+
+def _chat_events(prev_settings, content, user_query):
+    """
+    流式问答的事件：token（{"text": 片段}）逐段输出，结束时 done（首段与总耗时，毫秒），出错时 error。
+    客户端断开时生成器被关闭，ai_service 随即断开与模型的连接。
+    """
+    t0 = time.perf_counter()
+    first_token_ms = None
+    try:
+        for text in ai_service.stream_chat_with_context(prev_settings, content, user_query):
+            if first_token_ms is None:
+                first_token_ms = round((time.perf_counter() - t0) * 1000, 1)
+            yield 'token', {"text": text}
+    except Exception as e:
+        yield 'error', {"error": f"AI 响应出错: {str(e)}"}
+        return
+    yield 'done', {"first_token_ms": first_token_ms, "total_ms": round((time.perf_counter() - t0) * 1000, 1)}
@@ -0,0 +1,158 @@
+import gzip
+import hashlib
+import threading
+import zlib
+from functools import wraps
+from typing import Dict, Iterable, Iterator, Optional
+from flask import request, make_response
+from ..services.cache_service import cache_service
+
+try:
+    import brotli
+except ImportError:  # brotli 为可选依赖，未安装时只使用 gzip
+    brotli = None
+
+# 小于该字节数的响应不压缩（压缩收益抵不过开销）
+MIN_COMPRESS_BYTES = 1024
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+
+
+class HttpCacheStats:
+    """按端点统计条件请求命中（304）与压缩节省的字节数"""
+    def __init__(self):
+        self._stats: Dict[str, Dict[str, int]] = {}
+        # ETag -> 完整响应字节数，用于估算 304 节省的流量
+        self._sizes: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _endpoint(self, endpoint: str) -> Dict[str, int]:
+        return self._stats.setdefault(endpoint, {
+            "requests": 0, "not_modified": 0, "compressed": 0,
+            "bytes_raw": 0, "bytes_sent": 0, "bytes_saved": 0
+        })
+
+    def record_not_modified(self, endpoint: str, etag: str):
+        with self._lock:
+            stats = self._endpoint(endpoint)
+            stats["requests"] += 1
+            stats["not_modified"] += 1
+            size = self._sizes.get(etag, 0)
+            stats["bytes_raw"] += size
+            stats["bytes_saved"] += size
+
+    def record_response(self, endpoint: str, etag: str, raw_bytes: int, sent_bytes: int, compressed: bool):
+        with self._lock:
+            stats = self._endpoint(endpoint)
+            stats["requests"] += 1
+            stats["compressed"] += int(compressed)
+            stats["bytes_raw"] += raw_bytes
+            stats["bytes_sent"] += sent_bytes
+            stats["bytes_saved"] += raw_bytes - sent_bytes
+            if len(self._sizes) >= 10000:
+                self._sizes.clear()
+            self._sizes[etag] = raw_bytes
+
+    def get_stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {endpoint: dict(stats) for endpoint, stats in self._stats.items()}
+
+# 单例
+http_cache_stats = HttpCacheStats()
+
+
+def _make_etag(novel_id: int) -> str:
+    """
+    ETag = 小说写入代数 + 请求路径与参数的摘要。代数保存在数据库中，各 worker 进程一致且重启后延续，
+    同一资源在任一进程得到的 ETag 相同。
+    """
+    args = '&'.join(f'{k}={v}' for k, v in sorted(request.args.items(multi=True)))
+    digest = hashlib.sha1(f'{request.path}?{args}'.encode('utf-8')).hexdigest()[:12]
+    return f'{novel_id}-{cache_service.get_generation(novel_id)}-{digest}'
+
+
+def _choose_encoding() -> Optional[str]:
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def _compress(data: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL)
+
+
+def _compress_stream(chunks: Iterable[bytes], encoding: Optional[str], endpoint: str, etag: str) -> Iterator[bytes]:
+    """分块响应的增量压缩（encoding 为 None 时原样输出），输出结束时记录字节统计"""
+    if encoding is None:
+        compress, flush = (lambda chunk: chunk), (lambda: b'')
+    elif encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        compress, flush = compressor.process, compressor.finish
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # wbits=31：gzip 格式
+        compress, flush = compressor.compress, compressor.flush
+    raw_bytes = sent_bytes = 0
+    for chunk in chunks:
+        raw_bytes += len(chunk)
+        data = compress(chunk)
+        if data:
+            sent_bytes += len(data)
+            yield data
+    data = flush()
+    if data:
+        sent_bytes += len(data)
+        yield data
+    http_cache_stats.record_response(endpoint, etag, raw_bytes, sent_bytes, encoding is not None)
+
+
+def cached_response(view):
+    """
+    只读端点的 HTTP 缓存层（视图需带 novel_id 参数）：
+    - 以 小说写入代数 + 请求参数 计算弱 ETag，If-None-Match 命中时直接返回 304，不执行视图；
+    - 成功的响应附带 ETag 与 Cache-Control: no-cache（每次使用前向服务端确认）；
+    - 较大的响应按 Accept-Encoding 进行 brotli/gzip 压缩，分块输出的响应边生成边压缩。
+    代数在执行视图前读取：若计算期间发生写入，ETag 偏旧，下次请求时会重新计算，不会返回过期数据。
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        etag = _make_etag(kwargs['novel_id'])
+        endpoint = request.endpoint
+
+        if request.if_none_match.contains_weak(etag):
+            response = make_response('', 304)
+            response.set_etag(etag, weak=True)
+            response.headers['Cache-Control'] = 'no-cache'
+            http_cache_stats.record_not_modified(endpoint, etag)
+            return response
+
+        response = make_response(view(*args, **kwargs))
+        if response.status_code != 200:
+            return response
+
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = 'no-cache'
+        response.vary.add('Accept-Encoding')
+        if response.is_streamed:
+            # 分块输出（streaming.stream_json）的响应大小事先未知，一律增量压缩
+            encoding = _choose_encoding() if 'Content-Encoding' not in response.headers else None
+            response.response = _compress_stream(response.response, encoding, endpoint, etag)
+            if encoding:
+                response.headers['Content-Encoding'] = encoding
+            return response
+
+        data = response.get_data()
+        encoding = _choose_encoding() if len(data) >= MIN_COMPRESS_BYTES else None
+        if encoding and 'Content-Encoding' not in response.headers:
+            compressed = _compress(data, encoding)
+            response.set_data(compressed)
+            response.headers['Content-Encoding'] = encoding
+            http_cache_stats.record_response(endpoint, etag, len(data), len(compressed), True)
+        else:
+            http_cache_stats.record_response(endpoint, etag, len(data), len(data), False)
+        return response
+    return wrapper
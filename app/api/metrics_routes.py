@@ -0,0 +1,62 @@
+import time
+from typing import List
+from flask import Blueprint, Response, g, request
+from flask.json.provider import DefaultJSONProvider
+from ..services.metrics_service import metrics_service
+from ..services.chapter_cache_service import chapter_cache_service
+from .http_cache import http_cache_stats
+
+bp = Blueprint('metrics', __name__)
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """记录 jsonify 的编码耗时（流式输出的响应不经过这里）"""
+    def response(self, *args, **kwargs):
+        t0 = time.perf_counter()
+        response = super().response(*args, **kwargs)
+        metrics_service.observe_json(request.endpoint or 'unmatched', time.perf_counter() - t0)
+        return response
+
+
+@bp.before_app_request
+def begin_request_metrics():
+    g.metrics_token = metrics_service.begin_request()
+
+
+@bp.after_app_request
+def end_request_metrics(response):
+    """记录请求耗时与 SQL 次数，并附加 Server-Timing 响应头（db / ai / json / total，单位 ms）"""
+    token = g.pop('metrics_token', None)
+    if token is None:
+        return response
+    timings = metrics_service.end_request(token, request.endpoint or 'unmatched', request.method, response.status_code)
+    if timings is not None:
+        response.headers['Server-Timing'] = timings.server_timing()
+    return response
+
+
+def _cache_metrics() -> List[str]:
+    lines = ['# HELP chapter_cache_events_total 章节缓存事件次数', '# TYPE chapter_cache_events_total counter']
+    stats = chapter_cache_service.get_stats()
+    for event in ('hits', 'misses', 'evictions', 'invalidations'):
+        lines.append(f'chapter_cache_events_total{{event="{event}"}} {stats[event]}')
+    lines += ['# HELP chapter_cache_bytes 章节缓存占用字节数（估算）', '# TYPE chapter_cache_bytes gauge',
+              f'chapter_cache_bytes {stats["bytes"]}']
+
+    lines += ['# HELP http_cache_bytes_total 只读端点原始/实际发送/节省的字节数', '# TYPE http_cache_bytes_total counter']
+    endpoint_stats = http_cache_stats.get_stats()
+    for endpoint, stats in sorted(endpoint_stats.items()):
+        for kind in ('raw', 'sent', 'saved'):
+            lines.append(f'http_cache_bytes_total{{endpoint="{endpoint}",kind="{kind}"}} {stats["bytes_" + kind]}')
+    lines += ['# HELP http_cache_not_modified_total 返回 304 的次数', '# TYPE http_cache_not_modified_total counter']
+    for endpoint, stats in sorted(endpoint_stats.items()):
+        lines.append(f'http_cache_not_modified_total{{endpoint="{endpoint}"}} {stats["not_modified"]}')
+    return lines
+
+metrics_service.register_collector(_cache_metrics)
+
+
+@bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus 文本格式的指标"""
+    return Response(metrics_service.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
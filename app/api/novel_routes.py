@@ -1,7 +1,9 @@
 from flask import Blueprint, request, jsonify
 from ..services.novel_service import novel_service
 from ..services.setting_service import setting_service
+from ..services.chapter_service import chapter_service
 from ..services import db_service
+from .http_cache import cached_response, http_cache_stats
 
 bp = Blueprint('novels', __name__, url_prefix='/api/novels')
 
@@ -27,20 +29,24 @@ def delete_novel(novel_id):
     else:
         return jsonify({"error": "Novel not found"}), 404
 
+@bp.route('/http_cache/stats', methods=['GET'])
+def get_http_cache_stats():
+    """各只读端点的 304 命中次数、压缩次数与节省的字节数"""
+    return jsonify(http_cache_stats.get_stats())
+
 @bp.route('/<int:novel_id>/density', methods=['GET'])
+@cached_response
 def get_novel_density(novel_id):
     """计算小说的设定密度"""
     try:
-        # 获取小说的总字数
-        chapters = db_service.execute_query(
-            "SELECT content FROM chapters WHERE novel_id = ?", 
+        # 获取小说的总字数（导入时随正文一起记录，无需解压正文）
+        total_words = db_service.execute_query(
+            """
+            SELECT COALESCE(SUM(cc.char_count), 0) AS total FROM chapter_contents cc
+            JOIN chapters c ON cc.chapter_id = c.id WHERE c.novel_id = ?
+            """,
             (novel_id,)
-        )
-        
-        total_words = 0
-        for chapter in chapters:
-            if chapter['content']:
-                total_words += len(chapter['content'])
+        )[0]['total']
         
         # 获取实体数量
         entities_count = db_service.execute_query(
@@ -78,6 +84,14 @@ def get_novel_density(novel_id):
     except Exception as e:
         return jsonify({"error": f"计算密度失败: {str(e)}"}), 500
 
+@bp.route('/<int:novel_id>/storage', methods=['GET'])
+def get_novel_storage(novel_id):
+    """章节正文压缩存储统计（节省空间与解压耗时）"""
+    try:
+        return jsonify(chapter_service.get_storage_report(novel_id))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @bp.route('/<int:novel_id>/frequent_patterns', methods=['GET'])
 def get_frequent_patterns(novel_id):
     """获取小说的频繁子图模式"""
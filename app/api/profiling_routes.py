@@ -0,0 +1,92 @@
+from typing import Iterable, Iterator, Optional
+from flask import Blueprint, current_app, g, jsonify, request, send_from_directory, abort
+from ..services.profiling_service import profiling_service, MODES
+
+# 只有配置开启 PROFILING_ENABLED 时 create_app 才注册本蓝图；未注册时不存在任何请求钩子，没有额外开销
+bp = Blueprint('profiling', __name__, url_prefix='/api/profiles')
+
+# 触发剖析：请求头 X-Profile: cprofile|sample（其它非空值按 cprofile 处理）或查询参数 ?_profile=...
+PROFILE_HEADER = 'X-Profile'
+PROFILE_ARG = '_profile'
+# 配置了 PROFILING_TOKEN 时，还需带上该请求头且值相同
+TOKEN_HEADER = 'X-Profile-Token'
+
+
+def _requested_mode() -> Optional[str]:
+    value = request.headers.get(PROFILE_HEADER) or request.args.get(PROFILE_ARG)
+    if not value or request.blueprint == bp.name:
+        return None
+    token = current_app.config.get('PROFILING_TOKEN')
+    if token and request.headers.get(TOKEN_HEADER) != token:
+        return None
+    return value if value in MODES else 'cprofile'
+
+
+def _profile_meta(response) -> dict:
+    return {
+        "method": request.method,
+        "path": request.path,
+        "query": request.query_string.decode('utf-8', errors='replace'),
+        "endpoint": request.endpoint,
+        "status": response.status_code if response is not None else 500
+    }
+
+
+def _finish_after_stream(chunks: Iterable[bytes], capture, meta: dict) -> Iterator[bytes]:
+    """分块输出的响应在输出结束（或客户端断开）后才结束剖析，使结果包含生成响应体的耗时"""
+    try:
+        yield from chunks
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+        profiling_service.finish(capture, meta)
+
+
+@bp.before_app_request
+def start_profile():
+    mode = _requested_mode()
+    if mode is None:
+        return
+    capture = profiling_service.start(mode)
+    if capture is None:
+        g.profile_busy = True
+    else:
+        g.profile_capture = capture
+
+
+@bp.after_app_request
+def finish_profile(response):
+    capture = g.pop('profile_capture', None)
+    if capture is None:
+        if g.pop('profile_busy', False):
+            response.headers['X-Profile-Id'] = 'busy'  # 已有请求在使用 cProfile，本次未剖析
+        return response
+    response.headers['X-Profile-Id'] = capture.id
+    if response.is_streamed:
+        response.response = _finish_after_stream(response.response, capture, _profile_meta(response))
+    else:
+        profiling_service.finish(capture, _profile_meta(response))
+    return response
+
+
+@bp.teardown_app_request
+def abandon_profile(exc):
+    # 请求异常中断、未经过 after_request 时也要结束剖析并释放 cProfile
+    capture = g.pop('profile_capture', None)
+    if capture is not None:
+        profiling_service.finish(capture, _profile_meta(None))
+
+
+@bp.route('', methods=['GET'])
+def list_profiles():
+    """已保存的剖析结果（按时间倒序）"""
+    return jsonify({"profiles": profiling_service.list_profiles()})
+
+
+@bp.route('/<path:filename>', methods=['GET'])
+def download_profile(filename):
+    """下载剖析结果：.pstats（pstats / snakeviz）、.txt（文本摘要）、.collapsed（flamegraph.pl / speedscope）、.json（元数据）"""
+    if not profiling_service.is_valid_file(filename):
+        abort(404)
+    return send_from_directory(profiling_service.profile_dir, filename, as_attachment=True)
@@ -1,5 +1,8 @@
-from flask import Blueprint, jsonify, request
+import json
+from flask import Blueprint, jsonify, request, Response, stream_with_context
 from ..services.setting_service import setting_service
+from ..services.chapter_service import chapter_service
+from .streaming import stream_json
 
 bp = Blueprint('search', __name__, url_prefix='/api/search')
 
@@ -17,6 +20,38 @@ def get_entity_history():
     
     return jsonify(history)
 
+@bp.route('/timeline', methods=['GET', 'POST'])
+def get_entity_timelines():
+    """
+    批量实体变更时间线：names（GET 时可重复或逗号分隔，POST 时为 JSON 数组）或 type 指定实体，
+    两者都为空时返回全部实体。format=ndjson 时每行输出一个实体的时间线（流式）。
+    """
+    data = (request.get_json(silent=True) or {}) if request.method == 'POST' else {}
+    args = {**request.args.to_dict(), **data}
+    try:
+        novel_id = int(args.get('novel_id'))
+        start_chapter = int(args.get('start_chapter'))
+        end_chapter = int(args.get('end_chapter'))
+    except (TypeError, ValueError):
+        return jsonify({"error": "Missing required parameters"}), 400
+
+    names = data.get('names') if request.method == 'POST' else None
+    if names is None:
+        names = [n.strip() for raw in request.args.getlist('names') for n in raw.split(',') if n.strip()] or None
+    entity_type = args.get('type') or None
+
+    if args.get('format') == 'ndjson':
+        def generate():
+            for name, history in setting_service.iter_entity_timelines(novel_id, start_chapter, end_chapter, names, entity_type):
+                yield json.dumps({"name": name, "history": history}, ensure_ascii=False) + '\n'
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    # 默认输出 JSON 数组（分块输出，与 get_entity_timelines 的结构一致）
+    return stream_json(
+        {"name": name, "history": history}
+        for name, history in setting_service.iter_entity_timelines(novel_id, start_chapter, end_chapter, names, entity_type)
+    )
+
 @bp.route('/suggest', methods=['GET'])
 def suggest_entities():
     novel_id = request.args.get('novel_id', type=int)
@@ -27,3 +62,17 @@ def suggest_entities():
         
     suggestions = setting_service.search_entities(novel_id, query)
     return jsonify(suggestions)
+
+@bp.route('/chapters', methods=['GET'])
+def search_chapters():
+    """章节正文全文检索，返回按相关度排序的命中章节与高亮片段"""
+    novel_id = request.args.get('novel_id', type=int)
+    query = request.args.get('query', type=str, default='')
+    limit = request.args.get('limit', type=int, default=20)
+    offset = request.args.get('offset', type=int, default=0)
+
+    if not novel_id:
+        return jsonify({"error": "Missing required parameters"}), 400
+
+    result = chapter_service.search_chapter_content(novel_id, query, min(max(1, limit), 100), max(0, offset))
+    return jsonify(result)
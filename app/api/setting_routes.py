@@ -1,9 +1,15 @@
 from flask import Blueprint, request, jsonify
+from ..services import db_service
 from ..services.setting_service import setting_service
+from ..services.trace_service import trace_service
+from .ai_pool import ai_bound
+from .http_cache import cached_response
+from .streaming import stream_json
 
 bp = Blueprint('settings', __name__, url_prefix='/api/novels')
 
 @bp.route('/<int:novel_id>/chapters/<int:chapter_number>/extract', methods=['POST'])
+@ai_bound
 def extract_settings(novel_id, chapter_number):
     try:
         setting_service.extract_and_update_settings(novel_id, chapter_number)
@@ -12,6 +18,7 @@ def extract_settings(novel_id, chapter_number):
         return jsonify({"error": str(e)}), 500
 
 @bp.route('/<int:novel_id>/extract_batch', methods=['POST'])
+@ai_bound
 def extract_batch_settings(novel_id):
     try:
         data = request.get_json() or {}
@@ -44,16 +51,42 @@ def extract_batch_settings(novel_id):
         return jsonify({"error": str(e)}), 500
 
 @bp.route('/<int:novel_id>/chapters/<int:chapter_number>/settings', methods=['GET'])
+@cached_response
 def get_settings(novel_id, chapter_number):
-    settings = setting_service.get_settings_at_chapter(novel_id, chapter_number)
-    return jsonify(settings)
+    # 快照按需从数据库逐行读取、分块输出，不在内存中构建完整结果；
+    # 实体与关系在同一读事务中读取，两者之间提交的写入不会使结果不一致
+    conn = db_service.open_read_snapshot()
+    try:
+        settings = setting_service.iter_settings_at_chapter(novel_id, chapter_number, conn)
+    except Exception:
+        conn.close()
+        raise
+    return stream_json(settings, on_close=conn.close)
 
 @bp.route('/<int:novel_id>/chapters/<int:chapter_number>/changes', methods=['GET'])
+@cached_response
 def get_setting_changes(novel_id, chapter_number):
     changes = setting_service.get_chapter_changes(novel_id, chapter_number)
     return jsonify(changes)
 
+@bp.route('/<int:novel_id>/settings/diff', methods=['GET'])
+@cached_response
+def get_settings_diff(novel_id):
+    """
+    任意两章之间的设定差异：?from=100&to=900（from 可为 0，表示第一章之前）
+    """
+    from_chapter = request.args.get('from', type=int)
+    to_chapter = request.args.get('to', type=int)
+    if from_chapter is None or to_chapter is None or from_chapter < 0 or to_chapter < 0:
+        return jsonify({"error": "from and to are required"}), 400
+
+    diff = setting_service.get_settings_diff(novel_id, from_chapter, to_chapter)
+    if diff is None:
+        return jsonify({"error": "Chapter not found"}), 404
+    return jsonify(diff)
+
 @bp.route('/<int:novel_id>/extract_to_chapter', methods=['POST'])
+@ai_bound
 def extract_to_chapter(novel_id):
     """
     从第一个未提取的章节开始，批量提取设定直到指定的章节。
@@ -89,3 +122,60 @@ def rollback_settings(novel_id):
         return jsonify({"message": f"Settings rolled back for chapters {start} to {end}"})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+
+@bp.route('/<int:novel_id>/extraction_traces', methods=['GET'])
+def get_extraction_traces(novel_id):
+    """
+    设定提取记录（按时间倒序）：?limit=100&offset=0&chapter=12
+    """
+    try:
+        limit = min(max(request.args.get('limit', 100, type=int), 1), 1000)
+        offset = max(request.args.get('offset', 0, type=int), 0)
+        chapter = request.args.get('chapter', type=int)
+        return jsonify({"traces": trace_service.get_traces(novel_id, limit, offset, chapter)})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@bp.route('/<int:novel_id>/extraction_traces/summary', methods=['GET'])
+def get_extraction_trace_summary(novel_id):
+    """
+    按小说聚合提取记录：各阶段耗时分布、最慢章节、离群章节；?window=N 时对比最近 N 条与之前 N 条
+    """
+    try:
+        window = max(request.args.get('window', 0, type=int), 0)
+        top = min(max(request.args.get('top', 10, type=int), 1), 100)
+        return jsonify(trace_service.get_summary(novel_id, window, top))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@bp.route('/<int:novel_id>/settings/dedup/candidates', methods=['GET'])
+def dedup_candidates(novel_id):
+    """
+    查找疑似重复的实体（合并候选），按得分降序返回。
+    """
+    from ..services.dedup_service import dedup_service
+    try:
+        threshold = request.args.get('threshold', dedup_service.DEFAULT_THRESHOLD, type=float)
+        limit = min(max(request.args.get('limit', 100, type=int), 1), 1000)
+        return jsonify(dedup_service.find_candidates(novel_id, threshold, limit))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@bp.route('/<int:novel_id>/settings/dedup/merge', methods=['POST'])
+def dedup_merge(novel_id):
+    """
+    应用确认后的合并：{"merges": [{"keep": 实体ID, "merge": 实体ID}, ...]}
+    """
+    from ..services.dedup_service import dedup_service
+    try:
+        data = request.get_json() or {}
+        merges = data.get('merges')
+        if not merges or not isinstance(merges, list):
+            return jsonify({"error": "merges is required"}), 400
+        try:
+            result = dedup_service.apply_merges(novel_id, merges)
+        except (KeyError, TypeError, ValueError) as e:
+            return jsonify({"error": str(e)}), 400
+        return jsonify(result)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
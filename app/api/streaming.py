@@ -0,0 +1,97 @@
+import json
+import traceback
+from typing import Any, Callable, Iterable, Iterator, Optional, Tuple
+from flask import Response, request, stream_with_context
+
+# 累积到该字节数后再向客户端输出一个分块，避免逐行 yield 的开销
+CHUNK_BYTES = 64 * 1024
+# 输出中途出错时追加在已输出内容之后的一行（状态码 200 已发出，无法再改为错误状态）。
+# 响应体无法解析且以该行结尾，即表示结果不完整
+STREAM_ERROR_KEY = 'stream_error'
+
+
+def _is_stream(value: Any) -> bool:
+    return not isinstance(value, (dict, list, tuple, str, bytes, int, float, bool, type(None))) \
+        and hasattr(value, '__iter__')
+
+
+def _is_lazy(value: Any) -> bool:
+    """值本身或其中某个字段需要延迟求值（迭代器或可调用对象）"""
+    if callable(value) or _is_stream(value):
+        return True
+    return isinstance(value, dict) and any(_is_lazy(v) for v in value.values())
+
+
+def iter_json(value: Any) -> Iterator[str]:
+    """
+    逐段生成 value 的 JSON 文本：含迭代器的 dict 逐字段展开，迭代器（生成器、游标）作为数组逐项输出，
+    可调用对象在写到该位置时才求值（用于依赖前面数组内容的统计字段）。
+    不含延迟字段的值整体序列化。
+    """
+    if callable(value):
+        value = value()
+    if isinstance(value, dict) and _is_lazy(value):
+        yield '{'
+        for i, (key, item) in enumerate(value.items()):
+            yield (',' if i else '') + json.dumps(str(key), ensure_ascii=False) + ':'
+            yield from iter_json(item)
+        yield '}'
+    elif _is_stream(value):
+        yield '['
+        for i, item in enumerate(value):
+            yield (',' if i else '') + json.dumps(item, ensure_ascii=False)
+        yield ']'
+    else:
+        yield json.dumps(value, ensure_ascii=False)
+
+
+def _chunked(parts: Iterator[str]) -> Iterator[bytes]:
+    buffer, size = [], 0
+    try:
+        for part in parts:
+            buffer.append(part)
+            size += len(part)
+            if size >= CHUNK_BYTES:
+                yield ''.join(buffer).encode('utf-8')
+                buffer, size = [], 0
+    except Exception as e:
+        # 不静默截断：输出已缓冲的部分后以错误标记行结束
+        traceback.print_exc()
+        buffer.append('\n' + json.dumps({STREAM_ERROR_KEY: str(e)}, ensure_ascii=False) + '\n')
+    if buffer:
+        yield ''.join(buffer).encode('utf-8')
+
+
+def stream_json(value: Any, on_close: Optional[Callable[[], None]] = None) -> Response:
+    """
+    以分块传输输出 JSON 响应。value 中的迭代器按需读取，服务端不会同时持有完整的结果树与 JSON 文本，
+    首个分块在结果全部生成之前即可发出。输出与 jsonify 的结构一致，客户端无需改动。
+    生成过程中出错时以 {"stream_error": ...} 一行结束响应（见 STREAM_ERROR_KEY）。
+    on_close 在响应结束（含客户端断开）时调用，用于释放迭代器共用的资源（如读快照连接）。
+    """
+    response = Response(stream_with_context(_chunked(iter_json(value))), mimetype='application/json')
+    if on_close is not None:
+        response.call_on_close(on_close)
+    return response
+
+
+def wants_event_stream() -> bool:
+    """客户端通过 Accept: text/event-stream 请求以 Server-Sent Events 输出"""
+    return request.accept_mimetypes.best_match(['application/json', 'text/event-stream']) == 'text/event-stream'
+
+
+def _event_chunks(events: Iterable[Tuple[str, Any]]) -> Iterator[bytes]:
+    for event, data in events:
+        yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode('utf-8')
+
+
+def stream_events(events: Iterable[Tuple[str, Any]]) -> Response:
+    """
+    以 Server-Sent Events 输出 (事件名, 数据) 序列，数据编码为一行 JSON，每个事件生成后立即发出（不合并分块）。
+    客户端断开后，WSGI 服务器在下一次写出失败时关闭响应，events（生成器）随之被关闭，可在其中释放上游资源。
+    """
+    response = Response(_event_chunks(events), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # 关闭 nginx 等反向代理对响应的缓冲
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
@@ -1,170 +1,148 @@
 from flask import Blueprint, jsonify, request
-from ..services.setting_service import setting_service
+from ..services import db_service
+from ..services.graph_service import graph_service
+from ..services.graph_query_service import graph_query_service
+from .http_cache import cached_response
+from .streaming import stream_json
 
 bp = Blueprint('visualization', __name__, url_prefix='/api/novels')
 
+# 中心性时间序列一次最多采样的章节数
+MAX_SERIES_POINTS = 200
+
 @bp.route('/<int:novel_id>/chapters/<int:chapter_number>/knowledge_graph', methods=['GET'])
+@cached_response
 def get_knowledge_graph(novel_id, chapter_number):
+    """返回知识图谱。
+    可选参数 base_chapter：客户端已持有该章的图时，只返回新增/移除/变更的节点与边。
+    """
     # 从查询参数获取 n，默认值为 1
     n = request.args.get('n', default=1, type=int)
-
-    settings = setting_service.get_settings_at_chapter(novel_id, chapter_number)
-    
-    # 使用新的范围查询服务
-    if n > 1:
-        changes = setting_service.get_changes_in_range(novel_id, chapter_number, n)
-        updated_entity_names = changes.get('updated_entity_names', set())
-    else: # 兼容旧的单章查询
-        changes = setting_service.get_chapter_changes(novel_id, chapter_number)
-        updated_entity_names = {e['name'] for e in changes.get('new_entities', [])}
-        # Add entities with updated properties
-        updated_entity_names.update(p['entity_name'] for p in changes.get('new_properties', []))
-        # Add entities with updated relationships
-        for r in changes.get('new_relationships', []):
-            updated_entity_names.add(r['subject_name'])
-            updated_entity_names.add(r['object_name'])
-
-    nodes = []
-    links = []
-    
-    # Entities as nodes
-    for entity in settings.get('entities', []):
-        is_new = entity['name'] in updated_entity_names
-        nodes.append({
-            "id": str(entity['id']),
-            "name": entity['name'],
-            "category": entity['type'],
-            "properties": entity.get('properties', {}),
-            "is_new": is_new,
-            # 向前端传递 start_chapter_id 以便进行更灵活的过滤
-            "start_chapter": entity.get('start_chapter_id') 
-        })
-    
-    # Relationships as links
-    for rel in settings.get('relationships', []):
-        # 为了找到节点的数字ID，我们需要一个从实体名称到ID的映射
-        # 注意：这里的实现有一个潜在问题，如果存在同名实体，映射会不准确。
-        # 在当前数据模型下，我们假设实体名称是唯一的。
-        nodes_map = {n['name']: n['id'] for n in nodes}
-        source_id = nodes_map.get(rel['subject'])
-        target_id = nodes_map.get(rel['object'])
-        
-        if source_id and target_id:
-            links.append({
-                "source": source_id,
-                "target": target_id,
-                "value": rel['relation']
-            })
-    
-    return jsonify({
-        "nodes": nodes,
-        "links": links
-    })
+    base_chapter = request.args.get('base_chapter', type=int)
+
+    if base_chapter is not None and base_chapter != chapter_number:
+        result = graph_service.get_knowledge_graph_delta(novel_id, chapter_number, base_chapter, n)
+        response = jsonify(result)
+        # 增量的 stats 不含节点数与边数（部分快照时无法得到），日志只读取增量自身的字段
+        stats = result.get('stats', {})
+        print(f"[KnowledgeGraph] novel={novel_id} chapter={chapter_number} base={base_chapter} "
+              f"changed_items={stats.get('changed_items')} partial={stats.get('partial')} "
+              f"changed_entities={stats.get('changed_entities')} payload={response.content_length}B "
+              f"build={stats.get('build_ms')}ms diff={stats.get('diff_ms')}ms")
+        return response
+
+    # 完整图谱流式输出：节点与边逐个生成，stats 在两者输出完毕后计算；
+    # 实体与关系在同一读事务中读取
+    conn = db_service.open_read_snapshot()
+    try:
+        result = graph_service.iter_knowledge_graph(novel_id, chapter_number, n, conn)
+    except Exception:
+        conn.close()
+        raise
+    build_stats = result['stats']
+
+    def stats():
+        stats = build_stats()
+        print(f"[KnowledgeGraph] novel={novel_id} chapter={chapter_number} base=None "
+              f"nodes={stats['nodes']} links={stats['links']} streamed build={stats['build_ms']}ms")
+        return stats
+
+    result['stats'] = stats
+    return stream_json(result, on_close=conn.close)
+
+def _resolve_endpoints(graph, prefix_a='source', prefix_b='target'):
+    """从查询参数解析两个节点（优先使用 *_id，其次 *_name），返回节点下标"""
+    a = graph.resolve(request.args.get(f'{prefix_a}_id') or None, request.args.get(f'{prefix_a}_name') or None)
+    b = graph.resolve(request.args.get(f'{prefix_b}_id') or None, request.args.get(f'{prefix_b}_name') or None)
+    return a, b
 
 @bp.route('/<int:novel_id>/chapters/<int:chapter_number>/knowledge_graph/shortest_path', methods=['GET'])
 def get_shortest_path(novel_id, chapter_number):
     """返回两实体之间的最短路径（节点ID列表与路径上的边）。
     支持通过 source_id / target_id 或 source_name / target_name 指定实体。
-    可选参数 n 用于和 `get_knowledge_graph` 保持一致的范围查询。
+    邻接结构按 (novel, chapter) 缓存，路径使用双向 BFS 查找。
+    参数 n（与 get_knowledge_graph 一致的范围）仍然接受以兼容旧客户端；路径只取决于该章的图，n 不影响结果。
     """
-    # 支持和原接口相同的 n 参数
-    n = request.args.get('n', default=1, type=int)
+    graph = graph_query_service.get_graph(novel_id, chapter_number)
+    source, target = _resolve_endpoints(graph)
 
-    settings = setting_service.get_settings_at_chapter(novel_id, chapter_number)
-    if n > 1:
-        changes = setting_service.get_changes_in_range(novel_id, chapter_number, n)
-    else:
-        changes = setting_service.get_chapter_changes(novel_id, chapter_number)
-
-    nodes = []
-    links = []
-
-    for entity in settings.get('entities', []):
-        nodes.append({
-            "id": str(entity['id']),
-            "name": entity['name'],
-            "category": entity['type'],
-            "properties": entity.get('properties', {}),
-        })
-
-    nodes_map = {n['name']: n['id'] for n in nodes}
-    id_to_node = {n['id']: n for n in nodes}
-
-    for rel in settings.get('relationships', []):
-        source_id = nodes_map.get(rel['subject'])
-        target_id = nodes_map.get(rel['object'])
-        if source_id and target_id:
-            links.append({
-                "source": source_id,
-                "target": target_id,
-                "value": rel['relation']
-            })
-
-    # Resolve source/target from query params
-    source_id = request.args.get('source_id') or None
-    target_id = request.args.get('target_id') or None
-    source_name = request.args.get('source_name') or None
-    target_name = request.args.get('target_name') or None
-
-    if not source_id and source_name:
-        source_id = nodes_map.get(source_name)
-    if not target_id and target_name:
-        target_id = nodes_map.get(target_name)
-
-    if not source_id or not target_id:
+    if source is None or target is None:
         return jsonify({"error": "需要指定 source_id/source_name 和 target_id/target_name 中的两项"}), 400
 
-    # 构建邻接表（无向图，用于查找连接路径）
-    adj = {}
-    for n in nodes:
-        adj[n['id']] = set()
-    for l in links:
-        adj[l['source']].add(l['target'])
-        adj[l['target']].add(l['source'])
-
-    # BFS 寻找最短路径
-    from collections import deque
-    q = deque()
-    q.append(source_id)
-    prev = {source_id: None}
-    found = False
-    while q:
-        cur = q.popleft()
-        if cur == target_id:
-            found = True
-            break
-        for nb in adj.get(cur, []):
-            if nb not in prev:
-                prev[nb] = cur
-                q.append(nb)
-
-    if not found:
+    result = graph_query_service.shortest_path(novel_id, chapter_number, source, target)
+    if not result:
         return jsonify({"path_nodes": [], "path_links": [], "message": "未找到连接路径"}), 200
 
-    # 回溯路径
-    path = []
-    cur = target_id
-    while cur is not None:
-        path.append(cur)
-        cur = prev.get(cur)
-    path = list(reversed(path))
-
-    # 从原始 links 中提取路径上的边（保持方向和 relation 名称）
-    link_map = {(l['source'], l['target']): l for l in links}
-    path_edges = []
-    for i in range(len(path) - 1):
-        a = path[i]
-        b = path[i+1]
-        if (a, b) in link_map:
-            path_edges.append(link_map[(a, b)])
-        elif (b, a) in link_map:
-            # 如果只有反向边存在，仍然将其作为连接展示（保留原始方向）
-            path_edges.append(link_map[(b, a)])
-        else:
-            # 没有直接对应关系时，使用占位信息
-            path_edges.append({"source": a, "target": b, "value": None})
+    return jsonify(result)
+
+@bp.route('/<int:novel_id>/chapters/<int:chapter_number>/knowledge_graph/k_shortest_paths', methods=['GET'])
+def get_k_shortest_paths(novel_id, chapter_number):
+    """返回两实体之间的前 k 条无环最短路径（按长度升序）。"""
+    k = request.args.get('k', default=3, type=int)
+    graph = graph_query_service.get_graph(novel_id, chapter_number)
+    source, target = _resolve_endpoints(graph)
+
+    if source is None or target is None:
+        return jsonify({"error": "需要指定 source_id/source_name 和 target_id/target_name 中的两项"}), 400
+
+    paths = graph_query_service.k_shortest_paths(novel_id, chapter_number, source, target, k)
+    return jsonify({"paths": paths})
+
+@bp.route('/<int:novel_id>/chapters/<int:chapter_number>/knowledge_graph/neighborhood', methods=['GET'])
+def get_neighborhood(novel_id, chapter_number):
+    """返回以某实体为中心的 k 跳邻域子图，节点数超过 max_nodes 时截断。"""
+    hops = request.args.get('hops', default=1, type=int)
+    max_nodes = request.args.get('max_nodes', default=200, type=int)
+    graph = graph_query_service.get_graph(novel_id, chapter_number)
+    center = graph.resolve(request.args.get('node_id') or None, request.args.get('name') or None)
+
+    if center is None:
+        return jsonify({"error": "需要指定 node_id 或 name"}), 400
 
+    result = graph_query_service.ego_network(novel_id, chapter_number, center, max(0, hops), max(1, max_nodes))
+    return jsonify(result)
+
+@bp.route('/<int:novel_id>/chapters/<int:chapter_number>/knowledge_graph/analytics', methods=['GET'])
+def get_graph_analytics(novel_id, chapter_number):
+    """返回该章设定图的中心性（PageRank、度数、近似介数）与标签传播社区。
+    可选参数 top 限制返回的节点数（按 PageRank 排序），pivots 为介数近似的采样源点数。
+    """
+    from ..services.graph_analytics_service import graph_analytics_service
+    top = request.args.get('top', default=50, type=int)
+    pivots = request.args.get('pivots', default=graph_analytics_service.DEFAULT_PIVOTS, type=int)
+
+    result = graph_analytics_service.get_analytics(novel_id, chapter_number, max(1, pivots))
     return jsonify({
-        "path_nodes": path,
-        "path_links": path_edges
+        "nodes": result['nodes'][:max(0, top)],
+        "communities": result['communities'],
+        "stats": result['stats']
     })
+
+@bp.route('/<int:novel_id>/knowledge_graph/analytics_series', methods=['GET'])
+def get_graph_analytics_series(novel_id):
+    """返回章节区间内的中心性时间序列（每个采样章节的 PageRank 前 top 实体与社区数量）。"""
+    start = request.args.get('start', type=int)
+    end = request.args.get('end', type=int)
+    step = request.args.get('step', default=1, type=int)
+    top = request.args.get('top', default=10, type=int)
+
+    if not start or not end or start > end or step < 1:
+        return jsonify({"error": "Invalid range"}), 400
+    if (end - start) // step + 1 > MAX_SERIES_POINTS:
+        return jsonify({"error": f"采样章节数不能超过 {MAX_SERIES_POINTS}，请增大 step"}), 400
+
+    from ..services.graph_analytics_service import graph_analytics_service
+    series = graph_analytics_service.get_series(novel_id, start, end, step, max(1, top))
+    return jsonify({"series": series})
+
+@bp.route('/<int:novel_id>/chapters/<int:chapter_number>/knowledge_graph/layout', methods=['GET'])
+def get_graph_layout(novel_id, chapter_number):
+    """返回服务端预计算的节点坐标（力导向布局），用于大图渲染。
+    可选参数 top_k（按度数保留前 k 个节点）与 collapse_leaves（折叠度为 1 的叶子节点）。
+    """
+    top_k = request.args.get('top_k', type=int)
+    collapse_leaves = request.args.get('collapse_leaves', default='0') in ('1', 'true', 'True')
+
+    from ..services.graph_layout_service import graph_layout_service
+    result = graph_layout_service.get_layout_view(novel_id, chapter_number, top_k, collapse_leaves)
+    return jsonify(result)
@@ -1,7 +1,10 @@
 import json
 import random
-from typing import Dict, Any
-from zhipuai import ZhipuAI
+import threading
+import time
+from typing import Any, Dict, Iterator, List
+from app.services.metrics_service import metrics_service
+from app.services.trace_service import trace_service
 
 class AIService:
     """
@@ -17,18 +20,118 @@ class AIService:
         # 随机选择起始索引，后续按轮换(next)策略切换
         self.current_key_index = random.randrange(len(self.api_keys))
         self.model = "glm-4.5-flash"
+        # key 序号 -> 客户端，首次调用模型时才创建
+        self._clients: Dict[int, Any] = {}
+        self._clients_lock = threading.Lock()
+        # 线程固定使用的 key（批量任务的工作线程各占一个 key），未固定时使用 current_key_index
+        self._local = threading.local()
+
+    def pin_key(self, index: int):
+        """当前线程固定使用第 index 个 key（取模），此后该线程的 rotate_key 只切换自己的 key"""
+        self._local.key_index = index % len(self.api_keys)
+
+    def _key_index(self) -> int:
+        index = getattr(self._local, 'key_index', None)
+        return self.current_key_index if index is None else index
 
     def get_client(self):
-        # 使用当前索引对应的 key（轮换池）
-        return ZhipuAI(api_key=self.api_keys[self.current_key_index])
+        """
+        使用当前索引对应的 key（轮换池）。zhipuai SDK 导入较慢（连带 httpx / pydantic），
+        延迟到首次调用模型时导入，不调用模型的进程（worker 启动、CLI、基准测试）无需加载；
+        每个 key 的客户端创建一次后复用（复用其连接池）。
+        """
+        index = self._key_index()
+        client = self._clients.get(index)
+        if client is None:
+            with self._clients_lock:
+                client = self._clients.get(index)
+                if client is None:
+                    from zhipuai import ZhipuAI
+                    client = self._clients[index] = ZhipuAI(api_key=self.api_keys[index])
+        return client
 
     def rotate_key(self):
         """将当前 API key 切换到下一个（循环）并返回新的 key"""
-        old = self.current_key_index
-        self.current_key_index = (self.current_key_index + 1) % len(self.api_keys)
+        old = self._key_index()
+        new = (old + 1) % len(self.api_keys)
+        if getattr(self._local, 'key_index', None) is None:
+            self.current_key_index = new
+        else:
+            self._local.key_index = new
         # 仅打印 key 的前几位以便调试，避免泄露全部 key
-        print(f"  [AIService] Rotate API key: {old} -> {self.current_key_index}, new key prefix: {self.api_keys[self.current_key_index][:8]}...")
-        return self.api_keys[self.current_key_index]
+        print(f"  [AIService] Rotate API key: {old} -> {new}, new key prefix: {self.api_keys[new][:8]}...")
+        return self.api_keys[new]
+
+    def _create_completion(self, operation: str, retry: bool = False, **kwargs):
+        """调用模型并上报耗时、token 用量、重试与所用 key 的序号"""
+        key_index = self._key_index()
+        if retry:
+            trace_service.record('retries')
+        t0 = time.perf_counter()
+        try:
+            response = self.get_client().chat.completions.create(**kwargs)
+        except Exception:
+            metrics_service.observe_ai(operation, time.perf_counter() - t0, key_index, 'error', retry=retry)
+            raise
+        usage = getattr(response, 'usage', None)
+        prompt_tokens = getattr(usage, 'prompt_tokens', 0) or 0
+        completion_tokens = getattr(usage, 'completion_tokens', 0) or 0
+        metrics_service.observe_ai(
+            operation, time.perf_counter() - t0, key_index, 'ok',
+            prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, retry=retry
+        )
+        # 在设定提取过程中时计入本章的提取记录
+        trace_service.record('prompt_tokens', prompt_tokens)
+        trace_service.record('completion_tokens', completion_tokens)
+        return response
+
+    def _open_stream(self, operation: str, retry: bool = False, **kwargs):
+        """以流式模式发起模型调用，返回 (流, 开始时间, key 序号)。请求失败（如并发限制）时在这里抛出"""
+        key_index = self._key_index()
+        if retry:
+            trace_service.record('retries')
+        t0 = time.perf_counter()
+        try:
+            stream = self.get_client().chat.completions.create(stream=True, **kwargs)
+        except Exception:
+            metrics_service.observe_ai(operation, time.perf_counter() - t0, key_index, 'error', retry=retry)
+            raise
+        return stream, t0, key_index
+
+    def _iter_stream(self, operation: str, stream, t0: float, key_index: int, retry: bool = False) -> Iterator[str]:
+        """
+        逐段产出流式响应中的文本。生成器被关闭（客户端断开）时立即断开与模型的连接，模型随之停止生成、不再消耗额度；
+        结束时上报总耗时、首个 token 的延迟与 token 用量（outcome 为 ok / error / cancelled）。
+        """
+        outcome = 'cancelled'
+        prompt_tokens = completion_tokens = 0
+        first_token = False
+        try:
+            for chunk in stream:
+                usage = getattr(chunk, 'usage', None)
+                if usage is not None:
+                    prompt_tokens = getattr(usage, 'prompt_tokens', 0) or 0
+                    completion_tokens = getattr(usage, 'completion_tokens', 0) or 0
+                if not chunk.choices:
+                    continue
+                text = chunk.choices[0].delta.content
+                if text:
+                    if not first_token:
+                        first_token = True
+                        metrics_service.observe_ai_first_token(operation, time.perf_counter() - t0)
+                    yield text
+            outcome = 'ok'
+        except Exception:
+            outcome = 'error'
+            raise
+        finally:
+            response = getattr(stream, 'response', None)
+            if response is not None:
+                response.close()
+            metrics_service.observe_ai(
+                operation, time.perf_counter() - t0, key_index, outcome,
+                prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, retry=retry
+            )
 
     def _is_concurrency_error(self, exc: Exception) -> bool:
         """粗略识别并发限制错误（例如：429 / 1305 / '当前API请求过多'）"""
@@ -44,9 +147,9 @@ class AIService:
         # 构造 Prompt
         # 简化已有设定以节省 Token (仅保留名称和类型，或者关键属性)
         # 这里直接传入完整 JSON，如果太大可能需要截断或摘要
-        existing_json = json.dumps(existing_settings, ensure_ascii=False)
-        
-        prompt = f"""
+        with trace_service.stage('prompt'):
+            existing_json = json.dumps(existing_settings, ensure_ascii=False)
+            prompt = f"""
 你是一位资深的小说设定分析师和知识图谱专家。你的任务是根据“已有设定”和“新章节内容”，增量更新世界观设定。
 
 ### 核心原则
@@ -105,52 +208,57 @@ class AIService:
   ]
 }}
 """
-        # 尝试调用，遇到并发限制时切换 API key 并重试一次
-        try:
-            response = self.get_client().chat.completions.create(
-                model=self.model,
-                thinking={"type":"disabled"},
-                messages=[
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.1, # 低温度以保证输出格式稳定
-                top_p=0.7,
-            )
-        except Exception as e:
-            print(f"  [AIService] 调用失败: {e}")
-            if self._is_concurrency_error(e):
-                print("  [AIService] 并发错误，切换 API Key 并重试一次。")
-                self.rotate_key()
-                try:
-                    response = self.get_client().chat.completions.create(
-                        model=self.model,
-                        thinking={"type":"disabled"},
-                        messages=[
-                            {"role": "user", "content": prompt}
-                        ],
-                        temperature=0.1,
-                        top_p=0.7,
-                    )
-                except Exception as e2:
-                    print(f"  [AIService] 重试失败: {e2}")
-                    raise Exception(f"AI API调用失败，提取终止: {str(e2)}")
-            else:
-                # 非并发错误直接抛出
-                raise Exception(f"AI API调用失败，提取终止: {str(e)}")
+        trace_service.record('prompt_chars', len(prompt))
+
+        with trace_service.stage('model'):
+            # 尝试调用，遇到并发限制时切换 API key 并重试一次
+            try:
+                response = self._create_completion('extract',
+                    model=self.model,
+                    thinking={"type":"disabled"},
+                    messages=[
+                        {"role": "user", "content": prompt}
+                    ],
+                    temperature=0.1, # 低温度以保证输出格式稳定
+                    top_p=0.7,
+                )
+            except Exception as e:
+                print(f"  [AIService] 调用失败: {e}")
+                if self._is_concurrency_error(e):
+                    print("  [AIService] 并发错误，切换 API Key 并重试一次。")
+                    self.rotate_key()
+                    try:
+                        response = self._create_completion('extract', retry=True,
+                            model=self.model,
+                            thinking={"type":"disabled"},
+                            messages=[
+                                {"role": "user", "content": prompt}
+                            ],
+                            temperature=0.1,
+                            top_p=0.7,
+                        )
+                    except Exception as e2:
+                        print(f"  [AIService] 重试失败: {e2}")
+                        raise Exception(f"AI API调用失败，提取终止: {str(e2)}")
+                else:
+                    # 非并发错误直接抛出
+                    raise Exception(f"AI API调用失败，提取终止: {str(e)}")
 
         content = response.choices[0].message.content
-        print(f"  [AIService] Raw Response: {content}") # Debug print
-        
-        # 清理可能的 Markdown 标记
-        content = content.replace("```json", "").replace("```", "").strip()
-        
-        # 尝试清理注释 (简单的行级清理，防止 AI 还是输出了注释)
-        import re
-        # 移除 // 及其后的内容，但要小心 URL (http://...)
-        # 简单起见，只移除行首或空白后的 //
-        content = re.sub(r'\s*//.*', '', content)
-        
-        result = json.loads(content)
+        trace_service.record('response_chars', len(content or ''))
+        with trace_service.stage('parse'):
+            print(f"  [AIService] Raw Response: {content}") # Debug print
+
+            # 清理可能的 Markdown 标记
+            content = content.replace("```json", "").replace("```", "").strip()
+
+            # 尝试清理注释 (简单的行级清理，防止 AI 还是输出了注释)
+            import re
+            # 移除 // 及其后的内容，但要小心 URL (http://...)
+            # 简单起见，只移除行首或空白后的 //
+            content = re.sub(r'\s*//.*', '', content)
+
+            result = json.loads(content)
         print("  [AIService] 分析完成。")
         return result
 
@@ -194,7 +302,7 @@ class AIService:
 如果未发现冲突，返回 {{ "conflicts": [] }}。
 """
         try:
-            response = self.get_client().chat.completions.create(
+            response = self._create_completion('detect_conflicts',
                 model=self.model,
                 thinking={"type":"disabled"},
                 messages=[{"role": "user", "content": prompt}],
@@ -206,7 +314,7 @@ class AIService:
                 print("  [AIService] 并发错误，切换 API Key 并重试一次。")
                 self.rotate_key()
                 try:
-                    response = self.get_client().chat.completions.create(
+                    response = self._create_completion('detect_conflicts', retry=True,
                         model=self.model,
                         thinking={"type":"disabled"},
                         messages=[{"role": "user", "content": prompt}],
@@ -221,10 +329,7 @@ class AIService:
         content = response.choices[0].message.content.replace("```json", "").replace("```", "").strip()
         return json.loads(content)
 
-    def chat_with_context(self, previous_settings: Dict[str, Any], chapter_content: str, user_query: str) -> str:
-        """
-        基于设定和章节内容的 AI 对话。
-        """
+    def _chat_messages(self, previous_settings: Dict[str, Any], chapter_content: str, user_query: str) -> List[Dict[str, str]]:
         existing_json = json.dumps(previous_settings, ensure_ascii=False)
         
         system_prompt = f"""
@@ -238,14 +343,21 @@ class AIService:
 
 请基于以上信息回答用户的问题。如果信息不足，请如实告知。回答要简洁明了。
 """
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_query}
+        ]
+
+    def chat_with_context(self, previous_settings: Dict[str, Any], chapter_content: str, user_query: str) -> str:
+        """
+        基于设定和章节内容的 AI 对话。
+        """
+        messages = self._chat_messages(previous_settings, chapter_content, user_query)
         try:
-            response = self.get_client().chat.completions.create(
+            response = self._create_completion('chat',
                 model=self.model,
                 thinking={"type":"disabled"},
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_query}
-                ],
+                messages=messages,
                 temperature=0.7,
             )
         except Exception as e:
@@ -253,13 +365,10 @@ class AIService:
                 print(f"  [AIService] chat 调用并发错误: {e} ，切换 API Key 并重试一次。")
                 self.rotate_key()
                 try:
-                    response = self.get_client().chat.completions.create(
+                    response = self._create_completion('chat', retry=True,
                         model=self.model,
                         thinking={"type":"disabled"},
-                        messages=[
-                            {"role": "system", "content": system_prompt},
-                            {"role": "user", "content": user_query}
-                        ],
+                        messages=messages,
                         temperature=0.7,
                     )
                 except Exception as e2:
@@ -269,5 +378,29 @@ class AIService:
 
         return response.choices[0].message.content
 
+    def stream_chat_with_context(self, previous_settings: Dict[str, Any], chapter_content: str, user_query: str) -> Iterator[str]:
+        """
+        流式 AI 对话：逐段产出模型生成的文本，首段文本到达即可展示。
+        遇到并发限制时切换 API Key 重试一次（只在开始输出之前）；其它错误直接抛出。
+        关闭生成器即取消本次生成。
+        """
+        kwargs = dict(
+            model=self.model,
+            thinking={"type":"disabled"},
+            messages=self._chat_messages(previous_settings, chapter_content, user_query),
+            temperature=0.7,
+        )
+        retry = False
+        try:
+            stream, t0, key_index = self._open_stream('chat', **kwargs)
+        except Exception as e:
+            if not self._is_concurrency_error(e):
+                raise
+            print(f"  [AIService] chat 流式调用并发错误: {e} ，切换 API Key 并重试一次。")
+            self.rotate_key()
+            retry = True
+            stream, t0, key_index = self._open_stream('chat', retry=True, **kwargs)
+        yield from self._iter_stream('chat', stream, t0, key_index, retry=retry)
+
 # 单例实例
 ai_service = AIService()
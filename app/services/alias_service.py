@@ -0,0 +1,142 @@
+import re
+import threading
+from typing import Any, Dict, List, Set, Iterable, Optional, Tuple
+from app.services import db_service
+from app.services.cache_service import cache_service
+
+# 别名属性值中常见的分隔符
+ALIAS_SPLIT_RE = re.compile(r'[,，、;；/|]')
+
+def split_aliases(value: Optional[str]) -> List[str]:
+    """把 `别名` 属性值拆分为别名列表（去重并保持顺序）"""
+    if not value:
+        return []
+    aliases = []
+    for alias in ALIAS_SPLIT_RE.split(value):
+        alias = alias.strip()
+        if alias and alias not in aliases:
+            aliases.append(alias)
+    return aliases
+
+
+def alias_value(value: Any) -> str:
+    """把模型返回的 `别名` 属性值规范为字符串：列表按 ', ' 连接（而不是序列化为 JSON），其余转为字符串"""
+    if isinstance(value, (list, tuple)):
+        return ', '.join(str(v) for v in value)
+    return str(value)
+
+
+class AliasResolver:
+    """
+    单本小说当前有效实体的 名称/别名 -> 实体 ID 映射。
+    规范名称优先于别名；同一别名属于多个实体时视为有歧义，不做解析。
+    """
+    def __init__(self):
+        self.names: Dict[str, int] = {}                # 规范名称 -> 实体 ID
+        self.entity_names: Dict[int, str] = {}         # 实体 ID -> 规范名称
+        self.aliases: Dict[str, Set[int]] = {}         # 别名 -> 实体 ID 集合
+        self.entity_aliases: Dict[int, Set[str]] = {}  # 实体 ID -> 别名集合
+
+    def add_entity(self, entity_id: int, name: str):
+        # 同名实体保留先创建的一个，与按名称查询取第一行的行为一致
+        self.names.setdefault(name, entity_id)
+        self.entity_names[entity_id] = name
+
+    def set_aliases(self, entity_id: int, aliases: Iterable[str]):
+        """替换实体的别名集合（规范名称本身不作为别名）"""
+        new_aliases = {a for a in aliases if a and a != self.entity_names.get(entity_id)}
+        for alias in self.entity_aliases.get(entity_id, set()) - new_aliases:
+            owners = self.aliases.get(alias)
+            if owners:
+                owners.discard(entity_id)
+                if not owners:
+                    del self.aliases[alias]
+        for alias in new_aliases:
+            self.aliases.setdefault(alias, set()).add(entity_id)
+        self.entity_aliases[entity_id] = new_aliases
+
+    def resolve(self, name: Optional[str]) -> Optional[int]:
+        if not name:
+            return None
+        entity_id = self.names.get(name)
+        if entity_id is not None:
+            return entity_id
+        owners = self.aliases.get(name)
+        if owners and len(owners) == 1:
+            return next(iter(owners))
+        return None
+
+    def canonical(self, name: Optional[str]) -> Optional[str]:
+        """返回名称或别名对应的规范名称，无法解析时原样返回"""
+        entity_id = self.resolve(name)
+        return self.entity_names[entity_id] if entity_id is not None else name
+
+
+class AliasService:
+    """
+    别名解析服务。别名以区间形式存放在 entity_aliases 表中（与 `别名` 属性的版本区间一致），
+    并按小说在内存中维护当前有效实体的解析器，供设定提取时以 O(1) 把别名归并到已有实体。
+    解析器记录其对应的写入代数：提取过程中增量更新并在完成后同步代数，
+    回滚等其它写操作导致代数不一致时在下次使用时整体重建。
+    """
+    def __init__(self):
+        self._resolvers: Dict[int, Tuple[int, AliasResolver]] = {}
+        self._lock = threading.Lock()
+
+    def _build(self, novel_id: int) -> AliasResolver:
+        resolver = AliasResolver()
+        for row in db_service.execute_query(
+            "SELECT id, name FROM entities WHERE novel_id = ? AND end_chapter_id IS NULL ORDER BY id",
+            (novel_id,)
+        ):
+            resolver.add_entity(row['id'], row['name'])
+
+        aliases: Dict[int, List[str]] = {}
+        for row in db_service.execute_query(
+            "SELECT entity_id, alias FROM entity_aliases WHERE novel_id = ? AND end_chapter_id IS NULL",
+            (novel_id,)
+        ):
+            if row['entity_id'] in resolver.entity_names:
+                aliases.setdefault(row['entity_id'], []).append(row['alias'])
+        for entity_id, names in aliases.items():
+            resolver.set_aliases(entity_id, names)
+        return resolver
+
+    def get_resolver(self, novel_id: int) -> AliasResolver:
+        generation = cache_service.get_generation(novel_id)
+        with self._lock:
+            cached = self._resolvers.get(novel_id)
+            if cached and cached[0] == generation:
+                return cached[1]
+        resolver = self._build(novel_id)
+        with self._lock:
+            self._resolvers[novel_id] = (generation, resolver)
+        return resolver
+
+    def adopt(self, novel_id: int, resolver: AliasResolver):
+        """写操作完成后，将已增量更新的解析器标记为最新代数"""
+        with self._lock:
+            self._resolvers[novel_id] = (cache_service.get_generation(novel_id), resolver)
+
+    def invalidate(self, novel_id: int):
+        with self._lock:
+            self._resolvers.pop(novel_id, None)
+
+    def alias_operations(self, novel_id: int, entity_id: int, aliases: Iterable[str], chapter_id: int) -> List[Dict]:
+        """
+        生成 `别名` 属性变更对应的 entity_aliases 写操作（供 execute_transaction 使用）：
+        先结束该实体当前有效的别名，再插入新别名。aliases 为空即表示别名失效。
+        """
+        operations = [{
+            "query": "UPDATE entity_aliases SET end_chapter_id = ? WHERE entity_id = ? AND end_chapter_id IS NULL",
+            "params": (chapter_id, entity_id)
+        }]
+        for alias in aliases:
+            operations.append({
+                "query": "INSERT INTO entity_aliases (novel_id, entity_id, alias, start_chapter_id) VALUES (?, ?, ?, ?)",
+                "params": (novel_id, entity_id, alias, chapter_id)
+            })
+        return operations
+
+# 单例
+alias_service = AliasService()
@@ -0,0 +1,82 @@
+import threading
+from typing import Dict, Tuple
+from app.services import db_service
+
+class CacheService:
+    """
+    进程内缓存的失效协调：为每本小说维护一个写入代数（generation）。
+    任何修改小说设定或章节的操作都需要调用 bump_generation，
+    各类缓存在读取时比较代数，不一致即视为失效。
+    代数分两类（kind）：novel 为小说的任意写入（设定或章节），
+    chapters 为章节记录（含冲突检测结果）的变化，由章节缓存使用。
+
+    代数保存在数据库的 cache_generations 表中，多个 worker 进程共享：一个进程写入后，
+    其它进程的缓存与 ETag 随之失效。每个线程保持一个只用于读取代数的连接，借助
+    PRAGMA data_version（其它连接提交后才会变化）判断是否需要重新读表，数据库没有新的提交时
+    get_generation 只执行这一条 PRAGMA。
+    """
+    def __init__(self):
+        self._generations: Dict[Tuple[int, str], int] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _connection(self):
+        local = self._local
+        if getattr(local, 'db_path', None) != db_service.DB_PATH:
+            if getattr(local, 'conn', None) is not None:
+                local.conn.close()
+            local.conn = db_service.get_db_connection()
+            local.db_path = db_service.DB_PATH
+            local.data_version = None
+        return local.conn
+
+    def _sync(self):
+        conn = self._connection()
+        version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if version == self._local.data_version:
+            return
+        rows = conn.execute("SELECT novel_id, kind, generation FROM cache_generations").fetchall()
+        with self._lock:
+            # 代数只增不减：并发线程读到的旧快照不会覆盖较新的值
+            for novel_id, kind, generation in rows:
+                key = (novel_id, kind)
+                if generation > self._generations.get(key, 0):
+                    self._generations[key] = generation
+        self._local.data_version = version
+
+    def get_generation(self, novel_id: int, kind: str = 'novel') -> int:
+        self._sync()
+        return self._generations.get((novel_id, kind), 0)
+
+    def bump_generation(self, novel_id: int, kind: str = 'novel') -> int:
+        """递增写入代数并返回新的代数，调用方应在写入提交之后调用"""
+        conn = self._connection()
+        try:
+            conn.execute(
+                "INSERT INTO cache_generations (novel_id, kind, generation) VALUES (?, ?, 1) "
+                "ON CONFLICT (novel_id, kind) DO UPDATE SET generation = generation + 1",
+                (novel_id, kind)
+            )
+            generation = conn.execute(
+                "SELECT generation FROM cache_generations WHERE novel_id = ? AND kind = ?", (novel_id, kind)
+            ).fetchone()[0]
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        with self._lock:
+            if generation > self._generations.get((novel_id, kind), 0):
+                self._generations[(novel_id, kind)] = generation
+        return generation
+
+    def reset(self):
+        """丢弃当前线程的连接与本进程已读到的代数（预加载应用的 worker 在 fork 后调用）"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+        self._local = threading.local()
+        with self._lock:
+            self._generations = {}
+
+# 单例
+cache_service = CacheService()
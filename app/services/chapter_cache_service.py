@@ -0,0 +1,131 @@
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+from app.services import db_service
+from app.services.cache_service import cache_service
+
+# 章节缓存的内存上限（按估算的对象字节数计）
+CHAPTER_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+def _estimate_size(value: Any) -> int:
+    """估算缓存对象占用的字节数：字典按键值逐个累加，其它对象取 sys.getsizeof"""
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(sys.getsizeof(k) + _estimate_size(v) for k, v in value.items())
+    return sys.getsizeof(value)
+
+
+class ChapterCacheService:
+    """
+    进程内的章节 LRU 缓存，按估算字节数限制总大小，缓存两类数据：
+    - ('ids', novel_id)：整本小说的 章号 -> 章节 ID 映射，一次查询载入；
+    - ('chapter', novel_id, number)：单章记录（含解压后的正文与冲突检测结果）。
+    章节导入、删除与冲突结果更新时由 chapter_service 调用 invalidate_* 失效，
+    设定提取等不改动章节的写操作不影响本缓存。
+    失效时递增该小说的 chapters 写入代数（cache_service，多进程共享），条目记录载入时的代数，
+    读取时代数不一致即丢弃，因此其它 worker 进程中的失效同样生效。
+    """
+    def __init__(self, max_bytes: int = CHAPTER_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        # 键 -> (值, 估算字节数, 载入时的 chapters 代数)
+        self._entries: "OrderedDict[Tuple, Tuple[Any, int, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def _get(self, key: Tuple) -> Tuple[bool, Any]:
+        epoch = self._epoch(key[1])
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] != epoch:
+                # 已被（可能是其它进程中的）失效操作作废
+                self._entries.pop(key)
+                self._bytes -= entry[1]
+                self._stats["invalidations"] += 1
+                entry = None
+            if entry is None:
+                self._stats["misses"] += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return True, entry[0]
+
+    def _epoch(self, novel_id: int) -> int:
+        return cache_service.get_generation(novel_id, 'chapters')
+
+    def _put(self, key: Tuple, value: Any, epoch: int):
+        size = _estimate_size(value)
+        if size > self.max_bytes:
+            return
+        # 加载期间发生失效时丢弃加载结果，避免把旧数据写回缓存
+        if self._epoch(key[1]) != epoch:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (value, size, epoch)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self._stats["evictions"] += 1
+
+    def _load_chapter_ids(self, novel_id: int) -> Dict[int, int]:
+        rows = db_service.execute_query("SELECT id, number FROM chapters WHERE novel_id = ?", (novel_id,))
+        return {row['number']: row['id'] for row in rows}
+
+    def get_chapter_id(self, novel_id: int, chapter_number: int) -> Optional[int]:
+        """章号对应的章节 ID，不存在时返回 None"""
+        key = ('ids', novel_id)
+        found, ids = self._get(key)
+        if not found:
+            epoch = self._epoch(novel_id)
+            ids = self._load_chapter_ids(novel_id)
+            self._put(key, ids, epoch)
+        return ids.get(chapter_number)
+
+    def get_chapter(self, novel_id: int, chapter_number: int, loader: Callable[[], Optional[Dict]]) -> Optional[Dict]:
+        """
+        读取单章记录，未命中时调用 loader 从数据库加载。不存在的章节不缓存。
+        返回副本，调用方修改结果不会影响缓存。
+        """
+        key = ('chapter', novel_id, chapter_number)
+        found, chapter = self._get(key)
+        if not found:
+            epoch = self._epoch(novel_id)
+            chapter = loader()
+            if chapter is None:
+                return None
+            self._put(key, chapter, epoch)
+        return dict(chapter)
+
+    def invalidate_chapter(self, novel_id: int, chapter_number: int):
+        """单章记录变化后调用。代数按小说递增，其它进程中该小说的章节缓存会整体失效"""
+        self._discard(novel_id, lambda key: key == ('chapter', novel_id, chapter_number))
+
+    def invalidate_novel(self, novel_id: int):
+        """章节导入、删除或小说删除后，清除该小说的全部章节缓存"""
+        self._discard(novel_id, lambda key: key[1] == novel_id)
+
+    def _discard(self, novel_id: int, predicate: Callable[[Tuple], bool]):
+        cache_service.bump_generation(novel_id, 'chapters')
+        with self._lock:
+            for key in [k for k in self._entries if predicate(k)]:
+                _, size, _ = self._entries.pop(key)
+                self._bytes -= size
+                self._stats["invalidations"] += 1
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "hit_rate": round(self._stats["hits"] / lookups, 4) if lookups else None,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes
+            }
+
+# 单例
+chapter_cache_service = ChapterCacheService()
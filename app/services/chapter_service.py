@@ -1,6 +1,46 @@
-from typing import List, Dict, Optional
+import html
+import json
+import re
+import time
+from typing import Any, Callable, List, Dict, Optional, Iterator, Tuple
 from app.services import db_service
 from app.services.setting_service import setting_service
+from app.services.alias_service import alias_service
+from app.services.cache_service import cache_service
+from app.services.chapter_cache_service import chapter_cache_service
+
+# 全文检索片段中的高亮标记（控制字符，不会出现在正文中，渲染时替换为 <mark>）
+SNIPPET_OPEN = '\x02'
+SNIPPET_CLOSE = '\x03'
+
+# 冲突描述 conflicting_setting 形如 “张三: 等级=10” 或 “张三-李四: 师徒”，冒号前为涉及的实体
+CONFLICT_SETTING_HEAD_RE = re.compile(r'[:：]')
+CONFLICT_ENTITY_SPLIT_RE = re.compile(r'\s*[-—–→/、]\s*')
+
+def conflict_rows(result: Dict, canonical: Callable[[str], str]) -> List[Tuple]:
+    """
+    把一章的冲突检测结果拆成 conflicts 表的行 (start_chapter, entity, conflicting_setting, description, original_text)。
+    实体取 conflicting_setting 冒号前的第一个名称，经 canonical（别名解析）归并为规范名称；没有冒号时为 NULL。
+    """
+    rows = []
+    for conflict in (result or {}).get('conflicts') or []:
+        if not isinstance(conflict, dict):
+            continue
+        setting = str(conflict.get('conflicting_setting') or '')
+        entity = None
+        parts = CONFLICT_SETTING_HEAD_RE.split(setting, 1)
+        if len(parts) == 2:
+            names = [name for name in CONFLICT_ENTITY_SPLIT_RE.split(parts[0].strip()) if name]
+            if names:
+                entity = canonical(names[0])
+        start_chapter = conflict.get('start_chapter')
+        try:
+            start_chapter = int(start_chapter) if start_chapter is not None else None
+        except (TypeError, ValueError):
+            start_chapter = None
+        rows.append((start_chapter, entity, setting or None, conflict.get('description'), conflict.get('original_text')))
+    return rows
+
 
 class ChapterService:
     def batch_import_chapters(self, novel_id: int, chapters_data: List[Dict]) -> Dict:
@@ -9,13 +49,25 @@ class ChapterService:
             # Check if exists (simple check, can be improved)
             # For batch import, we might want to ignore duplicates or update
             # Here we assume simple insert
+            content = chapter.get('content') or ''
+            codec, data = db_service.encode_content(content)
             operations.append({
-                "query": "INSERT INTO chapters (novel_id, number, title, content) VALUES (?, ?, ?, ?)",
-                "params": (novel_id, chapter['number'], chapter['title'], chapter['content'])
+                "query": "INSERT INTO chapters (novel_id, number, title) VALUES (?, ?, ?)",
+                "params": (novel_id, chapter['number'], chapter['title'])
+            })
+            # 正文压缩后单独存放，元数据查询不会读到正文
+            operations.append({
+                "query": """
+                    INSERT INTO chapter_contents (chapter_id, codec, data, char_count, raw_bytes)
+                    SELECT id, ?, ?, ?, ? FROM chapters WHERE novel_id = ? AND number = ?
+                """,
+                "params": (codec, data, len(content), len(content.encode('utf-8')), novel_id, chapter['number'])
             })
         
         try:
             db_service.execute_transaction(operations)
+            cache_service.bump_generation(novel_id)
+            chapter_cache_service.invalidate_novel(novel_id)
             return {"success_count": len(chapters_data), "errors": []}
         except Exception as e:
             return {"success_count": 0, "errors": [str(e)]}
@@ -23,21 +75,207 @@ class ChapterService:
     def get_chapters(self, novel_id: int) -> List[Dict]:
         return db_service.execute_query("SELECT id, number, title FROM chapters WHERE novel_id = ? ORDER BY number", (novel_id,))
 
+    def iter_chapters(self, novel_id: int) -> Iterator[Dict]:
+        """逐行读取章节列表，用于流式输出"""
+        return db_service.iter_query("SELECT id, number, title FROM chapters WHERE novel_id = ? ORDER BY number", (novel_id,))
+
     def get_chapter_content(self, novel_id: int, chapter_number: int) -> Optional[Dict]:
+        """
+        读取章节（含正文）。正文只在这里按需解压，结果经章节缓存复用。
+        """
+        return chapter_cache_service.get_chapter(
+            novel_id, chapter_number, lambda: self._load_chapter(novel_id, chapter_number)
+        )
+
+    def _load_chapter(self, novel_id: int, chapter_number: int) -> Optional[Dict]:
         chapters = db_service.execute_query(
-            "SELECT * FROM chapters WHERE novel_id = ? AND number = ?", 
+            """
+            SELECT c.*, cc.codec, cc.data FROM chapters c
+            LEFT JOIN chapter_contents cc ON cc.chapter_id = c.id
+            WHERE c.novel_id = ? AND c.number = ?
+            """,
             (novel_id, chapter_number)
         )
-        return chapters[0] if chapters else None
+        if not chapters:
+            return None
+        chapter = chapters[0]
+        chapter['content'] = db_service.decode_content(chapter.pop('codec'), chapter.pop('data'))
+        return chapter
+
+    def get_storage_report(self, novel_id: int, sample_size: int = 20) -> Dict:
+        """
+        章节正文的存储统计：原文与压缩后字节数、节省比例，以及抽样测得的单章解压耗时。
+        """
+        stats = db_service.execute_query(
+            """
+            SELECT COUNT(*) AS chapters, COALESCE(SUM(cc.char_count), 0) AS chars,
+                   COALESCE(SUM(cc.raw_bytes), 0) AS raw_bytes, COALESCE(SUM(LENGTH(cc.data)), 0) AS stored_bytes
+            FROM chapter_contents cc JOIN chapters c ON cc.chapter_id = c.id
+            WHERE c.novel_id = ?
+            """,
+            (novel_id,)
+        )[0]
+        samples = db_service.execute_query(
+            """
+            SELECT cc.codec, cc.data FROM chapter_contents cc JOIN chapters c ON cc.chapter_id = c.id
+            WHERE c.novel_id = ? ORDER BY c.number LIMIT ?
+            """,
+            (novel_id, sample_size)
+        )
+        decode_ms = []
+        for row in samples:
+            t0 = time.perf_counter()
+            db_service.decode_content(row['codec'], row['data'])
+            decode_ms.append((time.perf_counter() - t0) * 1000)
+
+        raw_bytes, stored_bytes = stats['raw_bytes'], stats['stored_bytes']
+        return {
+            **stats,
+            "saved_bytes": raw_bytes - stored_bytes,
+            "compression_ratio": round(stored_bytes / raw_bytes, 4) if raw_bytes else None,
+            "decode_ms_avg": round(sum(decode_ms) / len(decode_ms), 4) if decode_ms else None,
+            "decode_ms_max": round(max(decode_ms), 4) if decode_ms else None,
+            "decode_samples": len(decode_ms)
+        }
 
     def update_conflict_result(self, novel_id: int, chapter_number: int, result: Dict) -> bool:
-        import json
-        result_json = json.dumps(result, ensure_ascii=False)
-        count = db_service.execute_commit(
-            "UPDATE chapters SET conflict_result = ? WHERE novel_id = ? AND number = ?",
-            (result_json, novel_id, chapter_number)
+        """
+        保存一章的冲突检测结果：原始结果写入 chapters.conflict_result（章节内容接口原样返回），
+        各条冲突同时拆分写入 conflicts 表（替换该章原有的行），供按实体、引用章节等条件查询。
+        """
+        chapter_id = chapter_cache_service.get_chapter_id(novel_id, chapter_number)
+        if chapter_id is None:
+            return False
+        canonical = alias_service.get_resolver(novel_id).canonical
+        operations = [
+            {"query": "UPDATE chapters SET conflict_result = ? WHERE id = ?",
+             "params": (json.dumps(result, ensure_ascii=False), chapter_id)},
+            {"query": "DELETE FROM conflicts WHERE chapter_id = ?", "params": (chapter_id,)}
+        ]
+        for row in conflict_rows(result, canonical):
+            operations.append({
+                "query": "INSERT INTO conflicts (novel_id, chapter_id, chapter_number, start_chapter, entity, "
+                         "conflicting_setting, description, original_text) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                "params": (novel_id, chapter_id, chapter_number, *row)
+            })
+        db_service.execute_transaction(operations)
+        chapter_cache_service.invalidate_chapter(novel_id, chapter_number)
+        return True
+
+    def query_conflicts(self, novel_id: int, entity: Optional[str] = None, start_chapter: Optional[int] = None,
+                        chapter_from: Optional[int] = None, chapter_to: Optional[int] = None,
+                        limit: int = 50, offset: int = 0) -> Dict[str, Any]:
+        """
+        按条件分页查询已保存的冲突（按章号、检测结果中的顺序排列）：
+        entity 为涉及的实体（名称或别名），start_chapter 为冲突引用的设定最早出现的章节，
+        chapter_from / chapter_to 为发现冲突的章节范围。各条件均走 conflicts 表的索引。
+        """
+        conditions, params = ["novel_id = ?"], [novel_id]
+        if entity:
+            conditions.append("entity = ?")
+            params.append(alias_service.get_resolver(novel_id).canonical(entity))
+        if start_chapter is not None:
+            conditions.append("start_chapter = ?")
+            params.append(start_chapter)
+        if chapter_from is not None:
+            conditions.append("chapter_number >= ?")
+            params.append(chapter_from)
+        if chapter_to is not None:
+            conditions.append("chapter_number <= ?")
+            params.append(chapter_to)
+        where = ' AND '.join(conditions)
+        total = db_service.execute_query(f"SELECT COUNT(*) AS total FROM conflicts WHERE {where}", tuple(params))[0]['total']
+        rows = db_service.execute_query(
+            f"""
+            SELECT id, chapter_number, start_chapter, entity, conflicting_setting, description, original_text
+            FROM conflicts WHERE {where}
+            ORDER BY chapter_number, id
+            LIMIT ? OFFSET ?
+            """,
+            (*params, limit, offset)
         )
-        return count > 0
+        return {"total": total, "conflicts": rows}
+
+    def search_chapter_content(self, novel_id: int, query: str, limit: int = 20, offset: int = 0) -> Dict:
+        """
+        全文检索章节标题与正文，按 bm25 相关度排序，返回章节号与高亮片段。
+        使用 chapters_fts（FTS5 trigram）索引；trigram 至少需要 3 个字符，
+        更短的查询或不支持 FTS5 时退化为逐章 LIKE 扫描。
+        """
+        query = (query or '').strip()
+        if not query:
+            return {"total": 0, "hits": []}
+
+        terms = query.split()
+        use_fts = all(len(t) >= 3 for t in terms) and db_service.execute_query(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name='chapters_fts'"
+        )
+
+        if use_fts:
+            # 每个词作为短语（双引号转义），多个词之间为 AND。
+            # CROSS JOIN 固定由全文索引驱动连接，避免规划器先扫描整本小说的章节再逐行匹配
+            match = ' '.join('"' + t.replace('"', '""') + '"' for t in terms)
+            total = db_service.execute_query(
+                """
+                SELECT COUNT(*) AS total FROM chapters_fts
+                CROSS JOIN chapters c ON c.id = chapters_fts.rowid
+                WHERE chapters_fts MATCH ? AND c.novel_id = ?
+                """,
+                (match, novel_id)
+            )[0]['total']
+            rows = db_service.execute_query(
+                f"""
+                SELECT c.number, c.title,
+                       snippet(chapters_fts, 1, '{SNIPPET_OPEN}', '{SNIPPET_CLOSE}', '…', 24) AS snippet,
+                       bm25(chapters_fts, 10.0, 1.0) AS score
+                FROM chapters_fts
+                CROSS JOIN chapters c ON c.id = chapters_fts.rowid
+                WHERE chapters_fts MATCH ? AND c.novel_id = ?
+                ORDER BY score
+                LIMIT ? OFFSET ?
+                """,
+                (match, novel_id, limit, offset)
+            )
+        else:
+            conditions = ' AND '.join("(instr(title, ?) > 0 OR instr(content, ?) > 0)" for _ in terms)
+            params = [p for t in terms for p in (t, t)]
+            # 逐章扫描需要解压全部正文，仅用于短查询
+            total = db_service.execute_query(
+                f"SELECT COUNT(*) AS total FROM chapter_texts WHERE novel_id = ? AND {conditions}",
+                (novel_id, *params)
+            )[0]['total']
+            rows = db_service.execute_query(
+                f"""
+                SELECT number, title, content, 0 AS score FROM chapter_texts
+                WHERE novel_id = ? AND {conditions}
+                ORDER BY number LIMIT ? OFFSET ?
+                """,
+                (novel_id, *params, limit, offset)
+            )
+            for row in rows:
+                row['snippet'] = self._make_snippet(row.pop('content') or '', terms[0])
+
+        hits = [{
+            "chapter_number": row['number'],
+            "title": row['title'],
+            "snippet": self._render_snippet(row['snippet'] or ''),
+            "score": round(-row['score'], 4)
+        } for row in rows]
+        return {"total": total, "hits": hits}
+
+    def _make_snippet(self, content: str, term: str, width: int = 24) -> str:
+        """逐章扫描时的片段截取，标记方式与 FTS5 snippet() 一致"""
+        pos = content.find(term)
+        if pos < 0:
+            return content[:width * 2]
+        start = max(0, pos - width)
+        end = min(len(content), pos + len(term) + width)
+        return ('…' if start > 0 else '') + content[start:pos] + SNIPPET_OPEN + term + SNIPPET_CLOSE \
+            + content[pos + len(term):end] + ('…' if end < len(content) else '')
+
+    def _render_snippet(self, snippet: str) -> str:
+        """对片段做 HTML 转义，再把高亮标记替换为 <mark> 标签"""
+        return html.escape(snippet).replace(SNIPPET_OPEN, '<mark>').replace(SNIPPET_CLOSE, '</mark>')
 
     def get_latest_chapter(self, novel_id: int) -> Optional[Dict]:
         chapters = db_service.execute_query(
@@ -70,14 +308,14 @@ class ChapterService:
         
         # 2. Update end_chapter_id to NULL for records ending in these chapters
         # This "reopens" entities/relations that were closed in the deleted chapters
-        for table in ['relationships', 'properties', 'entities']:
+        for table in ['relationships', 'entity_aliases', 'properties', 'entities']:
             operations.append({
                 "query": f"UPDATE {table} SET end_chapter_id = NULL WHERE end_chapter_id IN ({placeholders})",
                 "params": tuple(chapter_ids)
             })
             
         # 3. Delete records created in these chapters
-        for table in ['relationships', 'properties', 'entities']:
+        for table in ['relationships', 'entity_aliases', 'properties', 'entities']:
             operations.append({
                 "query": f"DELETE FROM {table} WHERE start_chapter_id IN ({placeholders})",
                 "params": tuple(chapter_ids)
@@ -90,6 +328,8 @@ class ChapterService:
         })
         
         db_service.execute_transaction(operations)
+        cache_service.bump_generation(novel_id)
+        chapter_cache_service.invalidate_novel(novel_id)
         return len(chapter_ids)
 
     def import_from_local_file(self, novel_id: int, start_num: int, end_num: int) -> Dict:
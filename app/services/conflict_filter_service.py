@@ -0,0 +1,371 @@
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple
+import numpy as np
+from app.services import db_service
+from app.services.ai_service import ai_service
+from app.services.alias_service import split_aliases
+from app.services.cache_service import cache_service
+from app.services.metrics_service import metrics_service
+
+# 判定实体已死亡的 `状态` 属性值（排除假死、复活等）
+DEATH_WORDS = ('死', '亡', '身故', '陨落', '去世', '牺牲', '遇害', '殒')
+NOT_DEATH_WORDS = ('假死', '未死', '不死', '诈死', '复活', '死里逃生')
+# 已死亡实体出现在这些词附近时视为回忆、祭奠等正常提及
+MEMORIAL_WORDS = ('回忆', '想起', '记得', '怀念', '遗体', '尸', '墓', '坟', '灵位', '牌位', '生前', '亡魂', '鬼魂',
+                  '祭', '悼', '梦')
+GENDER_KEYS = ('性别',)
+LOCATION_KEYS = ('所在地', '位置', '所在', '居住地', '住处')
+# 地点前的这些词表示人物此时身处该地
+LOCATIVE_WORDS = ('在', '于', '到', '至', '抵达', '来到', '回到', '身处', '位于', '进入', '赶往')
+# 人称代词：排除 “其他” 与 “他们 / 她们 / 他人”
+PRONOUN_RE = re.compile(r'(?<!其)[他她](?![们人])')
+
+MEMORIAL_WINDOW = 20     # 回忆类词语与实体提及的最大距离（字符）
+PRONOUN_WINDOW = 30      # 提及之后、下一个非地点实体提及之前的代词视为指代该实体
+LOCATION_WINDOW = 30     # 人物提及之后该范围内的地点视为其所在地
+MIN_TERM_CHARS = 2       # 单字名称 / 别名误匹配过多，不参与匹配
+AUTOMATON_CACHE_SIZE = 8
+
+MALE, FEMALE = 1, 2
+
+
+class NameAutomaton:
+    """
+    名称 / 别名的 Aho-Corasick 自动机：一次扫描正文即可找出全部检索词，耗时与检索词数量无关。
+    自动机只保存检索词本身，查询时由调用方给出 检索词 -> 实体名称，
+    因此整本小说的名称构造一次后可用于任意章节的快照（只保留快照中仍有效的检索词）。
+    """
+    def __init__(self, terms: Iterable[str]):
+        self.terms = frozenset(terms)
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[int]] = [[]]   # 节点 -> 以该节点结尾的检索词长度
+        for term in self.terms:
+            node = 0
+            for char in term:
+                nxt = self._goto[node].get(char)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[node][char] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                node = nxt
+            self._out[node].append(len(term))
+        # 按层构造失败指针，输出沿失败链合并
+        queue = list(self._goto[0].values())
+        for node in queue:
+            for char, nxt in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(char, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+                queue.append(nxt)
+
+    def find(self, text: str, names: Dict[str, str]) -> List[Tuple[int, int, str]]:
+        """
+        返回 names（检索词 -> 实体名称）中检索词的提及 (起点, 终点, 实体名称)，按起点排列。
+        重叠的提及取最左最长（“张三丰” 不会同时匹配 “张三”）。
+        """
+        goto, fail, out = self._goto, self._fail, self._out
+        matches = []
+        node = 0
+        for i, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for length in out[node]:
+                name = names.get(text[i + 1 - length:i + 1])
+                if name is not None:
+                    matches.append((i + 1 - length, i + 1, name))
+        matches.sort(key=lambda m: (m[0], -m[1]))
+        mentions, last_end = [], 0
+        for start, end, name in matches:
+            if start >= last_end:
+                mentions.append((start, end, name))
+                last_end = end
+        return mentions
+
+
+def _positions(text: str, words: Tuple[str, ...]) -> np.ndarray:
+    found = [m.start() for m in re.finditer('|'.join(map(re.escape, words)), text)]
+    return np.asarray(found, dtype=np.int64)
+
+
+def _first_at_or_after(positions: np.ndarray, points: np.ndarray) -> np.ndarray:
+    """对每个 point 取 positions 中第一个 >= point 的值，没有时为 +inf（向量化）"""
+    if not len(positions):
+        return np.full(len(points), np.inf)
+    index = np.searchsorted(positions, points)
+    padded = np.append(positions.astype(float), np.inf)
+    return padded[index]
+
+
+def _is_dead(status: Optional[str]) -> bool:
+    if not status or any(word in status for word in NOT_DEATH_WORDS):
+        return False
+    return any(word in status for word in DEATH_WORDS)
+
+
+class ConflictFilterService:
+    """
+    冲突检测的本地预筛：模型检测前先用规则找出本章可能与设定矛盾的实体（候选），
+    没有候选的章节不调用模型，直接记为无冲突。规则只覆盖最常见、可在本地判断的三类矛盾：
+    - dead_entity：`状态` 为死亡的实体在正文中出现（附近有回忆、祭奠等词语时除外）；
+    - pronoun_gender：提及之后紧接的代词（他 / 她）与 `性别` 属性不符；
+    - location_mismatch：人物提及之后紧接 “在 / 来到 / 回到 ……” 某地点实体，而该地点与其 `所在地` 不同。
+    实体提及由名称与别名构造的 Aho-Corasick 自动机一次扫描得到，各规则对全部提及做 numpy 向量化判断。
+    规则之外的矛盾（如方位、等级）不会产生候选，因此开启预筛是以少量漏检换取模型调用次数。
+    """
+    def __init__(self):
+        self._automata: "OrderedDict[Hashable, NameAutomaton]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"screened": 0, "skipped": 0, "screen_seconds": 0.0, "model_calls": 0, "model_seconds": 0.0,
+                       "settings_chars_full": 0, "settings_chars_sent": 0}
+
+    # ------------------------------------------------------------------
+    # 实体提及
+    # ------------------------------------------------------------------
+    def _terms(self, entities: List[Dict[str, Any]]) -> Dict[str, str]:
+        """检索词 -> 实体名称。规范名称优先；同一别名属于多个实体时不参与匹配"""
+        terms: Dict[str, str] = {}
+        alias_owners: Dict[str, set] = {}
+        for entity in entities:
+            name = entity["name"]
+            if len(name) >= MIN_TERM_CHARS:
+                terms[name] = name
+            for alias in split_aliases(entity.get("properties", {}).get('别名')):
+                if len(alias) >= MIN_TERM_CHARS:
+                    alias_owners.setdefault(alias, set()).add(name)
+        for alias, owners in alias_owners.items():
+            if alias not in terms and len(owners) == 1:
+                terms[alias] = next(iter(owners))
+        return terms
+
+    def _novel_terms(self, novel_id: int) -> List[str]:
+        """小说中出现过的全部实体名称与别名（含已失效的版本）"""
+        rows = db_service.execute_query(
+            "SELECT name AS term FROM entities WHERE novel_id = ? "
+            "UNION SELECT alias FROM entity_aliases WHERE novel_id = ?",
+            (novel_id, novel_id)
+        )
+        return [row['term'] for row in rows if len(row['term']) >= MIN_TERM_CHARS]
+
+    def _automaton(self, terms: Dict[str, str], novel_id: Optional[int]) -> NameAutomaton:
+        """
+        给出 novel_id 时使用整本小说的名称构造的自动机（按写入代数缓存），逐章检测时各章快照共用一个；
+        快照中有不在其中的检索词（或未给出 novel_id）时，按快照自身的检索词集合构造并缓存。
+        """
+        keys = []
+        if novel_id is not None:
+            keys.append(('novel', novel_id, cache_service.get_generation(novel_id)))
+        keys.append(frozenset(terms))
+        with self._lock:
+            for key in keys:
+                automaton = self._automata.get(key)
+                if automaton is not None and terms.keys() <= automaton.terms:
+                    self._automata.move_to_end(key)
+                    return automaton
+        automaton = None
+        if novel_id is not None:
+            automaton = NameAutomaton(self._novel_terms(novel_id))
+            key = keys[0]
+        if automaton is None or not terms.keys() <= automaton.terms:
+            automaton = NameAutomaton(terms)
+            key = keys[-1]
+        with self._lock:
+            self._automata[key] = automaton
+            while len(self._automata) > AUTOMATON_CACHE_SIZE:
+                self._automata.popitem(last=False)
+        return automaton
+
+    # ------------------------------------------------------------------
+    # 预筛
+    # ------------------------------------------------------------------
+    def screen(self, previous_settings: Dict[str, Any], chapter_content: str,
+               novel_id: Optional[int] = None) -> Dict[str, Any]:
+        """
+        对一章做预筛。给出 novel_id 时复用整本小说的名称自动机（逐章检测时无需每章重建）。
+        返回 {"mentioned": [本章提及的实体], "candidates": [{"entity", "rule", "position", "setting", "observed",
+        "evidence", "count"}], "screen_ms"}。同一实体同一规则只保留第一处，count 为命中次数。
+        """
+        t0 = time.perf_counter()
+        entities = previous_settings.get("entities", [])
+        terms = self._terms(entities)
+        mentions = self._automaton(terms, novel_id).find(chapter_content, terms) if terms else []
+        candidates = self._apply_rules(entities, terms, mentions, chapter_content) if mentions else []
+        return {
+            "mentioned": sorted({name for _, _, name in mentions}),
+            "candidates": candidates,
+            "screen_ms": round((time.perf_counter() - t0) * 1000, 3)
+        }
+
+    def _apply_rules(self, entities: List[Dict[str, Any]], terms: Dict[str, str],
+                     mentions: List[Tuple[int, int, str]], text: str) -> List[Dict[str, Any]]:
+        by_name = {entity["name"]: entity for entity in entities}
+        names = sorted({name for _, _, name in mentions})
+        index = {name: i for i, name in enumerate(names)}
+
+        # 每个被提及实体的设定特征
+        dead = np.zeros(len(names), dtype=bool)
+        gender = np.zeros(len(names), dtype=np.int8)
+        is_place = np.zeros(len(names), dtype=bool)
+        locations: List[Optional[str]] = [None] * len(names)
+        for i, name in enumerate(names):
+            entity = by_name[name]
+            properties = entity.get("properties", {})
+            dead[i] = _is_dead(properties.get('状态'))
+            sex = next((properties[k] for k in GENDER_KEYS if properties.get(k)), '')
+            gender[i] = FEMALE if '女' in sex else MALE if '男' in sex else 0
+            is_place[i] = entity.get("type") == '地点'
+            location = next((properties[k] for k in LOCATION_KEYS if properties.get(k)), None)
+            locations[i] = terms.get(location, location) if location else None
+
+        starts = np.asarray([m[0] for m in mentions], dtype=np.int64)
+        ends = np.asarray([m[1] for m in mentions], dtype=np.int64)
+        who = np.asarray([index[m[2]] for m in mentions], dtype=np.int64)
+        # 每个提及之后的下一个非地点实体提及（代词与所在地只在此之前判断）
+        next_others = _first_at_or_after(starts[~is_place[who]], ends)
+
+        flagged: List[Tuple[int, str, Dict[str, Any]]] = []   # (提及序号, 规则, 细节)
+
+        # 已死亡实体出现：附近没有回忆 / 祭奠类词语
+        memorial = _positions(text, MEMORIAL_WORDS)
+        near_memorial = _first_at_or_after(memorial, starts - MEMORIAL_WINDOW) <= ends + MEMORIAL_WINDOW
+        for m in np.flatnonzero(dead[who] & ~near_memorial):
+            flagged.append((m, 'dead_entity', {"setting": f"状态={by_name[names[who[m]]]['properties'].get('状态')}"}))
+
+        # 代词与性别不符：提及之后、下一个非地点实体提及之前最近的代词
+        pronouns = [(p.start(), p.group()) for p in PRONOUN_RE.finditer(text)]
+        he = np.asarray([pos for pos, char in pronouns if char == '他'], dtype=np.int64)
+        she = np.asarray([pos for pos, char in pronouns if char == '她'], dtype=np.int64)
+        next_he, next_she = _first_at_or_after(he, ends), _first_at_or_after(she, ends)
+        nearest = np.minimum(next_he, next_she)
+        refers = nearest < np.minimum(ends + PRONOUN_WINDOW, next_others)
+        sexes = gender[who]
+        mismatch = refers & (((sexes == MALE) & (next_she < next_he)) | ((sexes == FEMALE) & (next_he < next_she)))
+        for m in np.flatnonzero(mismatch):
+            flagged.append((m, 'pronoun_gender', {"setting": f"性别={'男' if sexes[m] == MALE else '女'}",
+                                                  "observed": '她' if next_she[m] < next_he[m] else '他'}))
+
+        # 所在地不符：人物提及之后、下一个非地点实体提及之前，紧接 “在 / 来到 ……” 的地点实体
+        has_location = np.asarray([locations[i] is not None for i in range(len(names))]) & ~is_place
+        place_mentions = np.asarray([m for m in range(len(mentions)) if is_place[who[m]]
+                                     and text[max(0, starts[m] - 2):starts[m]].endswith(LOCATIVE_WORDS)], dtype=np.int64)
+        if len(place_mentions):
+            place_starts = starts[place_mentions]
+            slot = np.searchsorted(place_starts, ends)
+            found = slot < len(place_mentions)
+            slot = np.minimum(slot, len(place_mentions) - 1)
+            located = found & (place_starts[slot] < np.minimum(ends + LOCATION_WINDOW, next_others))
+            for m in np.flatnonzero(has_location[who] & located):
+                place = names[who[place_mentions[slot[m]]]]
+                expected = locations[who[m]]
+                if place not in expected and expected not in place:
+                    flagged.append((m, 'location_mismatch', {"setting": f"所在地={expected}", "observed": place}))
+
+        candidates: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        for m, rule, detail in sorted(flagged, key=lambda f: f[0]):
+            name = names[who[m]]
+            key = (name, rule)
+            if key in candidates:
+                candidates[key]["count"] += 1
+                continue
+            start, end = int(starts[m]), int(ends[m])
+            candidates[key] = {"entity": name, "rule": rule, "position": start, **detail,
+                               "evidence": text[max(0, start - 10):end + PRONOUN_WINDOW], "count": 1}
+        return list(candidates.values())
+
+    def narrow_settings(self, previous_settings: Dict[str, Any], screening: Dict[str, Any]) -> Dict[str, Any]:
+        """只保留候选涉及的实体（含所在地比较中的地点）及其相关关系"""
+        names = set()
+        for candidate in screening["candidates"]:
+            names.add(candidate["entity"])
+            if candidate["rule"] == 'location_mismatch':
+                names.add(candidate["observed"])
+                names.add(candidate["setting"].split('=', 1)[1])
+        return {
+            "entities": [e for e in previous_settings.get("entities", []) if e["name"] in names],
+            "relationships": [r for r in previous_settings.get("relationships", [])
+                              if r["subject"] in names or r["object"] in names]
+        }
+
+    # ------------------------------------------------------------------
+    # 带预筛的冲突检测
+    # ------------------------------------------------------------------
+    def detect_conflicts(self, previous_settings: Dict[str, Any], chapter_content: str,
+                         candidates_only: bool = False, novel_id: Optional[int] = None) -> Dict[str, Any]:
+        """
+        先预筛，有候选时才调用 ai_service.detect_conflicts；candidates_only 时只把候选涉及的设定发给模型。
+        返回值与 ai_service.detect_conflicts 相同，另附 prefilter 字段（是否跳过、候选、预筛耗时）。
+        """
+        screening = self.screen(previous_settings, chapter_content, novel_id)
+        with self._lock:
+            self._stats["screened"] += 1
+            self._stats["screen_seconds"] += screening["screen_ms"] / 1000
+        if not screening["candidates"]:
+            with self._lock:
+                self._stats["skipped"] += 1
+            return {"conflicts": [], "prefilter": {"skipped": True, "mentioned": len(screening["mentioned"]),
+                                                   "screen_ms": screening["screen_ms"]}}
+
+        settings = previous_settings
+        if candidates_only:
+            settings = self.narrow_settings(previous_settings, screening)
+            full_chars = len(json.dumps(previous_settings, ensure_ascii=False))
+            sent_chars = len(json.dumps(settings, ensure_ascii=False))
+            with self._lock:
+                self._stats["settings_chars_full"] += full_chars
+                self._stats["settings_chars_sent"] += sent_chars
+        t0 = time.perf_counter()
+        result = ai_service.detect_conflicts(settings, chapter_content)
+        with self._lock:
+            self._stats["model_calls"] += 1
+            self._stats["model_seconds"] += time.perf_counter() - t0
+        result["prefilter"] = {"skipped": False, "candidates_only": candidates_only,
+                               "candidates": screening["candidates"], "screen_ms": screening["screen_ms"]}
+        return result
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        预筛统计：跳过率、平均预筛耗时，以及按本进程实际模型调用的平均耗时估算的节省时间；
+        candidates_only 时另有发送的设定字符数与完整设定字符数之比。
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        screened, calls = stats["screened"], stats["model_calls"]
+        avg_model = stats["model_seconds"] / calls if calls else None
+        return {
+            "screened": screened,
+            "skipped": stats["skipped"],
+            "skip_rate": round(stats["skipped"] / screened, 4) if screened else None,
+            "avg_screen_ms": round(stats["screen_seconds"] / screened * 1000, 3) if screened else None,
+            "model_calls": calls,
+            "avg_model_seconds": round(avg_model, 3) if avg_model is not None else None,
+            "estimated_saved_seconds": round(stats["skipped"] * avg_model, 1) if avg_model is not None else None,
+            "settings_chars_ratio": (round(stats["settings_chars_sent"] / stats["settings_chars_full"], 4)
+                                     if stats["settings_chars_full"] else None)
+        }
+
+# 单例
+conflict_filter_service = ConflictFilterService()
+
+
+def _conflict_filter_metrics():
+    stats = conflict_filter_service.get_stats()
+    lines = ['# HELP conflict_prefilter_chapters_total 冲突检测预筛的章节数', '# TYPE conflict_prefilter_chapters_total counter',
+             f'conflict_prefilter_chapters_total{{outcome="skipped"}} {stats["skipped"]}',
+             f'conflict_prefilter_chapters_total{{outcome="model"}} {stats["screened"] - stats["skipped"]}']
+    if stats["estimated_saved_seconds"] is not None:
+        lines += ['# HELP conflict_prefilter_saved_seconds 预筛跳过的模型调用估算节省的时间',
+                  '# TYPE conflict_prefilter_saved_seconds gauge',
+                  f'conflict_prefilter_saved_seconds {stats["estimated_saved_seconds"]}']
+    return lines
+
+metrics_service.register_collector(_conflict_filter_metrics)
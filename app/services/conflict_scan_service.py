@@ -0,0 +1,147 @@
+import itertools
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from app.services import db_service
+from app.services.ai_service import ai_service
+from app.services.chapter_service import chapter_service
+from app.services.setting_service import setting_service
+
+# 连续失败达到该次数时停止提交新的章节（如全部 key 的额度耗尽），避免对剩余章节逐一失败
+MAX_CONSECUTIVE_FAILURES = 5
+
+
+class ConflictScanService:
+    """
+    批量冲突检测：对章节区间逐章执行 ai_service.detect_conflicts 并保存结果。
+    每章的检测只依赖上一章结束时的设定快照与本章正文，章节之间相互独立，因此并发执行：
+    - 快照由 setting_service.iter_snapshots 一次扫描依次生成，不再每章查询一次完整快照；
+    - 工作线程各自固定使用 key 池中的一个 key（从当前 key 开始依次分配），并发请求分散到整个 key 池；
+    - 同时在途的章节数不超过并发数，快照在提交时才生成，内存占用与区间长度无关；
+    - prefilter 时每章先经 conflict_filter_service 本地预筛，没有疑似冲突的章节不调用模型。
+    结果按完成顺序写入（chapter_service.update_conflict_result），检测失败的章节保留原有结果。
+    """
+
+    def default_concurrency(self) -> int:
+        """默认并发数：每个 key 同时一个请求"""
+        return len(ai_service.api_keys)
+
+    def _chapters_to_scan(self, novel_id: int, start_chapter: int, end_chapter: int, skip_checked: bool) -> List[int]:
+        rows = db_service.execute_query(
+            "SELECT number, conflict_result IS NOT NULL AS checked FROM chapters "
+            "WHERE novel_id = ? AND number BETWEEN ? AND ? ORDER BY number",
+            (novel_id, start_chapter, end_chapter)
+        )
+        return [row['number'] for row in rows if not (skip_checked and row['checked'])]
+
+    def _check_chapter(self, novel_id: int, chapter_number: int, previous_settings: Dict[str, Any],
+                       prefilter: bool, candidates_only: bool) -> Tuple[Dict[str, Any], float]:
+        chapter = chapter_service.get_chapter_content(novel_id, chapter_number)
+        t0 = time.perf_counter()
+        if prefilter:
+            # 预筛依赖 numpy，只在使用时导入
+            from app.services.conflict_filter_service import conflict_filter_service
+            result = conflict_filter_service.detect_conflicts(previous_settings, chapter['content'],
+                                                              candidates_only=candidates_only, novel_id=novel_id)
+        else:
+            result = ai_service.detect_conflicts(previous_settings, chapter['content'])
+        return result, time.perf_counter() - t0
+
+    def scan(self, novel_id: int, start_chapter: int, end_chapter: int, concurrency: Optional[int] = None,
+             skip_checked: bool = False, prefilter: bool = False,
+             candidates_only: bool = False) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        检测 start_chapter 到 end_chapter 的各章（skip_checked 时跳过已有检测结果的章节），
+        依次产出进度事件 (事件名, 数据)：
+        - start：待检测章节数与并发数；
+        - chapter：每完成一章产出一次，含本章冲突数（或错误）、检测耗时与累计进度、吞吐，
+          prefilter 时另有 skipped（预筛后未调用模型）；
+        - done：汇总（成功 / 失败 / 未执行的章节数、预筛跳过的章节数、总耗时、每分钟章节数、
+          加速比 = 各章检测耗时之和 / 总耗时）。
+        生成器被提前关闭（如客户端断开）时取消尚未开始的章节，进行中的调用结束后其结果不再保存。
+        """
+        concurrency = max(1, concurrency or self.default_concurrency())
+        chapters = self._chapters_to_scan(novel_id, start_chapter, end_chapter, skip_checked)
+        wanted = set(chapters)
+        total = len(chapters)
+        yield 'start', {"total": total, "concurrency": concurrency}
+
+        # 第 n 章使用第 n - 1 章结束时的快照
+        snapshots = ((number + 1, snapshot) for number, snapshot
+                     in setting_service.iter_snapshots(novel_id, chapters[0] - 1, chapters[-1] - 1)
+                     if number + 1 in wanted) if chapters else iter(())
+        key_indexes = itertools.count(ai_service.current_key_index)
+        executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='conflict-scan',
+                                      initializer=lambda: ai_service.pin_key(next(key_indexes)))
+        pending: Dict[Any, int] = {}
+        done_count = failed = consecutive_failures = conflicts = skipped = 0
+        ai_seconds = 0.0
+        failures: List[Dict[str, Any]] = []
+        aborted = False
+        t0 = time.perf_counter()
+        try:
+            while True:
+                while not aborted and len(pending) < concurrency:
+                    item = next(snapshots, None)
+                    if item is None:
+                        break
+                    number, previous_settings = item
+                    pending[executor.submit(self._check_chapter, novel_id, number, previous_settings,
+                                            prefilter, candidates_only)] = number
+                if not pending:
+                    break
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in sorted(finished, key=pending.get):
+                    number = pending.pop(future)
+                    event = {"chapter": number}
+                    try:
+                        result, seconds = future.result()
+                        error = result.get("error")
+                    except Exception as e:
+                        result, seconds, error = None, 0.0, str(e)
+                    ai_seconds += seconds
+                    done_count += 1
+                    if error:
+                        failed += 1
+                        consecutive_failures += 1
+                        failures.append({"chapter": number, "error": error})
+                        event["error"] = error
+                        if consecutive_failures >= MAX_CONSECUTIVE_FAILURES:
+                            aborted = True
+                    else:
+                        consecutive_failures = 0
+                        chapter_service.update_conflict_result(novel_id, number, result)
+                        event["conflicts"] = len(result.get("conflicts", []))
+                        conflicts += event["conflicts"]
+                        if prefilter:
+                            event["skipped"] = result["prefilter"]["skipped"]
+                            skipped += event["skipped"]
+                    elapsed = time.perf_counter() - t0
+                    rate = done_count / elapsed if elapsed else 0.0
+                    event.update(
+                        seconds=round(seconds, 3), done=done_count, failed=failed, total=total,
+                        chapters_per_minute=round(rate * 60, 1),
+                        eta_seconds=round((total - done_count) / rate, 1) if rate else None
+                    )
+                    yield 'chapter', event
+        finally:
+            # 提前关闭时不等待进行中的调用，未开始的章节直接取消
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        elapsed = time.perf_counter() - t0
+        yield 'done', {
+            "total": total,
+            "checked": done_count - failed,
+            "failed": failed,
+            "remaining": total - done_count,
+            "aborted": aborted,
+            "conflicts": conflicts,
+            "skipped": skipped,
+            "failures": failures,
+            "elapsed_seconds": round(elapsed, 3),
+            "chapters_per_minute": round(done_count / elapsed * 60, 1) if elapsed else None,
+            "speedup": round(ai_seconds / elapsed, 2) if elapsed else None
+        }
+
+# 单例
+conflict_scan_service = ConflictScanService()
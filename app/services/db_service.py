@@ -1,6 +1,10 @@
+import json
 import sqlite3
 import os
-from typing import List, Dict, Any, Tuple, Optional
+import time
+import zlib
+from typing import List, Dict, Any, Tuple, Optional, Iterator
+from app.services.metrics_service import metrics_service
 
 # 数据库文件路径
 # 获取当前文件(db_service.py)的目录: .../app/services
@@ -9,6 +13,29 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 project_root = os.path.abspath(os.path.join(current_dir, '..', '..'))
 DB_PATH = os.path.join(project_root, 'novel_system.db')
 
+# 表结构版本，迁移完成后写入 PRAGMA user_version；新增迁移步骤时必须加 1，
+# 已是该版本的数据库启动时只读一次 user_version，不再逐项检查迁移
+SCHEMA_VERSION = 4
+
+# 章节正文压缩级别（导入时压缩一次，读取时解压，级别对解压速度几乎没有影响）
+CONTENT_COMPRESS_LEVEL = 9
+
+def encode_content(text: Optional[str]) -> Tuple[str, bytes]:
+    """把章节正文编码为 (codec, data)。压缩无收益时（如极短章节）按原文存储。"""
+    raw = (text or '').encode('utf-8')
+    packed = zlib.compress(raw, CONTENT_COMPRESS_LEVEL)
+    if len(packed) < len(raw):
+        return 'zlib', packed
+    return 'raw', raw
+
+def decode_content(codec: Optional[str], data: Optional[bytes]) -> Optional[str]:
+    """解码 chapter_contents 中的正文，同时注册为 SQL 函数 chapter_text(codec, data)"""
+    if data is None:
+        return None
+    if codec == 'zlib':
+        data = zlib.decompress(data)
+    return bytes(data).decode('utf-8')
+
 def get_db_connection():
     """
     获取数据库连接。
@@ -18,23 +45,30 @@ def get_db_connection():
     conn.row_factory = sqlite3.Row
     # 启用外键约束
     conn.execute("PRAGMA foreign_keys = ON")
+    # 章节正文视图 chapter_texts 与全文索引触发器依赖该函数
+    conn.create_function("chapter_text", 2, decode_content, deterministic=True)
     return conn
 
 def init_db():
     """
     初始化数据库：如果数据库文件不存在或表结构缺失，则创建并执行 schema.sql。
+    表结构已是 SCHEMA_VERSION 时直接返回。
     """
     should_init = False
     if not os.path.exists(DB_PATH):
         should_init = True
     else:
-        # 检查关键表是否存在
+        # 检查表结构版本与关键表是否存在
         try:
             conn = get_db_connection()
-            cursor = conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='novels'")
-            if cursor.fetchone() is None:
-                should_init = True
-            conn.close()
+            try:
+                if conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION:
+                    return
+                cursor = conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='novels'")
+                if cursor.fetchone() is None:
+                    should_init = True
+            finally:
+                conn.close()
         except Exception:
             should_init = True
 
@@ -51,34 +85,407 @@ def init_db():
         conn.close()
         print(f"数据库已初始化: {DB_PATH}")
 
+    migrate_db()
+
+def enable_wal() -> str:
+    """
+    切换为 WAL 日志模式（持久保存在数据库文件中）：写事务进行时其它进程仍可读取，
+    多 worker 部署时提取写入不会阻塞只读请求。返回切换后的日志模式。
+    """
+    conn = get_db_connection()
+    try:
+        return conn.execute("PRAGMA journal_mode = WAL").fetchone()[0]
+    finally:
+        conn.close()
+
+def migrate_db():
+    """
+    对已有数据库执行增量迁移。每一步都是幂等的，可在每次启动时重复执行。
+    """
+    conn = get_db_connection()
+    try:
+        moved = _ensure_chapter_contents(conn)
+        _ensure_chapter_fts(conn)
+        _ensure_entity_aliases(conn)
+        _ensure_extraction_traces(conn)
+        _ensure_cache_generations(conn)
+        _ensure_conflicts(conn)
+        _ensure_indexes(conn)
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.commit()
+        if moved:
+            # 正文迁出后回收 chapters 表释放的页
+            conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+def has_fts5(conn: sqlite3.Connection) -> bool:
+    """检查当前 SQLite 是否编译了 FTS5 扩展"""
+    try:
+        conn.execute("CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(x, tokenize='trigram')")
+        conn.execute("DROP TABLE temp.fts5_probe")
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+def _ensure_chapter_contents(conn: sqlite3.Connection) -> bool:
+    """
+    章节正文存储：正文按章压缩后存放在独立的 chapter_contents 表，chapters 只保留元数据，
+    列表、统计等只读元数据的查询不会把正文读入页缓存。chapter_texts 视图按需解压正文。
+    旧数据库中 chapters.content 的正文会被迁移过来并清空（旧的全文索引随之重建）。
+    返回是否迁移了旧正文。
+    """
+    exists = conn.execute(
+        "SELECT name FROM sqlite_master WHERE type='table' AND name='chapter_contents'"
+    ).fetchone()
+    if not exists:
+        conn.executescript("""
+            CREATE TABLE chapter_contents (
+                `chapter_id` INTEGER PRIMARY KEY,
+                `codec` TEXT NOT NULL,
+                `data` BLOB NOT NULL,
+                `char_count` INTEGER NOT NULL,
+                `raw_bytes` INTEGER NOT NULL,
+                FOREIGN KEY (`chapter_id`) REFERENCES `chapters`(`id`) ON DELETE CASCADE
+            );
+        """)
+    conn.executescript("""
+        CREATE VIEW IF NOT EXISTS chapter_texts AS
+            SELECT c.id, c.novel_id, c.number, c.title, chapter_text(cc.codec, cc.data) AS content
+            FROM chapters c JOIN chapter_contents cc ON cc.chapter_id = c.id;
+    """)
+
+    columns = [row['name'] for row in conn.execute("PRAGMA table_info(chapters)")]
+    if 'content' not in columns or not conn.execute(
+        "SELECT 1 FROM chapters WHERE content IS NOT NULL LIMIT 1"
+    ).fetchone():
+        return False
+
+    # 旧全文索引以 chapters.content 为外部内容，先删除，稍后基于 chapter_texts 重建
+    conn.executescript("""
+        DROP TRIGGER IF EXISTS chapters_fts_insert;
+        DROP TRIGGER IF EXISTS chapters_fts_delete;
+        DROP TRIGGER IF EXISTS chapters_fts_update;
+        DROP TABLE IF EXISTS chapters_fts;
+    """)
+
+    t0 = time.perf_counter()
+    raw_total = stored_total = count = 0
+    cursor = conn.execute("SELECT id, content FROM chapters WHERE content IS NOT NULL")
+    while True:
+        rows = cursor.fetchmany(200)
+        if not rows:
+            break
+        batch = []
+        for row in rows:
+            codec, data = encode_content(row['content'])
+            raw_bytes = len(row['content'].encode('utf-8'))
+            batch.append((row['id'], codec, data, len(row['content']), raw_bytes))
+            raw_total += raw_bytes
+            stored_total += len(data)
+        conn.executemany(
+            "INSERT OR REPLACE INTO chapter_contents (chapter_id, codec, data, char_count, raw_bytes) VALUES (?, ?, ?, ?, ?)",
+            batch
+        )
+        count += len(batch)
+    conn.execute("UPDATE chapters SET content = NULL WHERE content IS NOT NULL")
+    elapsed = time.perf_counter() - t0
+    print(f"已将 {count} 章正文迁移到 chapter_contents：{raw_total / 1048576:.1f} MB -> "
+          f"{stored_total / 1048576:.1f} MB（节省 {(1 - stored_total / max(raw_total, 1)) * 100:.0f}%），耗时 {elapsed:.1f}s。")
+    return True
+
+def _ensure_chapter_fts(conn: sqlite3.Connection):
+    """
+    章节全文索引：chapters_fts 是以 chapter_texts 视图为外部内容的 FTS5 表（trigram 分词，适合中文），
+    不重复存储正文，snippet() 只解压命中的章节。触发器在正文写入、章节删除、标题修改时保持同步；
+    章节删除时 chapter_contents 由外键级联删除，因此删除索引项的触发器挂在 chapters 上（BEFORE DELETE，
+    此时正文仍可读取）。首次创建时从现有章节重建索引。
+    """
+    exists = conn.execute(
+        "SELECT name FROM sqlite_master WHERE type='table' AND name='chapters_fts'"
+    ).fetchone()
+    if exists:
+        return
+    if not has_fts5(conn):
+        print("当前 SQLite 不支持 FTS5 trigram 分词，章节全文检索将退化为逐章扫描。")
+        return
+
+    conn.executescript("""
+        CREATE VIRTUAL TABLE chapters_fts USING fts5(
+            title, content,
+            content='chapter_texts', content_rowid='id',
+            tokenize='trigram'
+        );
+
+        CREATE TRIGGER chapters_fts_insert AFTER INSERT ON chapter_contents BEGIN
+            INSERT INTO chapters_fts(rowid, title, content)
+            VALUES (new.chapter_id, (SELECT title FROM chapters WHERE id = new.chapter_id), chapter_text(new.codec, new.data));
+        END;
+
+        CREATE TRIGGER chapters_fts_update AFTER UPDATE OF codec, data ON chapter_contents BEGIN
+            INSERT INTO chapters_fts(chapters_fts, rowid, title, content)
+            VALUES ('delete', old.chapter_id, (SELECT title FROM chapters WHERE id = old.chapter_id), chapter_text(old.codec, old.data));
+            INSERT INTO chapters_fts(rowid, title, content)
+            VALUES (new.chapter_id, (SELECT title FROM chapters WHERE id = new.chapter_id), chapter_text(new.codec, new.data));
+        END;
+
+        CREATE TRIGGER chapters_fts_delete BEFORE DELETE ON chapters
+        WHEN EXISTS (SELECT 1 FROM chapter_contents WHERE chapter_id = old.id) BEGIN
+            INSERT INTO chapters_fts(chapters_fts, rowid, title, content)
+            SELECT 'delete', old.id, old.title, chapter_text(codec, data) FROM chapter_contents WHERE chapter_id = old.id;
+        END;
+
+        CREATE TRIGGER chapters_fts_title AFTER UPDATE OF title ON chapters
+        WHEN EXISTS (SELECT 1 FROM chapter_contents WHERE chapter_id = new.id) BEGIN
+            INSERT INTO chapters_fts(chapters_fts, rowid, title, content)
+            SELECT 'delete', old.id, old.title, chapter_text(codec, data) FROM chapter_contents WHERE chapter_id = old.id;
+            INSERT INTO chapters_fts(rowid, title, content)
+            SELECT new.id, new.title, chapter_text(codec, data) FROM chapter_contents WHERE chapter_id = new.id;
+        END;
+
+        INSERT INTO chapters_fts(chapters_fts) VALUES ('rebuild');
+    """)
+    print("已创建章节全文索引 chapters_fts。")
+
+def _ensure_entity_aliases(conn: sqlite3.Connection):
+    """
+    别名表：把 `别名` 属性拆分为独立的行，区间与对应的属性版本一致，供别名解析使用。
+    首次创建时从现有的 `别名` 属性回填。
+    """
+    exists = conn.execute(
+        "SELECT name FROM sqlite_master WHERE type='table' AND name='entity_aliases'"
+    ).fetchone()
+    if exists:
+        return
+
+    conn.executescript("""
+        CREATE TABLE entity_aliases (
+            `id` INTEGER PRIMARY KEY AUTOINCREMENT,
+            `novel_id` INTEGER NOT NULL,
+            `entity_id` INTEGER NOT NULL,
+            `alias` TEXT NOT NULL,
+            `start_chapter_id` INTEGER NOT NULL,
+            `end_chapter_id` INTEGER,
+            FOREIGN KEY (`novel_id`) REFERENCES `novels`(`id`) ON DELETE CASCADE,
+            FOREIGN KEY (`entity_id`) REFERENCES `entities`(`id`) ON DELETE CASCADE,
+            FOREIGN KEY (`start_chapter_id`) REFERENCES `chapters`(`id`),
+            FOREIGN KEY (`end_chapter_id`) REFERENCES `chapters`(`id`)
+        );
+        CREATE INDEX idx_entity_aliases_novel_alias ON entity_aliases (novel_id, alias);
+        CREATE INDEX idx_entity_aliases_entity ON entity_aliases (entity_id);
+    """)
+
+    from app.services.alias_service import split_aliases
+    rows = conn.execute("""
+        SELECT e.novel_id, e.id AS entity_id, e.name, p.value, p.start_chapter_id, p.end_chapter_id
+        FROM properties p JOIN entities e ON p.entity_id = e.id
+        WHERE p.key = '别名'
+    """).fetchall()
+    conn.executemany(
+        "INSERT INTO entity_aliases (novel_id, entity_id, alias, start_chapter_id, end_chapter_id) VALUES (?, ?, ?, ?, ?)",
+        [
+            (r['novel_id'], r['entity_id'], alias, r['start_chapter_id'], r['end_chapter_id'])
+            for r in rows for alias in split_aliases(r['value']) if alias != r['name']
+        ]
+    )
+    print(f"已创建别名表 entity_aliases（回填 {len(rows)} 条别名属性）。")
+
+def _ensure_cache_generations(conn: sqlite3.Connection):
+    """缓存失效用的写入代数（见 cache_service），放在数据库中供多个 worker 进程共享"""
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS cache_generations (
+            `novel_id` INTEGER NOT NULL,
+            `kind` TEXT NOT NULL,
+            `generation` INTEGER NOT NULL,
+            PRIMARY KEY (`novel_id`, `kind`)
+        );
+    """)
+
+def _ensure_conflicts(conn: sqlite3.Connection):
+    """
+    冲突表：chapters.conflict_result 中的每条冲突一行，按实体、引用章节、发现章节建索引。
+    首次创建时从已有的 conflict_result 回填（无法解析的 JSON 跳过）。
+    """
+    exists = conn.execute(
+        "SELECT name FROM sqlite_master WHERE type='table' AND name='conflicts'"
+    ).fetchone()
+    if exists:
+        return
+
+    conn.executescript("""
+        CREATE TABLE conflicts (
+            `id` INTEGER PRIMARY KEY AUTOINCREMENT,
+            `novel_id` INTEGER NOT NULL,
+            `chapter_id` INTEGER NOT NULL,
+            `chapter_number` INTEGER NOT NULL,
+            `start_chapter` INTEGER,
+            `entity` TEXT,
+            `conflicting_setting` TEXT,
+            `description` TEXT,
+            `original_text` TEXT,
+            FOREIGN KEY (`novel_id`) REFERENCES `novels`(`id`) ON DELETE CASCADE,
+            FOREIGN KEY (`chapter_id`) REFERENCES `chapters`(`id`) ON DELETE CASCADE
+        );
+        CREATE INDEX idx_conflicts_novel_chapter ON conflicts (novel_id, chapter_number);
+        CREATE INDEX idx_conflicts_novel_entity ON conflicts (novel_id, entity, chapter_number);
+        CREATE INDEX idx_conflicts_novel_start ON conflicts (novel_id, start_chapter, chapter_number);
+        CREATE INDEX idx_conflicts_chapter ON conflicts (chapter_id);
+    """)
+
+    from app.services.alias_service import alias_service
+    from app.services.chapter_service import conflict_rows
+    chapters = conn.execute(
+        "SELECT id, novel_id, number, conflict_result FROM chapters WHERE conflict_result IS NOT NULL ORDER BY id"
+    ).fetchall()
+    rows, parsed = [], 0
+    for chapter in chapters:
+        try:
+            result = json.loads(chapter['conflict_result'])
+        except ValueError:
+            continue
+        if not isinstance(result, dict):
+            continue
+        parsed += 1
+        canonical = alias_service.get_resolver(chapter['novel_id']).canonical
+        rows.extend((chapter['novel_id'], chapter['id'], chapter['number'], *row)
+                    for row in conflict_rows(result, canonical))
+    conn.executemany(
+        "INSERT INTO conflicts (novel_id, chapter_id, chapter_number, start_chapter, entity, "
+        "conflicting_setting, description, original_text) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        rows
+    )
+    print(f"已创建冲突表 conflicts（回填 {parsed} 章的 {len(rows)} 条冲突）。")
+
+def _ensure_extraction_traces(conn: sqlite3.Connection):
+    """
+    设定提取记录表：每次章节提取一行，记录各阶段耗时（毫秒）、Prompt/响应大小、token、写操作数与重试次数。
+    只保存章号：章节被删除后记录仍保留，用于历史对比。
+    """
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS extraction_traces (
+            `id` INTEGER PRIMARY KEY AUTOINCREMENT,
+            `novel_id` INTEGER NOT NULL,
+            `chapter_number` INTEGER NOT NULL,
+            `status` TEXT NOT NULL,
+            `error` TEXT,
+            `total_ms` REAL NOT NULL,
+            `load_ms` REAL NOT NULL DEFAULT 0,
+            `snapshot_ms` REAL NOT NULL DEFAULT 0,
+            `prompt_ms` REAL NOT NULL DEFAULT 0,
+            `model_ms` REAL NOT NULL DEFAULT 0,
+            `parse_ms` REAL NOT NULL DEFAULT 0,
+            `diff_ms` REAL NOT NULL DEFAULT 0,
+            `write_ms` REAL NOT NULL DEFAULT 0,
+            `index_ms` REAL NOT NULL DEFAULT 0,
+            `prompt_chars` INTEGER NOT NULL DEFAULT 0,
+            `response_chars` INTEGER NOT NULL DEFAULT 0,
+            `prompt_tokens` INTEGER NOT NULL DEFAULT 0,
+            `completion_tokens` INTEGER NOT NULL DEFAULT 0,
+            `db_operations` INTEGER NOT NULL DEFAULT 0,
+            `retries` INTEGER NOT NULL DEFAULT 0,
+            `snapshot_entities` INTEGER NOT NULL DEFAULT 0,
+            `snapshot_relationships` INTEGER NOT NULL DEFAULT 0,
+            `segments` INTEGER NOT NULL DEFAULT 0,
+            `created_at` TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (`novel_id`) REFERENCES `novels`(`id`) ON DELETE CASCADE
+        );
+        CREATE INDEX IF NOT EXISTS idx_extraction_traces_novel ON extraction_traces (novel_id, status, id);
+    """)
+    columns = [row['name'] for row in conn.execute("PRAGMA table_info(extraction_traces)")]
+    if 'segments' not in columns:
+        conn.execute("ALTER TABLE extraction_traces ADD COLUMN `segments` INTEGER NOT NULL DEFAULT 0")
+
+def _ensure_indexes(conn: sqlite3.Connection):
+    """
+    常用索引：按实体查属性、按名称查实体，以及设定区间端点（章节区间差异、回滚按章节删除/恢复）
+    """
+    conn.executescript("""
+        CREATE INDEX IF NOT EXISTS idx_properties_entity ON properties (entity_id, key);
+        CREATE INDEX IF NOT EXISTS idx_entities_novel_name ON entities (novel_id, name);
+        CREATE INDEX IF NOT EXISTS idx_entities_start ON entities (start_chapter_id);
+        CREATE INDEX IF NOT EXISTS idx_entities_end ON entities (end_chapter_id);
+        CREATE INDEX IF NOT EXISTS idx_properties_start ON properties (start_chapter_id);
+        CREATE INDEX IF NOT EXISTS idx_properties_end ON properties (end_chapter_id);
+        CREATE INDEX IF NOT EXISTS idx_relationships_start ON relationships (start_chapter_id);
+        CREATE INDEX IF NOT EXISTS idx_relationships_end ON relationships (end_chapter_id);
+    """)
+
 def execute_query(query: str, params: Tuple = ()) -> List[Dict[str, Any]]:
     """
     执行查询语句 (SELECT)。
     返回字典列表。
     """
     conn = get_db_connection()
+    t0 = time.perf_counter()
+    failed = True
     try:
         cursor = conn.execute(query, params)
         # 将 sqlite3.Row 对象转换为普通字典
         result = [dict(row) for row in cursor.fetchall()]
+        failed = False
         return result
     finally:
+        metrics_service.observe_db(query, time.perf_counter() - t0, failed)
         conn.close()
 
+def open_read_snapshot() -> sqlite3.Connection:
+    """
+    打开一个处于读事务中的连接，其上的多条查询读到同一时刻的数据（WAL 模式下不阻塞写入）。
+    用于分多次逐行读取的快照（如实体与关系分别流式输出），调用方负责 close()。
+    """
+    conn = get_db_connection()
+    conn.execute("BEGIN")
+    return conn
+
+def iter_query(query: str, params: Tuple = (), conn: Optional[sqlite3.Connection] = None) -> Iterator[Dict[str, Any]]:
+    """
+    逐行执行查询语句 (SELECT)，用于流式输出大结果集。
+    连接在迭代结束（或生成器被关闭）时释放；传入 conn（如 open_read_snapshot 的连接）时使用该连接且不关闭。
+    """
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_connection()
+    # 只计入数据库内的耗时（执行与逐行读取），不含调用方处理每行的时间
+    elapsed = 0.0
+    failed = True
+    try:
+        t0 = time.perf_counter()
+        cursor = conn.execute(query, params)
+        row = cursor.fetchone()
+        elapsed += time.perf_counter() - t0
+        while row is not None:
+            yield dict(row)
+            t0 = time.perf_counter()
+            row = cursor.fetchone()
+            elapsed += time.perf_counter() - t0
+        failed = False
+    except GeneratorExit:
+        # 调用方提前结束迭代不算失败
+        failed = False
+        raise
+    finally:
+        metrics_service.observe_db(query, elapsed, failed)
+        if own_conn:
+            conn.close()
+
 def execute_commit(query: str, params: Tuple = ()) -> int:
     """
     执行提交语句 (INSERT, UPDATE, DELETE)。
     返回 lastrowid (对于INSERT) 或 rowcount (对于UPDATE/DELETE)。
     """
     conn = get_db_connection()
+    t0 = time.perf_counter()
+    failed = True
     try:
         cursor = conn.execute(query, params)
         conn.commit()
+        failed = False
         if query.strip().upper().startswith("INSERT"):
             return cursor.lastrowid
         else:
             return cursor.rowcount
     finally:
+        metrics_service.observe_db(query, time.perf_counter() - t0, failed)
         conn.close()
 
 def execute_transaction(operations: List[Dict[str, Any]]) -> bool:
@@ -87,12 +494,21 @@ def execute_transaction(operations: List[Dict[str, Any]]) -> bool:
     operations: 包含多个操作的列表，每个操作是 {'query': str, 'params': tuple}
     """
     conn = get_db_connection()
+    query = None
     try:
         for op in operations:
-            conn.execute(op['query'], op.get('params', ()))
+            query = op['query']
+            t0 = time.perf_counter()
+            conn.execute(query, op.get('params', ()))
+            metrics_service.observe_db(query, time.perf_counter() - t0)
+        query = 'COMMIT'
+        t0 = time.perf_counter()
         conn.commit()
+        metrics_service.observe_db(query, time.perf_counter() - t0)
         return True
     except Exception as e:
+        if query is not None:
+            metrics_service.db_errors.inc(metrics_service.statement_label(query))
         conn.rollback()
         print(f"事务执行失败: {e}")
         raise e # 抛出异常以便上层处理
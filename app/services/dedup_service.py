@@ -0,0 +1,391 @@
+import json
+import re
+import zlib
+from itertools import combinations
+from typing import Dict, List, Any, Optional, Set, Tuple
+import numpy as np
+from app.services import db_service
+from app.services.alias_service import alias_service
+from app.services.cache_service import cache_service
+from app.services.chapter_cache_service import chapter_cache_service
+from app.services.setting_service import setting_service
+
+# 比较名称前去除的书名号、引号、括号、间隔号与空白
+NORMALIZE_RE = re.compile(r'[\s《》〈〉「」『』“”"\'‘’()（）\[\]【】·・.,，、:：!！?？-]')
+
+def normalize_name(name: str) -> str:
+    return NORMALIZE_RE.sub('', name or '').lower()
+
+
+class DedupService:
+    """
+    实体去重：在整本小说的当前有效实体中查找疑似重复的实体并按人工确认的结果合并。
+
+    候选生成使用分块（blocking）避免 O(E^2) 两两比较：
+    - MinHash LSH：对名称与别名的 1/2-gram 集合计算 MinHash 签名，分带后同桶的实体成为候选；
+    - 精确/包含分块：名称或别名完全相同，或一方是另一方的前缀/后缀（如 “《零》” 与 “《零》游戏”）。
+    过大的桶（常见字）直接跳过。候选对再按名称相似度、别名重叠、共同关系邻居加权打分。
+    """
+    NUM_PERM = 32
+    BANDS = 16                     # 每带 2 行，Jaccard 约 0.25 以上的名称大概率同桶
+    MAX_BUCKET = 64
+    MERSENNE_PRIME = (1 << 61) - 1
+    NAME_WEIGHT = 0.6
+    ALIAS_WEIGHT = 0.25
+    NEIGHBOR_WEIGHT = 0.15
+    TYPE_MISMATCH_PENALTY = 0.5
+    DEFAULT_THRESHOLD = 0.45
+
+    # ------------------------------------------------------------------
+    # 数据加载
+    # ------------------------------------------------------------------
+    def _load_entities(self, novel_id: int) -> List[Dict[str, Any]]:
+        """读取当前有效实体及其别名、关系邻居与属性数量"""
+        entities = db_service.execute_query(
+            """
+            SELECT e.id, e.name, e.type, e.start_chapter_id, c.number AS start_chapter
+            FROM entities e JOIN chapters c ON e.start_chapter_id = c.id
+            WHERE e.novel_id = ? AND e.end_chapter_id IS NULL
+            ORDER BY e.id
+            """,
+            (novel_id,)
+        )
+        by_id = {e['id']: e for e in entities}
+        for e in entities:
+            e['aliases'] = set()
+            e['neighbors'] = set()
+            e['property_count'] = 0
+
+        for row in db_service.execute_query(
+            "SELECT entity_id, alias FROM entity_aliases WHERE novel_id = ? AND end_chapter_id IS NULL",
+            (novel_id,)
+        ):
+            if row['entity_id'] in by_id:
+                by_id[row['entity_id']]['aliases'].add(row['alias'])
+
+        for row in db_service.execute_query(
+            """
+            SELECT p.entity_id, COUNT(*) AS cnt FROM properties p
+            JOIN entities e ON p.entity_id = e.id
+            WHERE e.novel_id = ? AND p.end_chapter_id IS NULL
+            GROUP BY p.entity_id
+            """,
+            (novel_id,)
+        ):
+            if row['entity_id'] in by_id:
+                by_id[row['entity_id']]['property_count'] = row['cnt']
+
+        by_name: Dict[str, List[Dict[str, Any]]] = {}
+        for e in entities:
+            by_name.setdefault(e['name'], []).append(e)
+        for row in db_service.execute_query(
+            "SELECT subject_name, object_name FROM relationships WHERE novel_id = ? AND end_chapter_id IS NULL",
+            (novel_id,)
+        ):
+            for e in by_name.get(row['subject_name'], ()):
+                e['neighbors'].add(row['object_name'])
+            for e in by_name.get(row['object_name'], ()):
+                e['neighbors'].add(row['subject_name'])
+
+        for e in entities:
+            e['terms'] = {t for t in (normalize_name(x) for x in {e['name'], *e['aliases']}) if t}
+            e['term_grams'] = [(t, self._grams({t})) for t in e['terms']]
+        return entities
+
+    # ------------------------------------------------------------------
+    # 分块
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _grams(terms: Set[str]) -> Set[str]:
+        grams = set()
+        for term in terms:
+            grams.update(term)
+            grams.update(term[i:i + 2] for i in range(len(term) - 1))
+        return grams
+
+    def _minhash_signatures(self, entities: List[Dict[str, Any]]) -> np.ndarray:
+        """向量化计算所有实体的 MinHash 签名，形状为 (实体数, NUM_PERM)"""
+        hashes, owners = [], []
+        for i, e in enumerate(entities):
+            for gram in self._grams(e['terms']):
+                hashes.append(zlib.crc32(gram.encode('utf-8')))
+                owners.append(i)
+        signatures = np.full((len(entities), self.NUM_PERM), np.iinfo(np.uint64).max, dtype=np.uint64)
+        if not hashes:
+            return signatures
+
+        rng = np.random.default_rng(0)
+        a = rng.integers(1, self.MERSENNE_PRIME, size=self.NUM_PERM, dtype=np.uint64)
+        b = rng.integers(0, self.MERSENNE_PRIME, size=self.NUM_PERM, dtype=np.uint64)
+        h = np.asarray(hashes, dtype=np.uint64)
+        owners = np.asarray(owners, dtype=np.int64)
+        # owners 按实体顺序递增，每段的起点即为该实体的第一个 gram
+        starts = np.flatnonzero(np.r_[True, owners[1:] != owners[:-1]])
+        for p in range(self.NUM_PERM):
+            # 溢出按 2^64 取模，再对梅森素数取模，得到一族近似独立的哈希函数
+            values = (a[p] * h + b[p]) % np.uint64(self.MERSENNE_PRIME)
+            signatures[owners[starts], p] = np.minimum.reduceat(values, starts)
+        return signatures
+
+    def _candidate_pairs(self, entities: List[Dict[str, Any]]) -> Set[Tuple[int, int]]:
+        pairs: Set[Tuple[int, int]] = set()
+
+        def add_bucket(members):
+            if 1 < len(members) <= self.MAX_BUCKET:
+                pairs.update(combinations(sorted(set(members)), 2))
+
+        # 1. MinHash LSH 分带
+        signatures = self._minhash_signatures(entities)
+        rows = self.NUM_PERM // self.BANDS
+        for band in range(self.BANDS):
+            buckets: Dict[bytes, List[int]] = {}
+            block = np.ascontiguousarray(signatures[:, band * rows:(band + 1) * rows])
+            for i in range(len(entities)):
+                if entities[i]['terms']:
+                    buckets.setdefault(block[i].tobytes(), []).append(i)
+            for members in buckets.values():
+                add_bucket(members)
+
+        # 2. 名称/别名完全相同，或一方为另一方的前缀/后缀
+        term_owners: Dict[str, List[int]] = {}
+        for i, e in enumerate(entities):
+            for term in e['terms']:
+                term_owners.setdefault(term, []).append(i)
+        for members in term_owners.values():
+            add_bucket(members)
+        for i, e in enumerate(entities):
+            affixes = set()
+            for term in e['terms']:
+                for k in range(1, len(term)):
+                    affixes.add(term[:k])
+                    affixes.add(term[k:])
+            for affix in affixes:
+                owners = term_owners.get(affix)
+                if owners and len(owners) <= self.MAX_BUCKET:
+                    pairs.update((min(i, j), max(i, j)) for j in owners if j != i)
+        return pairs
+
+    # ------------------------------------------------------------------
+    # 打分
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _name_similarity(a: List[Tuple[str, Set[str]]], b: List[Tuple[str, Set[str]]]) -> float:
+        """各检索词两两之间 1/2-gram 集合的 Dice 系数取最大值"""
+        best = 0.0
+        for x, gx in a:
+            for y, gy in b:
+                score = 2 * len(gx & gy) / (len(gx) + len(gy))
+                if x in y or y in x:
+                    # 包含关系（如 “零” 与 “零游戏”）至少视为较高相似
+                    score = max(score, 0.8)
+                best = max(best, score)
+        return best
+
+    def _score(self, a: Dict[str, Any], b: Dict[str, Any], threshold: float) -> Optional[Dict[str, float]]:
+        """计算候选对的得分，低于 threshold 时返回 None"""
+        name_similarity = self._name_similarity(a['term_grams'], b['term_grams'])
+        alias_overlap = 1.0 if a['terms'] & b['terms'] else 0.0
+        # 彼此之间的关系不计入共同邻居
+        na, nb = a['neighbors'] - {b['name']}, b['neighbors'] - {a['name']}
+        shared = len(na & nb) / len(na | nb) if na | nb else 0.0
+        score = (self.NAME_WEIGHT * name_similarity + self.ALIAS_WEIGHT * alias_overlap
+                 + self.NEIGHBOR_WEIGHT * shared)
+        if a['type'] != b['type']:
+            score *= self.TYPE_MISMATCH_PENALTY
+        if score < threshold:
+            return None
+        return {
+            "score": round(score, 4),
+            "name_similarity": round(name_similarity, 4),
+            "alias_overlap": alias_overlap,
+            "shared_neighbors": round(shared, 4)
+        }
+
+    @staticmethod
+    def _summary(e: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "id": e['id'],
+            "name": e['name'],
+            "type": e['type'],
+            "aliases": sorted(e['aliases']),
+            "start_chapter": e['start_chapter'],
+            "property_count": e['property_count'],
+            "relationship_count": len(e['neighbors'])
+        }
+
+    def find_candidates(self, novel_id: int, threshold: float = DEFAULT_THRESHOLD, limit: int = 100) -> Dict[str, Any]:
+        """
+        返回得分不低于 threshold 的合并候选（按得分降序）。每个候选建议保留属性与关系更多的一方。
+        """
+        entities = self._load_entities(novel_id)
+        pairs = self._candidate_pairs(entities)
+
+        candidates = []
+        for i, j in pairs:
+            a, b = entities[i], entities[j]
+            scores = self._score(a, b, threshold)
+            if scores is None:
+                continue
+            keep, merge = (a, b) if (a['property_count'] + len(a['neighbors']), -a['id']) >= \
+                (b['property_count'] + len(b['neighbors']), -b['id']) else (b, a)
+            candidates.append({"keep": self._summary(keep), "merge": self._summary(merge), **scores})
+        candidates.sort(key=lambda c: (-c['score'], c['keep']['id'], c['merge']['id']))
+
+        n = len(entities)
+        return {
+            "candidates": candidates[:limit],
+            "stats": {
+                "entities": n,
+                "compared_pairs": len(pairs),
+                "all_pairs": n * (n - 1) // 2,
+                "matched": len(candidates)
+            }
+        }
+
+    # ------------------------------------------------------------------
+    # 合并
+    # ------------------------------------------------------------------
+    def _snapshot_size(self, novel_id: int) -> Dict[str, int]:
+        chapter = setting_service.get_latest_extracted_chapter(novel_id)
+        settings = setting_service.get_settings_at_chapter(novel_id, chapter)
+        return {
+            "chapter": chapter,
+            "entities": len(settings['entities']),
+            "relationships": len(settings['relationships']),
+            "bytes": len(json.dumps(settings, ensure_ascii=False).encode('utf-8'))
+        }
+
+    def apply_merges(self, novel_id: int, merges: List[Dict[str, int]]) -> Dict[str, Any]:
+        """
+        应用人工确认的合并：merges 为 [{"keep": 实体ID, "merge": 实体ID}, ...]，支持链式合并。
+        当前状态的变化按版本记录，以最新已提取章节为生效章节：
+        - 两侧当前都有的属性以保留方为准，被合并方的该属性在生效章节结束；
+        - 保留方的 `别名` 与别名表在生效章节结束旧版本并写入新版本（原别名加被合并实体的名称）；
+        - 合并后成为自环或重复的有效关系在生效章节结束。
+        合并会改写历史：被合并实体的其余属性版本（含已结束的）整体迁移到保留方，关系两端按名称改写，
+        冲突表中指向被合并名称的记录改指保留方，保留方的开始章节取两者中较早者，被合并实体随后删除。
+        因此生效章节之前的快照会以保留方的名称呈现被合并实体的历史，两侧同名属性的历史版本可能同时出现。
+        全部改写在一个事务中完成。
+        """
+        entities = {e['id']: e for e in self._load_entities(novel_id)}
+
+        # 解析合并链，得到每个被合并实体最终的保留方
+        parent: Dict[int, int] = {}
+        for item in merges:
+            keep_id, merge_id = int(item['keep']), int(item['merge'])
+            if keep_id not in entities or merge_id not in entities:
+                raise ValueError(f"Entity {keep_id if keep_id not in entities else merge_id} not found or no longer valid")
+            if keep_id == merge_id:
+                raise ValueError(f"Cannot merge entity {keep_id} into itself")
+            if merge_id in parent and parent[merge_id] != keep_id:
+                raise ValueError(f"Entity {merge_id} is merged into more than one entity")
+            parent[merge_id] = keep_id
+
+        def root(entity_id: int) -> int:
+            seen = set()
+            while entity_id in parent:
+                if entity_id in seen:
+                    raise ValueError("Merge list contains a cycle")
+                seen.add(entity_id)
+                entity_id = parent[entity_id]
+            return entity_id
+
+        groups: Dict[int, List[int]] = {}
+        for merge_id in parent:
+            groups.setdefault(root(merge_id), []).append(merge_id)
+        if not groups:
+            return {"merged": 0, "before": None, "after": None}
+
+        chapter_numbers = {e['start_chapter_id']: e['start_chapter'] for e in entities.values()}
+        before = self._snapshot_size(novel_id)
+        # 生效章节：合并后的状态从最新已提取章节起生效
+        current_chapter_id = chapter_cache_service.get_chapter_id(novel_id, before['chapter'])
+        if current_chapter_id is None:
+            current_chapter_id = max(chapter_numbers, key=chapter_numbers.get)
+        operations = []
+
+        for keep_id, merge_ids in groups.items():
+            keep = entities[keep_id]
+            aliases = set(keep['aliases'])
+            start_chapter_id = keep['start_chapter_id']
+
+            for merge_id in merge_ids:
+                merged = entities[merge_id]
+                aliases |= merged['aliases'] | {merged['name']}
+                if chapter_numbers[merged['start_chapter_id']] < chapter_numbers[start_chapter_id]:
+                    start_chapter_id = merged['start_chapter_id']
+
+                operations += [
+                    # 属性：两侧当前都有的键以保留方为准，被合并方的当前值在生效章节结束；其余版本整体迁移
+                    {"query": """
+                        UPDATE properties SET end_chapter_id = ? WHERE entity_id = ? AND end_chapter_id IS NULL
+                        AND key IN (SELECT key FROM properties WHERE entity_id = ? AND end_chapter_id IS NULL)
+                     """,
+                     "params": (current_chapter_id, merge_id, keep_id)},
+                    {"query": "UPDATE properties SET entity_id = ? WHERE entity_id = ?",
+                     "params": (keep_id, merge_id)},
+                    # 别名：迁移被合并实体的别名历史（当前别名随后统一换版）
+                    {"query": "UPDATE entity_aliases SET entity_id = ? WHERE entity_id = ?",
+                     "params": (keep_id, merge_id)},
+                    # 关系：按名称改写两端
+                    {"query": "UPDATE relationships SET subject_name = ? WHERE novel_id = ? AND subject_name = ?",
+                     "params": (keep['name'], novel_id, merged['name'])},
+                    {"query": "UPDATE relationships SET object_name = ? WHERE novel_id = ? AND object_name = ?",
+                     "params": (keep['name'], novel_id, merged['name'])},
+                    # 冲突记录改指保留方
+                    {"query": "UPDATE conflicts SET entity = ? WHERE novel_id = ? AND entity = ?",
+                     "params": (keep['name'], novel_id, merged['name'])},
+                    {"query": "DELETE FROM entities WHERE id = ?",
+                     "params": (merge_id,)}
+                ]
+
+            aliases.discard(keep['name'])
+            alias_value = ', '.join(sorted(aliases))
+            operations += [
+                {"query": "UPDATE entities SET start_chapter_id = ? WHERE id = ?",
+                 "params": (start_chapter_id, keep_id)},
+                # 合并产生的自环与重复的有效关系在生效章节结束
+                {"query": """
+                    UPDATE relationships SET end_chapter_id = ?
+                    WHERE novel_id = ? AND subject_name = ? AND object_name = ? AND end_chapter_id IS NULL
+                 """,
+                 "params": (current_chapter_id, novel_id, keep['name'], keep['name'])},
+                {"query": """
+                    UPDATE relationships SET end_chapter_id = ? WHERE novel_id = ? AND end_chapter_id IS NULL
+                    AND (subject_name = ? OR object_name = ?)
+                    AND id NOT IN (
+                        SELECT MIN(id) FROM relationships WHERE novel_id = ? AND end_chapter_id IS NULL
+                        GROUP BY subject_name, object_name, relation
+                    )
+                 """,
+                 "params": (current_chapter_id, novel_id, keep['name'], keep['name'], novel_id)},
+                # `别名` 属性：值有变化时结束当前版本并写入新版本
+                {"query": """
+                    UPDATE properties SET end_chapter_id = ?
+                    WHERE entity_id = ? AND key = '别名' AND end_chapter_id IS NULL AND value != ?
+                 """,
+                 "params": (current_chapter_id, keep_id, alias_value)},
+                {"query": """
+                    INSERT INTO properties (entity_id, key, value, start_chapter_id)
+                    SELECT ?, '别名', ?, ? WHERE NOT EXISTS (
+                        SELECT 1 FROM properties WHERE entity_id = ? AND key = '别名' AND end_chapter_id IS NULL
+                    )
+                 """,
+                 "params": (keep_id, alias_value, current_chapter_id, keep_id)}
+            ]
+            # 别名表：结束保留方（含迁移来的）当前别名，写入合并后的别名
+            operations += alias_service.alias_operations(novel_id, keep_id, sorted(aliases), current_chapter_id)
+
+        db_service.execute_transaction(operations)
+        cache_service.bump_generation(novel_id)
+        print(f"[DedupService] 小说 {novel_id} 合并了 {len(parent)} 个重复实体。")
+
+        return {
+            "merged": len(parent),
+            "groups": [{"keep": keep_id, "merged": merge_ids} for keep_id, merge_ids in groups.items()],
+            "before": before,
+            "after": self._snapshot_size(novel_id)
+        }
+
+# 单例
+dedup_service = DedupService()
@@ -0,0 +1,209 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional, Tuple
+import numpy as np
+from app.services.cache_service import cache_service
+from app.services.graph_query_service import graph_query_service, CompactGraph
+
+class GraphLayout:
+    """某章知识图谱的二维布局结果（内部坐标约位于 [-1, 1] 区间）"""
+    def __init__(self, graph: CompactGraph, positions: np.ndarray, degree: np.ndarray, warm_start_chapter: Optional[int], elapsed_ms: float):
+        self.graph = graph
+        self.positions = positions
+        self.degree = degree
+        self.warm_start_chapter = warm_start_chapter
+        self.elapsed_ms = elapsed_ms
+        self.position_map = {node_id: positions[i] for i, node_id in enumerate(graph.node_ids)}
+
+
+class GraphLayoutService:
+    """
+    服务端图布局：使用向量化的 Fruchterman-Reingold 力导向算法计算节点坐标，按 (novel, chapter) 缓存。
+    若同一小说已有相邻章节的布局，则以其坐标作为初始位置（warm start），保证章节切换时节点位置稳定。
+    """
+    MAX_CACHED_LAYOUTS = 32
+    COLD_ITERATIONS = 80
+    WARM_ITERATIONS = 30
+    # 节点数超过该值时，斥力改为对随机锚点采样计算
+    MAX_REPULSION_ANCHORS = 400
+    CHUNK_ROWS = 1024
+    OUTPUT_SCALE = 1000.0
+    GRAVITY = 0.1
+
+    def __init__(self):
+        self._cache: "OrderedDict[Tuple[int, int], Tuple[int, GraphLayout]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _find_warm_start(self, novel_id: int, chapter_number: int) -> Optional[Tuple[int, GraphLayout]]:
+        """查找同一小说中距离目标章节最近的已缓存布局（优先较早章节），代数不同也可用于初始化"""
+        best = None
+        with self._lock:
+            for (nid, chapter), (_, layout) in self._cache.items():
+                if nid != novel_id or chapter == chapter_number:
+                    continue
+                rank = (chapter > chapter_number, abs(chapter - chapter_number))
+                if best is None or rank < best[0]:
+                    best = (rank, chapter, layout)
+        return (best[1], best[2]) if best else None
+
+    def _initial_positions(self, graph: CompactGraph, seed: Optional[GraphLayout], rng) -> Tuple[np.ndarray, np.ndarray]:
+        """返回初始坐标以及哪些节点来自 warm start"""
+        n = graph.node_count
+        positions = rng.uniform(-1.0, 1.0, size=(n, 2))
+        seeded = np.zeros(n, dtype=bool)
+        if seed is None:
+            return positions, seeded
+
+        for i, node_id in enumerate(graph.node_ids):
+            pos = seed.position_map.get(node_id)
+            if pos is not None:
+                positions[i] = pos
+                seeded[i] = True
+
+        # 新节点放到已定位邻居的重心附近
+        for i in np.flatnonzero(~seeded):
+            placed = [positions[j] for j in graph.neighbors(i) if seeded[j]]
+            if placed:
+                positions[i] = np.mean(placed, axis=0) + rng.normal(0.0, 0.05, size=2)
+        return positions, seeded
+
+    def _force_layout(self, n: int, src: np.ndarray, dst: np.ndarray, positions: np.ndarray,
+                      iterations: int, temperature: float, rng) -> np.ndarray:
+        if n <= 1:
+            return np.zeros((n, 2))
+        k = 1.0 / np.sqrt(n)
+        k2 = k * k
+        pos = positions.copy()
+
+        for it in range(iterations):
+            disp = np.zeros((n, 2))
+
+            # 斥力：k^2 / d，节点多时对随机锚点采样并按比例放大
+            if n > self.MAX_REPULSION_ANCHORS:
+                anchors = rng.choice(n, size=self.MAX_REPULSION_ANCHORS, replace=False)
+                scale = n / self.MAX_REPULSION_ANCHORS
+            else:
+                anchors = np.arange(n)
+                scale = 1.0
+            ax, ay = pos[anchors, 0], pos[anchors, 1]
+            for start in range(0, n, self.CHUNK_ROWS):
+                end = start + self.CHUNK_ROWS
+                dx = pos[start:end, 0, None] - ax[None, :]
+                dy = pos[start:end, 1, None] - ay[None, :]
+                inv = (k2 * scale) / np.maximum(dx * dx + dy * dy, 1e-9)
+                disp[start:end, 0] += (dx * inv).sum(axis=1)
+                disp[start:end, 1] += (dy * inv).sum(axis=1)
+
+            # 引力：d^2 / k，沿边方向
+            if src.size:
+                delta = pos[src] - pos[dst]
+                dist = np.maximum(np.sqrt((delta ** 2).sum(axis=1)), 1e-9)
+                force = delta * (dist / k)[:, None]
+                for axis in range(2):
+                    disp[:, axis] -= np.bincount(src, weights=force[:, axis], minlength=n)
+                    disp[:, axis] += np.bincount(dst, weights=force[:, axis], minlength=n)
+
+            # 向中心的弱引力，防止不连通的分量飘散
+            disp -= pos * self.GRAVITY
+
+            length = np.maximum(np.sqrt((disp ** 2).sum(axis=1)), 1e-9)
+            step = temperature * (1.0 - it / iterations)
+            pos += disp / length[:, None] * np.minimum(length, step)[:, None]
+
+        return pos
+
+    def get_layout(self, novel_id: int, chapter_number: int) -> GraphLayout:
+        key = (novel_id, chapter_number)
+        generation = cache_service.get_generation(novel_id)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached and cached[0] == generation:
+                self._cache.move_to_end(key)
+                return cached[1]
+
+        t0 = time.perf_counter()
+        graph = graph_query_service.get_graph(novel_id, chapter_number)
+        n = graph.node_count
+        rng = np.random.default_rng(novel_id)
+
+        warm = self._find_warm_start(novel_id, chapter_number)
+        if cached:
+            # 同一章节的旧布局（设定已变更）是最好的初始位置
+            warm = (chapter_number, cached[1])
+        positions, seeded = self._initial_positions(graph, warm[1] if warm else None, rng)
+
+        edges = np.asarray(graph.endpoints, dtype=np.int64).reshape(-1, 2)
+        src, dst = edges[:, 0], edges[:, 1]
+        if warm and seeded.any():
+            positions = self._force_layout(n, src, dst, positions, self.WARM_ITERATIONS, 0.01, rng)
+        else:
+            positions = self._force_layout(n, src, dst, positions, self.COLD_ITERATIONS, 0.2, rng)
+
+        degree = np.bincount(src, minlength=n) + np.bincount(dst, minlength=n)
+        layout = GraphLayout(graph, positions, degree, warm[0] if warm else None,
+                             round((time.perf_counter() - t0) * 1000, 2))
+
+        with self._lock:
+            self._cache[key] = (generation, layout)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.MAX_CACHED_LAYOUTS:
+                self._cache.popitem(last=False)
+        return layout
+
+    def get_layout_view(self, novel_id: int, chapter_number: int, top_k: Optional[int] = None,
+                        collapse_leaves: bool = False) -> Dict[str, Any]:
+        """
+        返回带坐标的节点与边，并按细节层级（LOD）裁剪：
+        collapse_leaves 将度为 1 的叶子节点折叠进其邻居（邻居的 collapsed 计数加一）；
+        top_k 只保留度数最高的 k 个节点。
+        """
+        layout = self.get_layout(novel_id, chapter_number)
+        graph = layout.graph
+        n = graph.node_count
+        keep = np.ones(n, dtype=bool)
+        collapsed = np.zeros(n, dtype=np.int64)
+
+        if collapse_leaves and n:
+            leaves = np.flatnonzero(layout.degree == 1)
+            for leaf in leaves:
+                neighbor = graph.neighbors(leaf)[0]
+                # 两个叶子互连时保留其中一个
+                if keep[neighbor] and layout.degree[neighbor] > 1:
+                    keep[leaf] = False
+                    collapsed[neighbor] += 1
+
+        if top_k is not None and top_k < int(keep.sum()):
+            candidates = np.flatnonzero(keep)
+            order = np.argsort(-layout.degree[candidates], kind='stable')
+            keep[:] = False
+            keep[candidates[order[:max(0, top_k)]]] = True
+
+        coords = np.round(layout.positions * self.OUTPUT_SCALE, 2)
+        nodes = [{
+            "id": graph.node_ids[i],
+            "name": graph.names[i],
+            "category": graph.categories[i],
+            "x": float(coords[i, 0]),
+            "y": float(coords[i, 1]),
+            "degree": int(layout.degree[i]),
+            "collapsed": int(collapsed[i])
+        } for i in np.flatnonzero(keep)]
+
+        links = [link for link, (s, t) in zip(graph.links, graph.endpoints) if keep[s] and keep[t]]
+
+        return {
+            "nodes": nodes,
+            "links": links,
+            "stats": {
+                "total_nodes": n,
+                "total_links": len(graph.links),
+                "nodes": len(nodes),
+                "links": len(links),
+                "warm_start_chapter": layout.warm_start_chapter,
+                "layout_ms": layout.elapsed_ms
+            }
+        }
+
+# 单例
+graph_layout_service = GraphLayoutService()
@@ -0,0 +1,263 @@
+import heapq
+import threading
+from collections import OrderedDict, deque
+from typing import Dict, List, Any, Optional, Tuple, Set
+from app.services.setting_service import setting_service
+from app.services.graph_service import graph_service
+from app.services.cache_service import cache_service
+
+class CompactGraph:
+    """
+    某章知识图谱的紧凑邻接结构（CSR）。
+    节点用连续整数下标表示；第 i 个节点的邻居为 indices[indptr[i]:indptr[i+1]]，
+    edge_ids 中同位置记录对应的边在 links 中的下标。图按无向图处理。
+    """
+    def __init__(self, graph: Dict[str, List[Dict]]):
+        nodes = graph['nodes']
+        self.links = graph['links']
+        self.node_ids = [n['id'] for n in nodes]
+        self.index = {node_id: i for i, node_id in enumerate(self.node_ids)}
+        self.name_index = {n['name']: i for i, n in enumerate(nodes)}
+        self.names = [n['name'] for n in nodes]
+        self.categories = [n['category'] for n in nodes]
+
+        node_count = len(nodes)
+        degree = [0] * (node_count + 1)
+        # 有向边的 (source, target) 下标，与 links 一一对应
+        self.endpoints = endpoints = []
+        for link in self.links:
+            s = self.index[link['source']]
+            t = self.index[link['target']]
+            endpoints.append((s, t))
+            degree[s + 1] += 1
+            degree[t + 1] += 1
+
+        for i in range(node_count):
+            degree[i + 1] += degree[i]
+        self.indptr = degree
+
+        cursor = self.indptr[:-1]
+        self.indices = [0] * self.indptr[-1]
+        self.edge_ids = [0] * self.indptr[-1]
+        for edge_id, (s, t) in enumerate(endpoints):
+            self.indices[cursor[s]] = t
+            self.edge_ids[cursor[s]] = edge_id
+            cursor[s] += 1
+            self.indices[cursor[t]] = s
+            self.edge_ids[cursor[t]] = edge_id
+            cursor[t] += 1
+
+    @property
+    def node_count(self) -> int:
+        return len(self.node_ids)
+
+    def neighbors(self, i: int):
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+    def resolve(self, node_id: Optional[str] = None, name: Optional[str] = None) -> Optional[int]:
+        if node_id is not None and node_id in self.index:
+            return self.index[node_id]
+        if name is not None:
+            return self.name_index.get(name)
+        return None
+
+    def edge_between(self, a: int, b: int) -> Dict[str, Any]:
+        """返回 a、b 之间的一条边，优先使用 a -> b 方向（保持原始方向和 relation 名称）"""
+        fallback = None
+        for pos in range(self.indptr[a], self.indptr[a + 1]):
+            if self.indices[pos] != b:
+                continue
+            link = self.links[self.edge_ids[pos]]
+            if link['source'] == self.node_ids[a]:
+                return link
+            if fallback is None:
+                fallback = link
+        if fallback is not None:
+            return fallback
+        # 没有直接对应关系时，使用占位信息
+        return {"source": self.node_ids[a], "target": self.node_ids[b], "value": None}
+
+
+class GraphQueryService:
+    """
+    图查询服务：按 (novel, chapter) 缓存紧凑邻接结构，提供最短路径、k 条最短路径与 k 跳邻域查询。
+    缓存依据小说写入代数失效，设定发生变更后会自动重建。
+    """
+    MAX_CACHED_GRAPHS = 32
+    MAX_K_PATHS = 10
+
+    def __init__(self):
+        self._cache: "OrderedDict[Tuple[int, int], Tuple[int, CompactGraph]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_graph(self, novel_id: int, chapter_number: int) -> CompactGraph:
+        key = (novel_id, chapter_number)
+        generation = cache_service.get_generation(novel_id)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached and cached[0] == generation:
+                self._cache.move_to_end(key)
+                return cached[1]
+
+        settings = setting_service.get_settings_at_chapter(novel_id, chapter_number)
+        graph = CompactGraph(graph_service.build_graph(settings))
+
+        with self._lock:
+            self._cache[key] = (generation, graph)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.MAX_CACHED_GRAPHS:
+                self._cache.popitem(last=False)
+        return graph
+
+    def _path_result(self, graph: CompactGraph, path: List[int]) -> Dict[str, Any]:
+        return {
+            "path_nodes": [graph.node_ids[i] for i in path],
+            "path_links": [graph.edge_between(path[i], path[i + 1]) for i in range(len(path) - 1)]
+        }
+
+    def _bidirectional_bfs(self, graph: CompactGraph, source: int, target: int,
+                           banned_nodes: Optional[Set[int]] = None,
+                           banned_edges: Optional[Set[Tuple[int, int]]] = None) -> Optional[List[int]]:
+        """双向 BFS，每次扩展较小的一侧前沿。返回节点下标路径，找不到时返回 None。"""
+        if source == target:
+            return [source]
+        banned_nodes = banned_nodes or set()
+        banned_edges = banned_edges or set()
+        indptr, indices = graph.indptr, graph.indices
+
+        prev_fwd = {source: None}
+        prev_bwd = {target: None}
+        frontier_fwd = [source]
+        frontier_bwd = [target]
+
+        while frontier_fwd and frontier_bwd:
+            forward = len(frontier_fwd) <= len(frontier_bwd)
+            frontier = frontier_fwd if forward else frontier_bwd
+            visited = prev_fwd if forward else prev_bwd
+            other = prev_bwd if forward else prev_fwd
+
+            next_frontier = []
+            meet = None
+            for cur in frontier:
+                for pos in range(indptr[cur], indptr[cur + 1]):
+                    nb = indices[pos]
+                    if nb in visited or nb in banned_nodes:
+                        continue
+                    if banned_edges and ((cur, nb) in banned_edges or (nb, cur) in banned_edges):
+                        continue
+                    visited[nb] = cur
+                    if nb in other:
+                        meet = nb
+                        break
+                    next_frontier.append(nb)
+                if meet is not None:
+                    break
+
+            if meet is not None:
+                path = []
+                cur = meet
+                while cur is not None:
+                    path.append(cur)
+                    cur = prev_fwd[cur]
+                path.reverse()
+                cur = prev_bwd[meet]
+                while cur is not None:
+                    path.append(cur)
+                    cur = prev_bwd[cur]
+                return path
+
+            if forward:
+                frontier_fwd = next_frontier
+            else:
+                frontier_bwd = next_frontier
+        return None
+
+    def shortest_path(self, novel_id: int, chapter_number: int, source: int, target: int) -> Optional[Dict[str, Any]]:
+        graph = self.get_graph(novel_id, chapter_number)
+        path = self._bidirectional_bfs(graph, source, target)
+        return self._path_result(graph, path) if path else None
+
+    def k_shortest_paths(self, novel_id: int, chapter_number: int, source: int, target: int, k: int) -> List[Dict[str, Any]]:
+        """
+        Yen 算法求前 k 条无环最短路径（边权均为 1）。
+        """
+        graph = self.get_graph(novel_id, chapter_number)
+        k = max(1, min(k, self.MAX_K_PATHS))
+
+        first = self._bidirectional_bfs(graph, source, target)
+        if not first:
+            return []
+
+        paths = [first]
+        seen = {tuple(first)}
+        candidates = []
+        counter = 0  # 长度相同时按发现顺序出队
+
+        while len(paths) < k:
+            last = paths[-1]
+            for i in range(len(last) - 1):
+                spur = last[i]
+                root = last[:i + 1]
+
+                banned_edges = set()
+                for p in paths:
+                    if len(p) > i and p[:i + 1] == root:
+                        banned_edges.add((p[i], p[i + 1]))
+                banned_nodes = set(root[:-1])
+
+                spur_path = self._bidirectional_bfs(graph, spur, target, banned_nodes, banned_edges)
+                if not spur_path:
+                    continue
+                candidate = root[:-1] + spur_path
+                key = tuple(candidate)
+                if key in seen:
+                    continue
+                seen.add(key)
+                heapq.heappush(candidates, (len(candidate), counter, candidate))
+                counter += 1
+
+            if not candidates:
+                break
+            paths.append(heapq.heappop(candidates)[2])
+
+        return [self._path_result(graph, p) for p in paths]
+
+    def ego_network(self, novel_id: int, chapter_number: int, center: int, hops: int, max_nodes: int) -> Dict[str, Any]:
+        """
+        k 跳邻域：从中心节点做 BFS，最多扩展 hops 层，节点数达到 max_nodes 时截断。
+        返回子图中的节点 ID、每个节点的跳数以及两端均在子图中的边。
+        """
+        graph = self.get_graph(novel_id, chapter_number)
+        distance = {center: 0}
+        queue = deque([center])
+        truncated = False
+
+        while queue and not truncated:
+            cur = queue.popleft()
+            if distance[cur] >= hops:
+                continue
+            for nb in graph.neighbors(cur):
+                if nb in distance:
+                    continue
+                if len(distance) >= max_nodes:
+                    truncated = True
+                    break
+                distance[nb] = distance[cur] + 1
+                queue.append(nb)
+
+        edge_ids = set()
+        for cur in distance:
+            for pos in range(graph.indptr[cur], graph.indptr[cur + 1]):
+                if graph.indices[pos] in distance:
+                    edge_ids.add(graph.edge_ids[pos])
+        links = [graph.links[edge_id] for edge_id in sorted(edge_ids)]
+
+        return {
+            "center": graph.node_ids[center],
+            "nodes": [{"id": graph.node_ids[i], "name": graph.names[i], "hop": d} for i, d in distance.items()],
+            "links": links,
+            "truncated": truncated
+        }
+
+# 单例
+graph_query_service = GraphQueryService()
@@ -0,0 +1,215 @@
+import sqlite3
+import time
+from typing import Dict, List, Any, Optional, Set, Iterable, Iterator
+from app.services.setting_service import setting_service
+
+# 两章之间开始或结束的设定记录数超过目标章实体数的该比例时，增量改为按完整快照比较
+# （部分快照按实体读取属性，变化面大时反而比完整快照慢）
+DELTA_PARTIAL_MAX_SHARE = 0.25
+
+class GraphService:
+    """
+    知识图谱构建服务：把某章结束时的设定快照转换为前端使用的 nodes / links 结构，
+    并支持相对于客户端已有章节的增量（delta）结果。
+    """
+
+    def _get_updated_entity_names(self, novel_id: int, chapter_number: int, n: int) -> Set[str]:
+        """获取最近 n 章内发生变更的实体名称（用于 is_new 标记）"""
+        if n > 1:
+            changes = setting_service.get_changes_in_range(novel_id, chapter_number, n)
+            return changes.get('updated_entity_names', set())
+
+        # 兼容旧的单章查询
+        changes = setting_service.get_chapter_changes(novel_id, chapter_number)
+        updated_entity_names = {e['name'] for e in changes.get('new_entities', [])}
+        # Add entities with updated properties
+        updated_entity_names.update(p['entity_name'] for p in changes.get('new_properties', []))
+        # Add entities with updated relationships
+        for r in changes.get('new_relationships', []):
+            updated_entity_names.add(r['subject_name'])
+            updated_entity_names.add(r['object_name'])
+        return updated_entity_names
+
+    def build_graph(self, settings: Dict[str, Any], updated_entity_names: Optional[Set[str]] = None) -> Dict[str, List[Dict]]:
+        """
+        由设定快照构建图结构。名称到节点ID的映射只构建一次，整体复杂度为 O(N + R)。
+        部分快照（get_settings_for_names）的 endpoint_ids 提供不在 entities 中的边端点，只用于连边，不产出节点。
+        """
+        nodes_map: Dict[str, str] = {name: str(entity_id) for name, entity_id in settings.get('endpoint_ids', {}).items()}
+        nodes = list(self._iter_nodes(settings.get('entities', []), updated_entity_names or set(), nodes_map))
+        links = list(self._iter_links(settings.get('relationships', []), nodes_map))
+        return {"nodes": nodes, "links": links}
+
+    def _iter_nodes(self, entities: Iterable[Dict[str, Any]], updated_entity_names: Set[str],
+                    nodes_map: Dict[str, str]) -> Iterator[Dict[str, Any]]:
+        # 注意：如果存在同名实体，映射会以后出现的实体为准。
+        # 在当前数据模型下，我们假设实体名称是唯一的。
+        for entity in entities:
+            node_id = str(entity['id'])
+            nodes_map[entity['name']] = node_id
+            yield {
+                "id": node_id,
+                "name": entity['name'],
+                "category": entity['type'],
+                "properties": entity.get('properties', {}),
+                "is_new": entity['name'] in updated_entity_names,
+                # 向前端传递 start_chapter_id 以便进行更灵活的过滤
+                "start_chapter": entity.get('start_chapter_id')
+            }
+
+    def _iter_links(self, relationships: Iterable[Dict[str, Any]], nodes_map: Dict[str, str]) -> Iterator[Dict[str, Any]]:
+        # 依赖 _iter_nodes 填充的 nodes_map，必须在节点全部产出后再迭代
+        for rel in relationships:
+            source_id = nodes_map.get(rel['subject'])
+            target_id = nodes_map.get(rel['object'])
+            if source_id and target_id:
+                yield {
+                    "source": source_id,
+                    "target": target_id,
+                    "value": rel['relation']
+                }
+
+    def get_knowledge_graph(self, novel_id: int, chapter_number: int, n: int = 1) -> Dict[str, Any]:
+        """
+        获取指定章节的完整知识图谱。
+        """
+        t0 = time.perf_counter()
+        settings = setting_service.get_settings_at_chapter(novel_id, chapter_number)
+        t1 = time.perf_counter()
+        updated_entity_names = self._get_updated_entity_names(novel_id, chapter_number, n)
+        graph = self.build_graph(settings, updated_entity_names)
+        t2 = time.perf_counter()
+
+        graph["stats"] = {
+            "nodes": len(graph["nodes"]),
+            "links": len(graph["links"]),
+            "snapshot_ms": round((t1 - t0) * 1000, 2),
+            "build_ms": round((t2 - t1) * 1000, 2)
+        }
+        return graph
+
+    def iter_knowledge_graph(self, novel_id: int, chapter_number: int, n: int = 1,
+                             conn: Optional[sqlite3.Connection] = None) -> Dict[str, Any]:
+        """
+        流式版本的 get_knowledge_graph：nodes / links 为迭代器，快照按需从数据库逐行读取；
+        stats 为可调用对象，在 nodes 与 links 输出完毕后求值（build_ms 为整个流式构建耗时）。
+        conn 见 setting_service.iter_settings_at_chapter。
+        """
+        t0 = time.perf_counter()
+        updated_entity_names = self._get_updated_entity_names(novel_id, chapter_number, n)
+        snapshot = setting_service.iter_settings_at_chapter(novel_id, chapter_number, conn)
+        nodes_map: Dict[str, str] = {}
+        counts = {"nodes": 0, "links": 0}
+
+        def counted(items: Iterator[Dict[str, Any]], key: str) -> Iterator[Dict[str, Any]]:
+            for item in items:
+                counts[key] += 1
+                yield item
+
+        def stats() -> Dict[str, Any]:
+            return {**counts, "build_ms": round((time.perf_counter() - t0) * 1000, 2)}
+
+        return {
+            "nodes": counted(self._iter_nodes(snapshot["entities"], updated_entity_names, nodes_map), "nodes"),
+            "links": counted(self._iter_links(snapshot["relationships"], nodes_map), "links"),
+            "stats": stats
+        }
+
+    def diff_graphs(self, base: Dict[str, List[Dict]], target: Dict[str, List[Dict]]) -> Dict[str, Any]:
+        """
+        计算两个图之间的差异。节点按 id 比较；边按 (source, target, value) 比较，
+        关系名变化表现为一条边被移除、另一条边被新增。
+        """
+        base_nodes = {n['id']: n for n in base['nodes']}
+        target_nodes = {n['id']: n for n in target['nodes']}
+
+        added_nodes = []
+        changed_nodes = []
+        for node_id, node in target_nodes.items():
+            old = base_nodes.get(node_id)
+            if old is None:
+                added_nodes.append(node)
+            elif old != node:
+                changed_nodes.append(node)
+        removed_nodes = [node_id for node_id in base_nodes if node_id not in target_nodes]
+
+        def link_key(link):
+            return (link['source'], link['target'], link['value'])
+
+        base_links = {link_key(l) for l in base['links']}
+        target_links = {link_key(l) for l in target['links']}
+
+        added_links = [l for l in target['links'] if link_key(l) not in base_links]
+        removed_links = [l for l in base['links'] if link_key(l) not in target_links]
+
+        return {
+            "added_nodes": added_nodes,
+            "changed_nodes": changed_nodes,
+            "removed_nodes": removed_nodes,
+            "added_links": added_links,
+            "removed_links": removed_links
+        }
+
+    def _changed_entity_names(self, novel_id: int, base_chapter: int, chapter_number: int,
+                              updated_base: Set[str], updated_target: Set[str]) -> Optional[Set[str]]:
+        """
+        两章之间节点可能不同的实体名称：区间 (base, target] 内变化的实体、属性与关系涉及的名称，
+        以及 is_new 标记翻转的名称。其余实体的节点以及两端都不在其中的边在两章完全相同。章节不存在时返回 None。
+        """
+        diff = setting_service.get_settings_diff(novel_id, base_chapter, chapter_number)
+        if diff is None:
+            return None
+        names = updated_base ^ updated_target
+        for group in diff["entities"].values():
+            names.update(e['name'] for e in group)
+        for group in diff["properties"].values():
+            names.update(p['entity'] for p in group)
+        for group in diff["relationships"].values():
+            for r in group:
+                names.update((r['subject'], r['object']))
+        return names
+
+    def get_knowledge_graph_delta(self, novel_id: int, chapter_number: int, base_chapter: int, n: int = 1) -> Dict[str, Any]:
+        """
+        获取相对于 base_chapter 的知识图谱增量。
+        客户端已持有 base_chapter 的图（使用相同的 n），只需应用返回的增删改即可得到 chapter_number 的图。
+        一般情况下服务端不构建两章的完整图：先由区间数据找出两章之间发生变化的实体，
+        只读取与这些实体相关的部分快照（setting_service.get_settings_for_names）构建子图后比较，
+        开销与两章之间的变更数量成正比；变更记录数超过 DELTA_PARTIAL_MAX_SHARE 时仍按完整快照比较。
+        """
+        t0 = time.perf_counter()
+        updated_base = self._get_updated_entity_names(novel_id, base_chapter, n)
+        updated_target = self._get_updated_entity_names(novel_id, chapter_number, n)
+        changes = setting_service.count_changes_between(novel_id, base_chapter, chapter_number)
+        partial = changes is not None and \
+            changes <= DELTA_PARTIAL_MAX_SHARE * setting_service.count_entities_at_chapter(novel_id, chapter_number)
+        names = None
+        if partial:
+            names = self._changed_entity_names(novel_id, base_chapter, chapter_number, updated_base, updated_target)
+            partial = names is not None
+        if not partial:
+            # 章节不存在（快照为空）或两章相差较大：按完整快照比较
+            base_settings = setting_service.get_settings_at_chapter(novel_id, base_chapter)
+            target_settings = setting_service.get_settings_at_chapter(novel_id, chapter_number)
+        else:
+            base_settings = setting_service.get_settings_for_names(novel_id, base_chapter, names)
+            target_settings = setting_service.get_settings_for_names(novel_id, chapter_number, names)
+        base_graph = self.build_graph(base_settings, updated_base)
+        target_graph = self.build_graph(target_settings, updated_target)
+        t1 = time.perf_counter()
+        delta = self.diff_graphs(base_graph, target_graph)
+        t2 = time.perf_counter()
+
+        delta["base_chapter"] = base_chapter
+        delta["chapter"] = chapter_number
+        delta["stats"] = {
+            "changed_entities": len(names) if names is not None else None,
+            "partial": partial,
+            "changed_items": sum(len(v) for v in delta.values() if isinstance(v, list)),
+            "build_ms": round((t1 - t0) * 1000, 2),
+            "diff_ms": round((t2 - t1) * 1000, 2)
+        }
+        return delta
+
+# 单例
+graph_service = GraphService()
@@ -0,0 +1,194 @@
+import re
+import threading
+import time
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Tuple
+
+# 直方图默认分桶（秒）
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# 每个请求的 SQL 次数分桶
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000)
+# SQL 模板标签的数量上限，超出后归入 "other"，避免标签基数无限增长
+MAX_STATEMENT_LABELS = 300
+
+_WHITESPACE_RE = re.compile(r'\s+')
+_PLACEHOLDER_LIST_RE = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    if not names:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in values)
+    return '{' + ','.join(f'{n}="{v}"' for n, v in zip(names, escaped)) + '}'
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name, self.help, self.labels = name, help_text, labels
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values: str, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for values, total in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labels, values)} {total:g}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help_text, labels, buckets
+        # 标签值 -> [各分桶计数..., 总和, 次数]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str):
+        with self._lock:
+            data = self._values.get(label_values)
+            if data is None:
+                data = self._values[label_values] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[i] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        names = self.labels + ('le',)
+        with self._lock:
+            for values, data in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, data):
+                    lines.append(f'{self.name}_bucket{_format_labels(names, values + (f"{bound:g}",))} {count:g}')
+                lines.append(f'{self.name}_bucket{_format_labels(names, values + ("+Inf",))} {data[-1]:g}')
+                lines.append(f'{self.name}_sum{_format_labels(self.labels, values)} {data[-2]:g}')
+                lines.append(f'{self.name}_count{_format_labels(self.labels, values)} {data[-1]:g}')
+        return lines
+
+
+class RequestTimings:
+    """单个请求内累计的各类耗时（毫秒）与次数，用于 Server-Timing 响应头"""
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.values: Dict[str, List[float]] = {}
+
+    def add(self, kind: str, seconds: float):
+        entry = self.values.setdefault(kind, [0.0, 0])
+        entry[0] += seconds * 1000
+        entry[1] += 1
+
+    def count(self, kind: str) -> int:
+        return int(self.values.get(kind, (0, 0))[1])
+
+    def server_timing(self) -> str:
+        parts = [f'{kind};dur={ms:.2f};desc="{count} calls"' for kind, (ms, count) in self.values.items()]
+        parts.append(f'total;dur={(time.perf_counter() - self.start) * 1000:.2f}')
+        return ', '.join(parts)
+
+_request_timings: ContextVar[Optional[RequestTimings]] = ContextVar('request_timings', default=None)
+
+
+class MetricsService:
+    """
+    进程内指标：SQL（按语句模板）、AI 调用、JSON 编码与 HTTP 请求的计数与耗时直方图，
+    以 Prometheus 文本格式输出。请求内的累计耗时通过 ContextVar 记录，供 Server-Timing 响应头使用。
+    本模块不依赖其它服务，db_service / ai_service 直接调用 observe_* 上报。
+    """
+    def __init__(self):
+        self.http_duration = Histogram('http_request_duration_seconds', 'HTTP 请求耗时', ('endpoint', 'method', 'status'))
+        self.http_queries = Histogram('http_request_db_queries', '单个请求执行的 SQL 语句数', ('endpoint',), QUERY_COUNT_BUCKETS)
+        self.db_duration = Histogram('db_query_duration_seconds', 'SQL 语句耗时（按语句模板）', ('statement',))
+        self.db_errors = Counter('db_query_errors_total', 'SQL 执行失败次数', ('statement',))
+        self.ai_duration = Histogram('ai_request_duration_seconds', '模型调用耗时', ('operation', 'outcome'))
+        self.ai_requests = Counter('ai_requests_total', '模型调用次数（按 API key 序号）', ('operation', 'key', 'outcome'))
+        self.ai_retries = Counter('ai_retries_total', '模型调用重试次数', ('operation',))
+        self.ai_tokens = Counter('ai_tokens_total', '模型调用消耗的 token 数', ('operation', 'kind'))
+        self.ai_first_token = Histogram('ai_first_token_seconds', '流式模型调用的首个 token 延迟', ('operation',))
+        self.json_duration = Histogram('json_encode_duration_seconds', 'JSON 编码耗时', ('endpoint',))
+        self._metrics = [self.http_duration, self.http_queries, self.db_duration, self.db_errors,
+                         self.ai_duration, self.ai_requests, self.ai_retries, self.ai_tokens, self.ai_first_token,
+                         self.json_duration]
+        self._collectors: List[Callable[[], List[str]]] = []
+        self._statements: Dict[str, str] = {}  # 原始语句 -> 模板标签
+        self._labels: set = set()
+        self._lock = threading.Lock()
+
+    # ---- 请求生命周期 ----
+    def begin_request(self):
+        return _request_timings.set(RequestTimings())
+
+    def end_request(self, token, endpoint: str, method: str, status: int) -> Optional[RequestTimings]:
+        timings = _request_timings.get()
+        _request_timings.reset(token)
+        if timings is None:
+            return None
+        self.http_duration.observe(time.perf_counter() - timings.start, endpoint, method, str(status))
+        self.http_queries.observe(timings.count('db'), endpoint)
+        return timings
+
+    def _add_timing(self, kind: str, seconds: float):
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.add(kind, seconds)
+
+    # ---- 上报 ----
+    def statement_label(self, query: str) -> str:
+        """SQL 语句模板：压缩空白，IN (?, ?, ...) 折叠为 IN (?...)，截断过长语句"""
+        label = self._statements.get(query)
+        if label is None:
+            label = _PLACEHOLDER_LIST_RE.sub('(?...)', _WHITESPACE_RE.sub(' ', query).strip())[:160]
+            with self._lock:
+                if label not in self._labels:
+                    if len(self._labels) >= MAX_STATEMENT_LABELS:
+                        label = 'other'
+                    else:
+                        self._labels.add(label)
+                if len(self._statements) < 10 * MAX_STATEMENT_LABELS:
+                    self._statements[query] = label
+        return label
+
+    def observe_db(self, query: str, seconds: float, failed: bool = False):
+        label = self.statement_label(query)
+        self.db_duration.observe(seconds, label)
+        if failed:
+            self.db_errors.inc(label)
+        self._add_timing('db', seconds)
+
+    def observe_ai(self, operation: str, seconds: float, key_index: int, outcome: str,
+                   prompt_tokens: int = 0, completion_tokens: int = 0, retry: bool = False):
+        self.ai_duration.observe(seconds, operation, outcome)
+        self.ai_requests.inc(operation, str(key_index), outcome)
+        if retry:
+            self.ai_retries.inc(operation)
+        if prompt_tokens:
+            self.ai_tokens.inc(operation, 'prompt', amount=prompt_tokens)
+        if completion_tokens:
+            self.ai_tokens.inc(operation, 'completion', amount=completion_tokens)
+        self._add_timing('ai', seconds)
+
+    def observe_ai_first_token(self, operation: str, seconds: float):
+        self.ai_first_token.observe(seconds, operation)
+
+    def observe_json(self, endpoint: str, seconds: float):
+        self.json_duration.observe(seconds, endpoint)
+        self._add_timing('json', seconds)
+
+    def register_collector(self, collector: Callable[[], List[str]]):
+        """注册在输出时才采集的指标（如各缓存的统计），collector 返回 Prometheus 文本行"""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            lines.extend(collector())
+        return '\n'.join(lines) + '\n'
+
+# 单例
+metrics_service = MetricsService()
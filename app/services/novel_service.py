@@ -1,5 +1,7 @@
 from typing import List, Dict, Optional
 from app.services import db_service
+from app.services.cache_service import cache_service
+from app.services.chapter_cache_service import chapter_cache_service
 
 class NovelService:
     def create_novel(self, title: str, author: str) -> Dict:
@@ -19,6 +21,8 @@ class NovelService:
     def delete_novel(self, novel_id: int) -> bool:
         # SQLite with foreign keys ON should handle cascade delete
         row_count = db_service.execute_commit("DELETE FROM novels WHERE id = ?", (novel_id,))
+        cache_service.bump_generation(novel_id)
+        chapter_cache_service.invalidate_novel(novel_id)
         return row_count > 0
 
 novel_service = NovelService()
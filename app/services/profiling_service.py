@@ -0,0 +1,172 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+# 剖析模式：cprofile 为确定性剖析（输出 .pstats），sample 为按间隔采样调用栈（输出火焰图用的 .collapsed）
+MODES = ('cprofile', 'sample')
+DEFAULT_SAMPLE_INTERVAL = 0.005
+# 最多保留的剖析结果数，超出后删除最早的
+MAX_PROFILES = 200
+# 剖析结果文件名中的 ID：时间戳（毫秒）-随机串，只含安全字符
+_PROFILE_ID_RE = re.compile(r'^[0-9]{8}T[0-9]{9}-[0-9a-f]{8}$')
+
+
+class StackSampler:
+    """后台线程按固定间隔读取目标线程的调用栈，汇总为 collapsed stack 格式（根在前，以 ; 分隔）"""
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def collapsed(self) -> str:
+        return ''.join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+class ProfileCapture:
+    """一次请求的剖析过程"""
+    def __init__(self, mode: str, sample_interval: float):
+        now = time.time()
+        # 按 ID 排序即按开始时间排序（精确到毫秒）
+        self.id = time.strftime('%Y%m%dT%H%M%S', time.localtime(now)) + f"{int(now * 1000) % 1000:03d}-{uuid.uuid4().hex[:8]}"
+        self.mode = mode
+        self.start = time.perf_counter()
+        self.profiler: Optional[cProfile.Profile] = None
+        self.sampler: Optional[StackSampler] = None
+        if mode == 'cprofile':
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        else:
+            self.sampler = StackSampler(threading.get_ident(), sample_interval)
+            self.sampler.start()
+
+    def stop(self) -> float:
+        if self.profiler is not None:
+            self.profiler.disable()
+        if self.sampler is not None:
+            self.sampler.stop()
+        return (time.perf_counter() - self.start) * 1000
+
+
+class ProfilingService:
+    """
+    按需剖析单个请求（需在配置中开启，见 profiling_routes）。cProfile 同一时刻只允许一个请求使用，
+    其余请求不剖析；采样模式互不影响。结果与元数据（同名 .json）保存在 profile_dir 下。
+    """
+    def __init__(self):
+        self.profile_dir: Optional[str] = None
+        self.sample_interval = DEFAULT_SAMPLE_INTERVAL
+        self.max_profiles = MAX_PROFILES
+        self._cprofile_lock = threading.Lock()
+
+    def configure(self, profile_dir: str, sample_interval: float = DEFAULT_SAMPLE_INTERVAL,
+                  max_profiles: int = MAX_PROFILES):
+        os.makedirs(profile_dir, exist_ok=True)
+        self.profile_dir = profile_dir
+        self.sample_interval = sample_interval
+        self.max_profiles = max_profiles
+
+    def start(self, mode: str) -> Optional[ProfileCapture]:
+        """开始剖析；cProfile 已被其它请求占用时返回 None"""
+        if mode == 'cprofile' and not self._cprofile_lock.acquire(blocking=False):
+            return None
+        try:
+            return ProfileCapture(mode, self.sample_interval)
+        except Exception:
+            if mode == 'cprofile':
+                self._cprofile_lock.release()
+            raise
+
+    def finish(self, capture: ProfileCapture, meta: Dict[str, Any]) -> bool:
+        """结束剖析并写出结果（文件名前缀为 capture.id），返回是否写入成功"""
+        try:
+            duration_ms = capture.stop()
+        finally:
+            if capture.mode == 'cprofile':
+                self._cprofile_lock.release()
+
+        profile_id = capture.id
+        base = os.path.join(self.profile_dir, profile_id)
+        try:
+            if capture.profiler is not None:
+                capture.profiler.dump_stats(base + '.pstats')
+                # 附带按累计耗时排序的文本摘要，无需本地工具即可查看
+                text = io.StringIO()
+                pstats.Stats(capture.profiler, stream=text).sort_stats('cumulative').print_stats(60)
+                with open(base + '.txt', 'w', encoding='utf-8') as f:
+                    f.write(text.getvalue())
+                files = [profile_id + '.pstats', profile_id + '.txt']
+            else:
+                with open(base + '.collapsed', 'w', encoding='utf-8') as f:
+                    f.write(capture.sampler.collapsed())
+                files = [profile_id + '.collapsed']
+            meta = dict(meta, id=profile_id, mode=capture.mode, duration_ms=round(duration_ms, 2),
+                        created_at=time.strftime('%Y-%m-%d %H:%M:%S'), files=files)
+            if capture.sampler is not None:
+                meta['samples'] = sum(capture.sampler.samples.values())
+            with open(base + '.json', 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False)
+        except OSError as e:
+            print(f"  [ProfilingService] 写入剖析结果失败: {e}")
+            return False
+        self._prune()
+        return True
+
+    def _prune(self):
+        metas = sorted(name for name in os.listdir(self.profile_dir) if name.endswith('.json'))
+        for name in metas[:max(0, len(metas) - self.max_profiles)]:
+            profile_id = name[:-len('.json')]
+            for ext in ('.json', '.pstats', '.txt', '.collapsed'):
+                try:
+                    os.remove(os.path.join(self.profile_dir, profile_id + ext))
+                except FileNotFoundError:
+                    pass
+
+    def list_profiles(self) -> List[Dict[str, Any]]:
+        """按时间倒序列出剖析结果的元数据"""
+        result = []
+        for name in sorted(os.listdir(self.profile_dir), reverse=True):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.profile_dir, name), 'r', encoding='utf-8') as f:
+                    result.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return result
+
+    def is_valid_file(self, filename: str) -> bool:
+        """下载时校验文件名，只允许本服务生成的文件"""
+        profile_id, _, ext = filename.rpartition('.')
+        return bool(_PROFILE_ID_RE.match(profile_id)) and ext in ('json', 'pstats', 'txt', 'collapsed')
+
+# 单例
+profiling_service = ProfilingService()
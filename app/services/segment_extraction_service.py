@@ -0,0 +1,191 @@
+import itertools
+import re
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+from app.services.ai_service import ai_service
+from app.services.alias_service import alias_value, split_aliases
+from app.services.trace_service import trace_service
+
+# 单次提取 Prompt 中章节正文的 token 上限（估算值）。超出时按段落拆分为多段并发提取
+SEGMENT_MAX_TOKENS = 4000
+# 超长段落在这些句末标点之后断开
+SENTENCE_END_RE = re.compile(r'(?<=[。！？!?…])')
+# 中日韩文字（每字约一个 token），其余字符约四个一个 token
+CJK_RE = re.compile(r'[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]')
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：中文按字计，其余字符四个一个（偏保守，不依赖分词器）"""
+    cjk = len(CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _pack(pieces: List[str], max_tokens: int) -> List[str]:
+    """把依次排列的片段拼接为估算 token 数不超过 max_tokens 的若干段（单个片段不超出上限）"""
+    segments, current, current_tokens = [], [], 0
+    for piece in pieces:
+        tokens = estimate_tokens(piece)
+        if current and current_tokens + tokens > max_tokens:
+            segments.append(''.join(current))
+            current, current_tokens = [], 0
+        current.append(piece)
+        current_tokens += tokens
+    if current:
+        segments.append(''.join(current))
+    return segments
+
+
+def _split_long(paragraph: str, max_tokens: int) -> List[str]:
+    """超过上限的单个段落按句末标点断开，仍超出的句子按字符数硬切"""
+    pieces = []
+    for sentence in SENTENCE_END_RE.split(paragraph):
+        while estimate_tokens(sentence) > max_tokens:
+            pieces.append(sentence[:max_tokens])
+            sentence = sentence[max_tokens:]
+        if sentence:
+            pieces.append(sentence)
+    return pieces
+
+
+def split_segments(content: str, max_tokens: int = SEGMENT_MAX_TOKENS) -> List[str]:
+    """
+    按段落边界把正文拆分为估算 token 数不超过 max_tokens 的若干段（拼接后与原文相同）。
+    超出上限的单个段落在句末断开。未超出上限的章节返回只含原文的一段。
+    """
+    if estimate_tokens(content) <= max_tokens:
+        return [content]
+    pieces = []
+    for paragraph in content.splitlines(keepends=True):
+        if estimate_tokens(paragraph) > max_tokens:
+            pieces.extend(_split_long(paragraph, max_tokens))
+        else:
+            pieces.append(paragraph)
+    return _pack(pieces, max_tokens)
+
+
+def _alias_map(settings: Dict[str, Any]) -> Dict[str, str]:
+    """快照中 别名 -> 实体名称（被多个实体共用的别名不参与归并）"""
+    owners: Dict[str, set] = {}
+    for entity in settings.get("entities", []):
+        for alias in split_aliases((entity.get("properties") or {}).get('别名')):
+            owners.setdefault(alias, set()).add(entity["name"])
+    return {alias: next(iter(names)) for alias, names in owners.items() if len(names) == 1}
+
+
+def normalize_aliases(result: Dict[str, Any]) -> Dict[str, Any]:
+    """把一次提取结果中列表形式的 `别名` 属性值规范为 ', ' 连接的字符串（就地修改并返回 result）"""
+    for entity in (result.get("new_settings") or {}).get("entities", []):
+        properties = entity.get('properties') or {}
+        if isinstance(properties.get('别名'), (list, tuple)):
+            properties['别名'] = alias_value(properties['别名'])
+    return result
+
+
+def merge_results(results: List[Dict[str, Any]], existing_settings: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    按段的顺序合并各段（已经 normalize_aliases 规范）的提取结果，结果与段的完成顺序无关：
+    - 实体按名称合并，以别名（上一章快照中的或前面各段新增的）指代的归并到对应实体；类型取第一个明确的类型；
+    - 属性后写覆盖前写，`别名` 取各段的并集；
+    - 关系按 (主体, 客体) 合并，后出现的关系覆盖前面的（与写入时同一对实体只保留一条有效关系一致）；
+    - 失效项与新增项按出现顺序互相抵消：某段新增后又被后面的段失效的设定不再新增，反之亦然。
+    """
+    aliases = _alias_map(existing_settings)
+    entities: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+    relationships: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+    invalidated: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+
+    def canonical(name):
+        return aliases.get(name, name)
+
+    for result in results:
+        new_settings = result.get("new_settings") or {}
+        for entity in new_settings.get("entities", []):
+            name = canonical(entity['name'])
+            merged = entities.setdefault(name, {"name": name, "type": entity.get('type', 'unknown'), "properties": {}})
+            if merged["type"] in (None, '', 'unknown') and entity.get('type'):
+                merged["type"] = entity['type']
+            for key, value in (entity.get('properties') or {}).items():
+                invalidated.pop(('property', name, key), None)
+                if key == '别名':
+                    names = split_aliases(merged["properties"].get(key)) + split_aliases(str(value))
+                    value = ', '.join(split_aliases(', '.join(names)))
+                    for alias in split_aliases(value):
+                        aliases.setdefault(alias, name)
+                merged["properties"][key] = value
+        for rel in new_settings.get("relationships", []):
+            subject, obj, relation = canonical(rel.get('subject')), canonical(rel.get('object')), rel.get('relation')
+            if not subject or not obj or not relation:
+                continue
+            invalidated.pop(('relationship', subject, obj, relation), None)
+            relationships.pop((subject, obj), None)
+            relationships[(subject, obj)] = relation
+        for item in result.get("invalidated_settings", []):
+            if item.get("type") == "relationship":
+                subject, obj = canonical(item.get("subject")), canonical(item.get("object"))
+                if relationships.get((subject, obj)) == item.get("relation"):
+                    del relationships[(subject, obj)]
+                invalidated[('relationship', subject, obj, item.get("relation"))] = \
+                    {**item, "subject": subject, "object": obj}
+            elif item.get("type") == "property":
+                name = canonical(item.get("entity"))
+                if name in entities:
+                    entities[name]["properties"].pop(item.get("key"), None)
+                invalidated[('property', name, item.get("key"))] = {**item, "entity": name}
+
+    return {
+        "new_settings": {
+            "entities": list(entities.values()),
+            "relationships": [{"subject": s, "object": o, "relation": r} for (s, o), r in relationships.items()]
+        },
+        "invalidated_settings": list(invalidated.values())
+    }
+
+
+class SegmentExtractionService:
+    """
+    长章节的分段提取（map-reduce）：正文超过 SEGMENT_MAX_TOKENS 时按段落拆分，
+    各段以同一份上一章快照并发调用 ai_service.extract_settings_from_text（工作线程各自固定一个 API key），
+    再按段的顺序合并为一份结果，交给 setting_service 照常比对写入。
+    未超出上限的章节仍只调用一次模型，行为不变。
+    """
+
+    def default_concurrency(self) -> int:
+        """默认并发数：每个 key 同时一个请求"""
+        return len(ai_service.api_keys)
+
+    def extract(self, chapter_content: str, existing_settings: Dict[str, Any],
+                max_tokens: int = SEGMENT_MAX_TOKENS, concurrency: Optional[int] = None) -> Dict[str, Any]:
+        """
+        返回值与 ai_service.extract_settings_from_text 相同，`别名` 统一为字符串（normalize_aliases）；
+        任一段失败时整章提取失败。段数记入提取记录的 segments。
+        """
+        segments = split_segments(chapter_content, max_tokens)
+        trace_service.record('segments', len(segments))
+        if len(segments) == 1:
+            return normalize_aliases(ai_service.extract_settings_from_text(chapter_content, existing_settings))
+
+        concurrency = max(1, min(concurrency or self.default_concurrency(), len(segments)))
+        parent = trace_service.current()
+        key_indexes = itertools.count(ai_service.current_key_index)
+
+        def extract_segment(segment: str):
+            with trace_service.segment_trace(parent) as segment_trace:
+                return normalize_aliases(ai_service.extract_settings_from_text(segment, existing_settings)), segment_trace
+
+        executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='segment-extract',
+                                      initializer=lambda: ai_service.pin_key(next(key_indexes)))
+        t0 = time.perf_counter()
+        try:
+            outputs = [future.result() for future in [executor.submit(extract_segment, s) for s in segments]]
+        finally:
+            # 某段失败时不再等待其余各段
+            executor.shutdown(wait=False, cancel_futures=True)
+        if parent is not None:
+            parent.merge_segments([segment_trace for _, segment_trace in outputs],
+                                  (time.perf_counter() - t0) * 1000)
+        return merge_results([result for result, _ in outputs], existing_settings)
+
+# 单例
+segment_extraction_service = SegmentExtractionService()
@@ -1,6 +1,44 @@
-from typing import Dict, List, Any
+import json
+import sqlite3
+from typing import Dict, List, Any, Optional, Iterable, Iterator, Tuple
 from app.services import db_service
-from app.services.ai_service import ai_service
+from app.services.cache_service import cache_service
+from app.services.chapter_cache_service import chapter_cache_service
+from app.services.suggest_service import suggest_service
+from app.services.alias_service import alias_service, alias_value, split_aliases
+from app.services.trace_service import trace_service, ExtractionTrace
+from app.services.segment_extraction_service import segment_extraction_service
+
+class _IntervalSweep:
+    """
+    按章节 ID 递增推进，维护在当前章节有效（start_chapter_id <= 当前 < end_chapter_id）的区间记录，
+    每条记录只加入、移除各一次。
+    """
+    def __init__(self, rows: List[Dict[str, Any]]):
+        self._starts = sorted(rows, key=lambda row: row['start_chapter_id'])
+        self._ends = sorted((row for row in rows if row['end_chapter_id'] is not None),
+                            key=lambda row: row['end_chapter_id'])
+        self._next_start = self._next_end = 0
+        self.live: Dict[int, Dict[str, Any]] = {}
+        # 最近一次 advance 中加入或移除的记录
+        self.changed: List[Dict[str, Any]] = []
+
+    def advance(self, chapter_id: int) -> Dict[int, Dict[str, Any]]:
+        """推进到 chapter_id（不小于上一次的值），返回记录 ID -> 记录"""
+        starts, ends = self._starts, self._ends
+        self.changed = []
+        while self._next_start < len(starts) and starts[self._next_start]['start_chapter_id'] <= chapter_id:
+            row = starts[self._next_start]
+            if row['end_chapter_id'] is None or row['end_chapter_id'] > chapter_id:
+                self.live[row['id']] = row
+                self.changed.append(row)
+            self._next_start += 1
+        while self._next_end < len(ends) and ends[self._next_end]['end_chapter_id'] <= chapter_id:
+            if self.live.pop(ends[self._next_end]['id'], None) is not None:
+                self.changed.append(ends[self._next_end])
+            self._next_end += 1
+        return self.live
+
 
 class SettingService:
     """
@@ -11,150 +49,328 @@ class SettingService:
         """
         获取指定章节结束时的完整世界观设定。
         """
-        if chapter_number <= 0:
-            return {"entities": [], "relationships": []}
+        conn = db_service.open_read_snapshot()
+        try:
+            snapshot = self.iter_settings_at_chapter(novel_id, chapter_number, conn)
+            return {"entities": list(snapshot["entities"]), "relationships": list(snapshot["relationships"])}
+        finally:
+            conn.close()
 
-        chapters = db_service.execute_query(
-            "SELECT id FROM chapters WHERE novel_id = ? AND number = ?", 
-            (novel_id, chapter_number)
+    def iter_settings_at_chapter(self, novel_id: int, chapter_number: int,
+                                 conn: Optional[sqlite3.Connection] = None) -> Dict[str, Iterator[Dict[str, Any]]]:
+        """
+        与 get_settings_at_chapter 结构相同，但 entities / relationships 为逐行读取的迭代器，
+        用于流式输出大快照。章节不存在时两个迭代器均为空。
+        两个迭代器分别查询数据库：传入 db_service.open_read_snapshot() 的连接时两者在同一读事务中读取，
+        否则各自使用独立连接，两次读取之间的写入可能使实体与关系不一致。
+        """
+        target_chapter_id = self._chapter_id_at(novel_id, chapter_number) or 0
+        return {
+            "entities": self._iter_snapshot_entities(novel_id, target_chapter_id, conn=conn),
+            "relationships": self._iter_snapshot_relationships(novel_id, target_chapter_id, conn=conn)
+        }
+
+    def get_settings_for_names(self, novel_id: int, chapter_number: int, names: Iterable[str]) -> Dict[str, Any]:
+        """
+        chapter_number 结束时与 names 相关的部分快照：entities / relationships 与 get_settings_at_chapter 结构相同，
+        分别为 names 中的实体与主体或客体属于 names 的有效关系；endpoint_ids 为这些关系另一端实体的 名称 -> ID
+        （同名时取 ID 较大者，与完整快照中后出现的实体为准一致）。
+        """
+        target_chapter_id = self._chapter_id_at(novel_id, chapter_number) or 0
+        names = set(names)
+        relationships = list(self._iter_snapshot_relationships(novel_id, target_chapter_id, names))
+        endpoints = {name for r in relationships for name in (r['subject'], r['object'])} - names
+        rows = db_service.execute_query(
+            """
+            SELECT e.id, e.name FROM entities e
+            WHERE e.novel_id = ? AND e.start_chapter_id <= ?
+            AND (e.end_chapter_id IS NULL OR e.end_chapter_id > ?)
+            AND e.name IN (SELECT value FROM json_each(?))
+            ORDER BY e.id
+            """,
+            (novel_id, target_chapter_id, target_chapter_id, json.dumps(list(endpoints), ensure_ascii=False))
+        ) if endpoints else []
+        return {"entities": list(self._iter_snapshot_entities(novel_id, target_chapter_id, names)),
+                "relationships": relationships,
+                "endpoint_ids": {row['name']: row['id'] for row in rows}}
+
+    def count_entities_at_chapter(self, novel_id: int, chapter_number: int) -> int:
+        """chapter_number 结束时有效的实体数"""
+        target_chapter_id = self._chapter_id_at(novel_id, chapter_number) or 0
+        rows = db_service.execute_query(
+            """
+            SELECT COUNT(*) AS n FROM entities
+            WHERE novel_id = ? AND start_chapter_id <= ? AND (end_chapter_id IS NULL OR end_chapter_id > ?)
+            """,
+            (novel_id, target_chapter_id, target_chapter_id)
         )
-        if not chapters:
-            return {"entities": [], "relationships": []}
-        
-        target_chapter_id = chapters[0]['id']
+        return rows[0]['n']
+
+    def count_changes_between(self, novel_id: int, from_chapter: int, to_chapter: int) -> Optional[int]:
+        """
+        两章之间（区间端点之间）开始或结束的实体、属性与关系记录数，只按区间端点索引计数，
+        用于在计算差异前估计变化规模。章节不存在时返回 None。
+        """
+        from_id = self._chapter_id_at(novel_id, from_chapter)
+        to_id = self._chapter_id_at(novel_id, to_chapter)
+        if from_id is None or to_id is None:
+            return None
+        lo, hi = min(from_id, to_id), max(from_id, to_id)
+        rows = db_service.execute_query(
+            """
+            SELECT (SELECT COUNT(*) FROM entities WHERE novel_id = ? AND start_chapter_id > ? AND start_chapter_id <= ?)
+                 + (SELECT COUNT(*) FROM entities WHERE novel_id = ? AND end_chapter_id > ? AND end_chapter_id <= ?)
+                 + (SELECT COUNT(*) FROM properties p JOIN entities e ON p.entity_id = e.id
+                    WHERE e.novel_id = ? AND p.start_chapter_id > ? AND p.start_chapter_id <= ?)
+                 + (SELECT COUNT(*) FROM properties p JOIN entities e ON p.entity_id = e.id
+                    WHERE e.novel_id = ? AND p.end_chapter_id > ? AND p.end_chapter_id <= ?)
+                 + (SELECT COUNT(*) FROM relationships WHERE novel_id = ? AND start_chapter_id > ? AND start_chapter_id <= ?)
+                 + (SELECT COUNT(*) FROM relationships WHERE novel_id = ? AND end_chapter_id > ? AND end_chapter_id <= ?)
+                 AS n
+            """,
+            (novel_id, lo, hi) * 6
+        )
+        return rows[0]['n']
 
-        # 2. 查询有效实体
-        entities_sql = """
-            SELECT e.*, c.number as start_chapter_number
+    def _iter_snapshot_entities(self, novel_id: int, target_chapter_id: int,
+                                names: Optional[Iterable[str]] = None,
+                                conn: Optional[sqlite3.Connection] = None) -> Iterator[Dict[str, Any]]:
+        # 实体与其有效属性一次连接查询，按实体 ID 有序读取，相邻行归并为一个实体
+        # names 不为空时只读取这些名称的实体（名称列表以 JSON 数组作为单个参数传入）
+        sql = """
+            SELECT e.id, e.name, e.type, ce.number AS start_chapter_number,
+                   p.key, p.value, cp.number AS property_start_chapter
             FROM entities e
-            JOIN chapters c ON e.start_chapter_id = c.id
-            WHERE c.novel_id = ? 
-            AND e.start_chapter_id <= ? 
+            JOIN chapters ce ON e.start_chapter_id = ce.id
+            LEFT JOIN properties p ON p.entity_id = e.id
+                AND p.start_chapter_id <= ?
+                AND (p.end_chapter_id IS NULL OR p.end_chapter_id > ?)
+            LEFT JOIN chapters cp ON p.start_chapter_id = cp.id
+            WHERE ce.novel_id = ?
+            AND e.start_chapter_id <= ?
             AND (e.end_chapter_id IS NULL OR e.end_chapter_id > ?)
+            {name_filter}
+            ORDER BY e.id, p.id
         """
-        entities = db_service.execute_query(entities_sql, (novel_id, target_chapter_id, target_chapter_id))
-
-        # 3. 查询有效属性
-        formatted_entities = []
-        for entity in entities:
-            props_sql = """
-                SELECT p.key, p.value, c.number as start_chapter_number
-                FROM properties p
-                JOIN chapters c ON p.start_chapter_id = c.id
-                WHERE p.entity_id = ? 
-                AND p.start_chapter_id <= ? 
-                AND (p.end_chapter_id IS NULL OR p.end_chapter_id > ?)
-            """
-            props = db_service.execute_query(props_sql, (entity['id'], target_chapter_id, target_chapter_id))
-            
-            props_dict = {p['key']: p['value'] for p in props}
-            props_meta = {p['key']: p['start_chapter_number'] for p in props}
-            
-            formatted_entities.append({
-                "id": entity['id'],
-                "name": entity['name'],
-                "type": entity['type'],
-                "properties": props_dict,
-                "start_chapter": entity['start_chapter_number'],
-                "property_start_chapters": props_meta
-            })
+        params = (target_chapter_id, target_chapter_id, novel_id, target_chapter_id, target_chapter_id)
+        if names is not None:
+            sql = sql.format(name_filter="AND e.name IN (SELECT value FROM json_each(?))")
+            params += (json.dumps(list(names), ensure_ascii=False),)
+        else:
+            sql = sql.format(name_filter="")
+        entity = None
+        for row in db_service.iter_query(sql, params, conn):
+            if entity is None or entity["id"] != row['id']:
+                if entity is not None:
+                    yield entity
+                entity = {
+                    "id": row['id'],
+                    "name": row['name'],
+                    "type": row['type'],
+                    "properties": {},
+                    "start_chapter": row['start_chapter_number'],
+                    "property_start_chapters": {}
+                }
+            if row['key'] is not None:
+                entity["properties"][row['key']] = row['value']
+                entity["property_start_chapters"][row['key']] = row['property_start_chapter']
+        if entity is not None:
+            yield entity
 
-        # 4. 查询有效关系
-        rels_sql = """
-            SELECT r.*, c.number as start_chapter_number
+    def _iter_snapshot_relationships(self, novel_id: int, target_chapter_id: int,
+                                     names: Optional[Iterable[str]] = None,
+                                     conn: Optional[sqlite3.Connection] = None) -> Iterator[Dict[str, Any]]:
+        # names 不为空时只读取主体或客体属于 names 的关系
+        sql = """
+            SELECT r.id, r.subject_name, r.object_name, r.relation, c.number AS start_chapter_number
             FROM relationships r
             JOIN chapters c ON r.start_chapter_id = c.id
-            WHERE c.novel_id = ? 
-            AND r.start_chapter_id <= ? 
+            WHERE c.novel_id = ?
+            AND r.start_chapter_id <= ?
             AND (r.end_chapter_id IS NULL OR r.end_chapter_id > ?)
         """
-        relationships = db_service.execute_query(rels_sql, (novel_id, target_chapter_id, target_chapter_id))
-        
-        formatted_relationships = []
-        for rel in relationships:
-            formatted_relationships.append({
+        params = (novel_id, target_chapter_id, target_chapter_id)
+        if names is not None:
+            sql += """
+            AND (r.subject_name IN (SELECT value FROM json_each(?)) OR r.object_name IN (SELECT value FROM json_each(?)))
+            """
+            names_json = json.dumps(list(names), ensure_ascii=False)
+            params += (names_json, names_json)
+        for rel in db_service.iter_query(sql, params, conn):
+            yield {
                 "id": rel['id'],
                 "subject": rel['subject_name'],
                 "object": rel['object_name'],
                 "relation": rel['relation'],
                 "start_chapter": rel['start_chapter_number']
-            })
-
-        return {"entities": formatted_entities, "relationships": formatted_relationships}
+            }
 
-    def get_entity_history_in_range(self, novel_id: int, entity_name: str, start_chapter: int, end_chapter: int) -> List[Dict[str, Any]]:
+    def iter_snapshots(self, novel_id: int, start_chapter: int, end_chapter: int) -> Iterator[Tuple[int, Dict[str, Any]]]:
         """
-        获取指定实体在章节范围内的设定变更历史。
+        依次产出 (章号, 该章结束时的设定快照)，章号从 start_chapter 到 end_chapter，快照与 get_settings_at_chapter 相同。
+        用于逐章处理大段章节（如批量冲突检测）：不再每章执行一次快照查询，而是一次读出在区间内任一章有效的
+        实体、属性与关系，再按章节 ID 顺序扫描，依次加入开始于该章、移除结束于该章的记录。
+        相邻快照之间未变化的实体与关系是同一个对象，调用方不应修改快照。
         """
-        # 1. Find the entity by name
-        entities = db_service.execute_query(
-            """
-            SELECT e.id, e.type 
-            FROM entities e
-            JOIN chapters c ON e.start_chapter_id = c.id
-            WHERE c.novel_id = ? AND e.name = ?
-            """,
-            (novel_id, entity_name)
-        )
-        if not entities:
-            return []
-        
-        entity_id = entities[0]['id']
-        entity_type = entities[0]['type']
+        targets = [(number, self._chapter_id_at(novel_id, number) or 0)
+                   for number in range(max(start_chapter, 0), end_chapter + 1)]
+        ids = [tid for _, tid in targets if tid]
+        if not ids:
+            for number, _ in targets:
+                yield number, {"entities": [], "relationships": []}
+            return
+        low, high = min(ids), max(ids)
 
-        # 2. Get chapter IDs for the range
-        chapters_sql = "SELECT id, number FROM chapters WHERE novel_id = ? AND number >= ? AND number <= ? ORDER BY number"
-        chapters = db_service.execute_query(chapters_sql, (novel_id, start_chapter, end_chapter))
-        chapter_id_map = {c['id']: c['number'] for c in chapters}
-        chapter_ids = list(chapter_id_map.keys())
+        # 只读取在 [low, high] 内某一章有效的记录
+        entities = db_service.execute_query("""
+            SELECT e.id, e.name, e.type, e.start_chapter_id, e.end_chapter_id, c.number AS start_chapter_number
+            FROM entities e JOIN chapters c ON e.start_chapter_id = c.id
+            WHERE c.novel_id = ? AND e.start_chapter_id <= ? AND (e.end_chapter_id IS NULL OR e.end_chapter_id > ?)
+        """, (novel_id, high, low))
+        properties = db_service.execute_query("""
+            SELECT p.id, p.entity_id, p.key, p.value, p.start_chapter_id, p.end_chapter_id, c.number AS start_chapter_number
+            FROM properties p JOIN chapters c ON p.start_chapter_id = c.id
+            WHERE c.novel_id = ? AND p.start_chapter_id <= ? AND (p.end_chapter_id IS NULL OR p.end_chapter_id > ?)
+        """, (novel_id, high, low))
+        relationships = db_service.execute_query("""
+            SELECT r.id, r.subject_name, r.object_name, r.relation, r.start_chapter_id, r.end_chapter_id,
+                   c.number AS start_chapter_number
+            FROM relationships r JOIN chapters c ON r.start_chapter_id = c.id
+            WHERE c.novel_id = ? AND r.start_chapter_id <= ? AND (r.end_chapter_id IS NULL OR r.end_chapter_id > ?)
+        """, (novel_id, high, low))
 
-        if not chapter_ids:
-            return []
+        sweeps, position = None, None
+        for number, tid in targets:
+            if not tid:
+                # 章节不存在（或章号为 0）：与 get_settings_at_chapter 一致，返回空快照
+                yield number, {"entities": [], "relationships": []}
+                continue
+            # 章节 ID 按导入顺序分配，通常随章号递增；遇到倒序时重新开始扫描
+            if sweeps is None or tid < position:
+                sweeps = [_IntervalSweep(rows) for rows in (entities, properties, relationships)]
+                # 实体 ID -> {属性 ID: 属性}；已构造的实体与关系（未变化时在相邻快照间复用）
+                entity_props: Dict[int, Dict[int, Dict[str, Any]]] = {}
+                built_entities: Dict[int, Dict[str, Any]] = {}
+                built_relationships: Dict[int, Dict[str, Any]] = {}
+            position = tid
+            entity_sweep, property_sweep, relationship_sweep = sweeps
+            live_entities = entity_sweep.advance(tid)
+            live_properties = property_sweep.advance(tid)
+            live_relationships = relationship_sweep.advance(tid)
 
-        history = []
+            dirty = {row['id'] for row in entity_sweep.changed}
+            for prop in property_sweep.changed:
+                props = entity_props.setdefault(prop['entity_id'], {})
+                if prop['id'] in live_properties:
+                    props[prop['id']] = prop
+                else:
+                    props.pop(prop['id'], None)
+                dirty.add(prop['entity_id'])
+            for eid in dirty:
+                built_entities.pop(eid, None)
 
-        # 3. Check for entity creation
-        placeholders = ','.join('?' for _ in chapter_ids)
-        creation_sql = f"SELECT start_chapter_id FROM entities WHERE id = ? AND start_chapter_id IN ({placeholders})"
-        creation_events = db_service.execute_query(creation_sql, (entity_id, *chapter_ids))
-        for event in creation_events:
-            history.append({
-                "chapter_number": chapter_id_map[event['start_chapter_id']],
-                "change_type": "new_entity",
-                "details": {"type": entity_type}
-            })
+            snapshot_entities = []
+            for eid in sorted(live_entities):
+                entity = built_entities.get(eid)
+                if entity is None:
+                    row = live_entities[eid]
+                    entity = {"id": eid, "name": row['name'], "type": row['type'], "properties": {},
+                              "start_chapter": row['start_chapter_number'], "property_start_chapters": {}}
+                    props = entity_props.get(eid, {})
+                    for pid in sorted(props):
+                        entity["properties"][props[pid]['key']] = props[pid]['value']
+                        entity["property_start_chapters"][props[pid]['key']] = props[pid]['start_chapter_number']
+                    built_entities[eid] = entity
+                snapshot_entities.append(entity)
 
-        # 4. Check for property changes
-        props_sql = f"""
-            SELECT key, value, start_chapter_id 
-            FROM properties 
-            WHERE entity_id = ? AND start_chapter_id IN ({placeholders})
+            snapshot_relationships = []
+            for rid in sorted(live_relationships):
+                relationship = built_relationships.get(rid)
+                if relationship is None:
+                    rel = live_relationships[rid]
+                    relationship = built_relationships[rid] = {
+                        "id": rid, "subject": rel['subject_name'], "object": rel['object_name'],
+                        "relation": rel['relation'], "start_chapter": rel['start_chapter_number']}
+                snapshot_relationships.append(relationship)
+            yield number, {"entities": snapshot_entities, "relationships": snapshot_relationships}
+
+    def get_entity_history_in_range(self, novel_id: int, entity_name: str, start_chapter: int, end_chapter: int) -> List[Dict[str, Any]]:
         """
-        prop_changes = db_service.execute_query(props_sql, (entity_id, *chapter_ids))
-        
-        for prop in prop_changes:
-            history.append({
-                "chapter_number": chapter_id_map[prop['start_chapter_id']],
-                "change_type": "property_change",
-                "details": {"key": prop['key'], "value": prop['value']}
-            })
+        获取指定实体在章节范围内的设定变更历史。
+        """
+        for _, history in self.iter_entity_timelines(novel_id, start_chapter, end_chapter, names=[entity_name]):
+            return history
+        return []
+
+    def iter_entity_timelines(self, novel_id: int, start_chapter: int, end_chapter: int,
+                              names: Optional[List[str]] = None, entity_type: Optional[str] = None) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+        """
+        批量获取多个实体（names 指定名称，或 entity_type 指定类型，均为空时为全部实体）
+        在章节范围内的设定变更历史，按实体名称逐个产出 (name, history)。
+        只有一条集合查询：章节按章号区间连接过滤，名称列表以 JSON 数组作为单个参数传入，
+        结果按 (名称, 章节) 有序流式读取。范围内没有变更的实体不会产出。
+        """
+        sql = """
+            WITH target AS (
+                SELECT e.id, e.name, e.type, e.start_chapter_id FROM entities e
+                WHERE e.novel_id = ?
+                AND (? IS NULL OR e.type = ?)
+                AND (? IS NULL OR e.name IN (SELECT value FROM json_each(?)))
+            ),
+            ch AS (
+                SELECT id, number FROM chapters WHERE novel_id = ? AND number BETWEEN ? AND ?
+            )
+            SELECT t.name, ch.number AS chapter_number, 0 AS kind, t.type AS type, NULL AS key, NULL AS value
+            FROM target t JOIN ch ON t.start_chapter_id = ch.id
+            UNION ALL
+            SELECT t.name, ch.number, 1, NULL, p.key, p.value
+            FROM target t
+            JOIN properties p ON p.entity_id = t.id
+            JOIN ch ON p.start_chapter_id = ch.id
+            ORDER BY 1, 2, 3
+        """
+        names_json = json.dumps(list(names), ensure_ascii=False) if names is not None else None
+        params = (novel_id, entity_type, entity_type, names_json, names_json, novel_id, start_chapter, end_chapter)
+
+        current, history = None, []
+        for row in db_service.iter_query(sql, params):
+            if row['name'] != current:
+                if current is not None:
+                    yield current, history
+                current, history = row['name'], []
+            if row['kind'] == 0:
+                history.append({
+                    "chapter_number": row['chapter_number'],
+                    "change_type": "new_entity",
+                    "details": {"type": row['type']}
+                })
+            else:
+                history.append({
+                    "chapter_number": row['chapter_number'],
+                    "change_type": "property_change",
+                    "details": {"key": row['key'], "value": row['value']}
+                })
+        if current is not None:
+            yield current, history
 
-        history.sort(key=lambda x: x['chapter_number'])
-        return history
+    def get_entity_timelines(self, novel_id: int, start_chapter: int, end_chapter: int,
+                             names: Optional[List[str]] = None, entity_type: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        iter_entity_timelines 的列表形式：[{"name": ..., "history": [...]}, ...]
+        """
+        return [
+            {"name": name, "history": history}
+            for name, history in self.iter_entity_timelines(novel_id, start_chapter, end_chapter, names, entity_type)
+        ]
 
     def get_chapter_changes(self, novel_id: int, chapter_number: int) -> Dict[str, Any]:
         """
         获取指定章节发生的设定变更（新增、修改、失效）。
         """
-        chapters = db_service.execute_query(
-            "SELECT id FROM chapters WHERE novel_id = ? AND number = ?", 
-            (novel_id, chapter_number)
-        )
-        if not chapters:
+        target_chapter_id = chapter_cache_service.get_chapter_id(novel_id, chapter_number)
+        if target_chapter_id is None:
             return {"new_entities": [], "updated_properties": [], "new_relationships": [], "invalidated": []}
         
-        target_chapter_id = chapters[0]['id']
-        
         # 1. 新增实体
         new_entities = db_service.execute_query(
             """
@@ -216,208 +432,346 @@ class SettingService:
             "invalidated_relationships": [dict(r) for r in invalidated_rels]
         }
 
+    def _chapter_id_at(self, novel_id: int, chapter_number: int) -> Optional[int]:
+        """章号对应的章节 ID；章号为 0 表示第一章之前（返回 0，小于任何章节 ID）"""
+        if chapter_number <= 0:
+            return 0
+        return chapter_cache_service.get_chapter_id(novel_id, chapter_number)
+
+    def get_settings_diff(self, novel_id: int, from_chapter: int, to_chapter: int) -> Optional[Dict[str, Any]]:
+        """
+        计算两个章节结束时设定之间的差异（新增、删除、变更的实体/属性/关系）。
+        直接基于区间数据：对 a < b，在 b 有效而在 a 无效的记录满足 a < start <= b 且在 b 仍有效；
+        在 a 有效而在 b 无效的记录满足 a < end <= b 且 start <= a。两类查询都只按区间端点做范围扫描，
+        开销与两章之间的变更数量成正比，与世界观规模无关。from_chapter > to_chapter 时返回反向差异。
+        章节不存在时返回 None。
+        """
+        from_id = self._chapter_id_at(novel_id, from_chapter)
+        to_id = self._chapter_id_at(novel_id, to_chapter)
+        if from_id is None or to_id is None:
+            return None
+        lo, hi = min(from_id, to_id), max(from_id, to_id)
+
+        def appeared(table_sql: str, columns: str, novel_filter: str):
+            return db_service.execute_query(
+                f"""
+                SELECT {columns} FROM {table_sql}
+                WHERE {novel_filter} AND t.start_chapter_id > ? AND t.start_chapter_id <= ?
+                AND (t.end_chapter_id IS NULL OR t.end_chapter_id > ?)
+                """,
+                (novel_id, lo, hi, hi)
+            )
+
+        def disappeared(table_sql: str, columns: str, novel_filter: str):
+            return db_service.execute_query(
+                f"""
+                SELECT {columns} FROM {table_sql}
+                WHERE {novel_filter} AND t.end_chapter_id > ? AND t.end_chapter_id <= ?
+                AND t.start_chapter_id <= ?
+                """,
+                (novel_id, lo, hi, lo)
+            )
+
+        queries = {
+            "entities": ("entities t", "t.id, t.name, t.type", "t.novel_id = ?"),
+            "properties": ("properties t JOIN entities e ON t.entity_id = e.id",
+                           "t.entity_id, e.name AS entity, t.key, t.value", "e.novel_id = ?"),
+            "relationships": ("relationships t", "t.subject_name AS subject, t.object_name AS object, t.relation",
+                              "t.novel_id = ?")
+        }
+        gained = {name: appeared(*q) for name, q in queries.items()}
+        lost = {name: disappeared(*q) for name, q in queries.items()}
+        if from_id > to_id:
+            gained, lost = lost, gained
+
+        # 实体
+        entities = {
+            "added": [dict(e) for e in gained['entities']],
+            "removed": [dict(e) for e in lost['entities']]
+        }
+
+        # 属性：同一实体同一键两侧都有记录时视为变更
+        old_props = {(p['entity_id'], p['key']): p for p in lost['properties']}
+        new_props = {(p['entity_id'], p['key']): p for p in gained['properties']}
+        properties = {"added": [], "removed": [], "changed": []}
+        for key, p in new_props.items():
+            old = old_props.get(key)
+            if old is None:
+                properties['added'].append({"entity": p['entity'], "key": p['key'], "value": p['value']})
+            elif old['value'] != p['value']:
+                properties['changed'].append({"entity": p['entity'], "key": p['key'], "old_value": old['value'], "new_value": p['value']})
+        for key, p in old_props.items():
+            if key not in new_props:
+                properties['removed'].append({"entity": p['entity'], "key": p['key'], "value": p['value']})
+
+        # 关系：先抵消完全相同的记录（中途失效又恢复），同一对实体两侧都有记录时视为关系变更
+        old_rels: Dict[Tuple[str, str], List[str]] = {}
+        new_rels: Dict[Tuple[str, str], List[str]] = {}
+        for r in lost['relationships']:
+            old_rels.setdefault((r['subject'], r['object']), []).append(r['relation'])
+        for r in gained['relationships']:
+            new_rels.setdefault((r['subject'], r['object']), []).append(r['relation'])
+        relationships = {"added": [], "removed": [], "changed": []}
+        for pair in set(old_rels) | set(new_rels):
+            old = sorted(set(old_rels.get(pair, [])) - set(new_rels.get(pair, [])))
+            new = sorted(set(new_rels.get(pair, [])) - set(old_rels.get(pair, [])))
+            subject, obj = pair
+            if old and new:
+                relationships['changed'].append({"subject": subject, "object": obj, "old_relations": old, "new_relations": new})
+            else:
+                for relation in new:
+                    relationships['added'].append({"subject": subject, "object": obj, "relation": relation})
+                for relation in old:
+                    relationships['removed'].append({"subject": subject, "object": obj, "relation": relation})
+        for group in relationships.values():
+            group.sort(key=lambda r: (r['subject'], r['object']))
+
+        return {
+            "from_chapter": from_chapter,
+            "to_chapter": to_chapter,
+            "entities": entities,
+            "properties": properties,
+            "relationships": relationships,
+            "stats": {
+                name: {kind: len(items) for kind, items in section.items()}
+                for name, section in (("entities", entities), ("properties", properties), ("relationships", relationships))
+            }
+        }
+
     def extract_and_update_settings(self, novel_id: int, chapter_number: int):
         """
-        核心流程：增量提取并更新设定。
+        核心流程：增量提取并更新设定。各阶段耗时与计数记入 extraction_traces（见 trace_service）。
         """
+        with trace_service.trace_extraction(novel_id, chapter_number) as trace:
+            self._extract_and_update_settings(novel_id, chapter_number, trace)
+
+    def _extract_and_update_settings(self, novel_id: int, chapter_number: int, trace: ExtractionTrace):
         print(f"\n[SettingService] 开始处理第 {chapter_number} 章设定...")
 
-        current_chapters = db_service.execute_query(
-            "SELECT id, content FROM chapters WHERE novel_id = ? AND number = ?", 
-            (novel_id, chapter_number)
-        )
-        if not current_chapters:
+        from app.services.chapter_service import chapter_service
+
+        trace.enter('load')
+        current_chapter = chapter_service.get_chapter_content(novel_id, chapter_number)
+        if not current_chapter:
             print("  错误：找不到章节")
+            trace.save = False
             return
-        current_chapter = current_chapters[0]
         current_chapter_id = current_chapter['id']
         content = current_chapter['content']
 
+        trace.enter('snapshot')
         old_settings = self.get_settings_at_chapter(novel_id, chapter_number - 1)
         print(f"  [Context] 上一章有效实体数: {len(old_settings['entities'])}")
+        trace.add('snapshot_entities', len(old_settings['entities']))
+        trace.add('snapshot_relationships', len(old_settings['relationships']))
 
-        ai_result = ai_service.extract_settings_from_text(content, old_settings)
+        # prompt / model / parse 三个阶段由 ai_service 计时（分段提取时由各段合并）
+        trace.enter(None)
+        # 超长章节按段落拆分后并发提取并合并（segment_extraction_service），其余章节直接调用一次模型
+        ai_result = segment_extraction_service.extract(content, old_settings)
+        trace.enter('diff')
         new_settings_data = ai_result.get("new_settings", {})
         
         db_operations = []
+        # 受本次更新影响的实体名称，用于增量刷新补全索引
+        touched_names = set()
+        # 名称/别名 -> 实体解析器，使用别名指代已有实体时归并到规范名称，避免产生重复实体
+        try:
+            resolver = alias_service.get_resolver(novel_id)
         
-        new_entities = new_settings_data.get("entities", [])
+            new_entities = new_settings_data.get("entities", [])
         
-        for new_ent in new_entities:
-            name = new_ent['name']
-            ent_type = new_ent.get('type', 'unknown')
-            new_props = new_ent.get('properties', {})
-
-            existing_ent_rows = db_service.execute_query(
-                """
-                SELECT e.id FROM entities e
-                JOIN chapters c ON e.start_chapter_id = c.id
-                WHERE c.novel_id = ? AND e.name = ? 
-                AND (e.end_chapter_id IS NULL OR e.end_chapter_id > ?)
-                """,
-                (novel_id, name, current_chapter_id)
-            )
-            
-            entity_id = None
+            for new_ent in new_entities:
+                name = new_ent['name']
+                ent_type = new_ent.get('type', 'unknown')
+                new_props = new_ent.get('properties', {})
+
+                entity_id = resolver.resolve(name)
+                if entity_id is not None and resolver.entity_names[entity_id] != name:
+                    print(f"  [Alias] {name} -> {resolver.entity_names[entity_id]}")
+                    name = resolver.entity_names[entity_id]
+                touched_names.add(name)
             
-            if not existing_ent_rows:
-                print(f"  [Action] 发现新实体: {name}")
-                entity_id = db_service.execute_commit(
-                    "INSERT INTO entities (novel_id, name, type, start_chapter_id) VALUES (?, ?, ?, ?)",
-                    (novel_id, name, ent_type, current_chapter_id)
-                )
-            else:
-                entity_id = existing_ent_rows[0]['id']
+                if entity_id is None:
+                    print(f"  [Action] 发现新实体: {name}")
+                    entity_id = db_service.execute_commit(
+                        "INSERT INTO entities (novel_id, name, type, start_chapter_id) VALUES (?, ?, ?, ?)",
+                        (novel_id, name, ent_type, current_chapter_id)
+                    )
+                    trace.add('db_operations')
+                    cache_service.bump_generation(novel_id)
+                    resolver.add_entity(entity_id, name)
 
-            for key, value in new_props.items():
-                if isinstance(value, (dict, list)):
-                    import json
-                    value = json.dumps(value, ensure_ascii=False)
-                else:
-                    value = str(value)
+                for key, value in new_props.items():
+                    if key == '别名':
+                        # 列表形式的别名按分隔符连接，否则 JSON 的引号和括号会被拆进别名
+                        value = alias_value(value)
+                    elif isinstance(value, (dict, list)):
+                        import json
+                        value = json.dumps(value, ensure_ascii=False)
+                    else:
+                        value = str(value)
 
-                existing_props = db_service.execute_query(
-                    """
-                    SELECT id, value FROM properties 
-                    WHERE entity_id = ? AND key = ? 
-                    AND (end_chapter_id IS NULL OR end_chapter_id > ?)
-                    """,
-                    (entity_id, key, current_chapter_id)
-                )
+                    existing_props = db_service.execute_query(
+                        """
+                        SELECT id, value FROM properties 
+                        WHERE entity_id = ? AND key = ? 
+                        AND (end_chapter_id IS NULL OR end_chapter_id > ?)
+                        """,
+                        (entity_id, key, current_chapter_id)
+                    )
                 
-                should_insert = False
+                    should_insert = False
                 
-                if existing_props:
-                    old_prop = existing_props[0]
-                    if old_prop['value'] != value:
-                        print(f"  [Change] {name}.{key}: {old_prop['value']} -> {value}")
-                        db_operations.append({
-                            "query": "UPDATE properties SET end_chapter_id = ? WHERE id = ?",
-                            "params": (current_chapter_id, old_prop['id'])
-                        })
+                    if existing_props:
+                        old_prop = existing_props[0]
+                        if old_prop['value'] != value:
+                            print(f"  [Change] {name}.{key}: {old_prop['value']} -> {value}")
+                            db_operations.append({
+                                "query": "UPDATE properties SET end_chapter_id = ? WHERE id = ?",
+                                "params": (current_chapter_id, old_prop['id'])
+                            })
+                            should_insert = True
+                    else:
+                        print(f"  [New Prop] {name}.{key} = {value}")
                         should_insert = True
-                else:
-                    print(f"  [New Prop] {name}.{key} = {value}")
-                    should_insert = True
                 
-                if should_insert:
-                    db_operations.append({
-                        "query": "INSERT INTO properties (entity_id, key, value, start_chapter_id) VALUES (?, ?, ?, ?)",
-                        "params": (entity_id, key, value, current_chapter_id)
-                    })
+                    if should_insert:
+                        db_operations.append({
+                            "query": "INSERT INTO properties (entity_id, key, value, start_chapter_id) VALUES (?, ?, ?, ?)",
+                            "params": (entity_id, key, value, current_chapter_id)
+                        })
+                        if key == '别名':
+                            aliases = [a for a in split_aliases(value) if a != name]
+                            db_operations.extend(alias_service.alias_operations(novel_id, entity_id, aliases, current_chapter_id))
+                            resolver.set_aliases(entity_id, aliases)
 
-        new_relationships = new_settings_data.get("relationships", [])
-        for new_rel in new_relationships:
-            subj = new_rel.get('subject')
-            obj = new_rel.get('object')
-            relation = new_rel.get('relation')
-            
-            if not subj or not obj or not relation:
-                continue
-                
-            existing_rels = db_service.execute_query(
-                """
-                SELECT r.id, r.relation 
-                FROM relationships r
-                JOIN chapters c ON r.start_chapter_id = c.id
-                WHERE c.novel_id = ? AND r.subject_name = ? AND r.object_name = ? 
-                AND (r.end_chapter_id IS NULL OR r.end_chapter_id > ?)
-                """,
-                (novel_id, subj, obj, current_chapter_id)
-            )
+            new_relationships = new_settings_data.get("relationships", [])
+            for new_rel in new_relationships:
+                subj = resolver.canonical(new_rel.get('subject'))
+                obj = resolver.canonical(new_rel.get('object'))
+                relation = new_rel.get('relation')
             
-            should_insert = False
-            if existing_rels:
-                old_rel = existing_rels[0]
-                if old_rel['relation'] != relation:
-                    print(f"  [Change Rel] {subj} -> {obj}: {old_rel['relation']} -> {relation}")
-                    db_operations.append({
-                        "query": "UPDATE relationships SET end_chapter_id = ? WHERE id = ?",
-                        "params": (current_chapter_id, old_rel['id'])
-                    })
-                    should_insert = True
-            else:
-                print(f"  [New Rel] {subj} -> {obj}: {relation}")
-                should_insert = True
-                
-            if should_insert:
-                db_operations.append({
-                    "query": "INSERT INTO relationships (novel_id, subject_name, object_name, relation, start_chapter_id) VALUES (?, ?, ?, ?, ?)",
-                    "params": (novel_id, subj, obj, relation, current_chapter_id)
-                })
-
-        invalidated = ai_result.get("invalidated_settings", [])
-        for item in invalidated:
-            item_type = item.get("type")
-            if item_type == "relationship":
-                subj = item.get("subject")
-                obj = item.get("object")
-                relation = item.get("relation")
+                if not subj or not obj or not relation:
+                    continue
+                touched_names.update((subj, obj))
                 
                 existing_rels = db_service.execute_query(
                     """
-                    SELECT r.id 
+                    SELECT r.id, r.relation 
                     FROM relationships r
                     JOIN chapters c ON r.start_chapter_id = c.id
-                    WHERE c.novel_id = ? AND r.subject_name = ? AND r.object_name = ? AND r.relation = ?
+                    WHERE c.novel_id = ? AND r.subject_name = ? AND r.object_name = ? 
                     AND (r.end_chapter_id IS NULL OR r.end_chapter_id > ?)
                     """,
-                    (novel_id, subj, obj, relation, current_chapter_id)
+                    (novel_id, subj, obj, current_chapter_id)
                 )
-                for rel in existing_rels:
-                    print(f"  [Invalidate Rel] {subj} -> {obj}: {relation}")
+            
+                should_insert = False
+                if existing_rels:
+                    old_rel = existing_rels[0]
+                    if old_rel['relation'] != relation:
+                        print(f"  [Change Rel] {subj} -> {obj}: {old_rel['relation']} -> {relation}")
+                        db_operations.append({
+                            "query": "UPDATE relationships SET end_chapter_id = ? WHERE id = ?",
+                            "params": (current_chapter_id, old_rel['id'])
+                        })
+                        should_insert = True
+                else:
+                    print(f"  [New Rel] {subj} -> {obj}: {relation}")
+                    should_insert = True
+                
+                if should_insert:
                     db_operations.append({
-                        "query": "UPDATE relationships SET end_chapter_id = ? WHERE id = ?",
-                        "params": (current_chapter_id, rel['id'])
+                        "query": "INSERT INTO relationships (novel_id, subject_name, object_name, relation, start_chapter_id) VALUES (?, ?, ?, ?, ?)",
+                        "params": (novel_id, subj, obj, relation, current_chapter_id)
                     })
-            
-            elif item_type == "property":
-                entity_name = item.get("entity")
-                key = item.get("key")
+
+            invalidated = ai_result.get("invalidated_settings", [])
+            for item in invalidated:
+                item_type = item.get("type")
+                if item_type == "relationship":
+                    subj = resolver.canonical(item.get("subject"))
+                    obj = resolver.canonical(item.get("object"))
+                    relation = item.get("relation")
+                    touched_names.update((subj, obj))
                 
-                ents = db_service.execute_query(
-                    "SELECT e.id FROM entities e JOIN chapters c ON e.start_chapter_id = c.id WHERE c.novel_id = ? AND e.name = ?", 
-                    (novel_id, entity_name)
-                )
-                if ents:
-                    entity_id = ents[0]['id']
-                    existing_props = db_service.execute_query(
+                    existing_rels = db_service.execute_query(
                         """
-                        SELECT id FROM properties 
-                        WHERE entity_id = ? AND key = ? 
-                        AND (end_chapter_id IS NULL OR end_chapter_id > ?)
+                        SELECT r.id 
+                        FROM relationships r
+                        JOIN chapters c ON r.start_chapter_id = c.id
+                        WHERE c.novel_id = ? AND r.subject_name = ? AND r.object_name = ? AND r.relation = ?
+                        AND (r.end_chapter_id IS NULL OR r.end_chapter_id > ?)
                         """,
-                        (entity_id, key, current_chapter_id)
+                        (novel_id, subj, obj, relation, current_chapter_id)
                     )
-                    for prop in existing_props:
-                        print(f"  [Invalidate Prop] {entity_name}.{key}")
+                    for rel in existing_rels:
+                        print(f"  [Invalidate Rel] {subj} -> {obj}: {relation}")
                         db_operations.append({
-                            "query": "UPDATE properties SET end_chapter_id = ? WHERE id = ?",
-                            "params": (current_chapter_id, prop['id'])
+                            "query": "UPDATE relationships SET end_chapter_id = ? WHERE id = ?",
+                            "params": (current_chapter_id, rel['id'])
                         })
+            
+                elif item_type == "property":
+                    entity_name = resolver.canonical(item.get("entity"))
+                    key = item.get("key")
+                    touched_names.add(entity_name)
+                
+                    entity_id = resolver.resolve(entity_name)
+                    if entity_id is not None:
+                        existing_props = db_service.execute_query(
+                            """
+                            SELECT id FROM properties 
+                            WHERE entity_id = ? AND key = ? 
+                            AND (end_chapter_id IS NULL OR end_chapter_id > ?)
+                            """,
+                            (entity_id, key, current_chapter_id)
+                        )
+                        for prop in existing_props:
+                            print(f"  [Invalidate Prop] {entity_name}.{key}")
+                            db_operations.append({
+                                "query": "UPDATE properties SET end_chapter_id = ? WHERE id = ?",
+                                "params": (current_chapter_id, prop['id'])
+                            })
+                        if existing_props and key == '别名':
+                            db_operations.extend(alias_service.alias_operations(novel_id, entity_id, [], current_chapter_id))
+                            resolver.set_aliases(entity_id, [])
 
-        if db_operations:
-            db_service.execute_transaction(db_operations)
-            print(f"  [Success] 数据库更新完成，执行了 {len(db_operations)} 个操作。")
-        else:
-            print("  [Info] 没有检测到需要更新的设定。")
+            trace.enter('write')
+            trace.add('db_operations', len(db_operations))
+            if db_operations:
+                db_service.execute_transaction(db_operations)
+                cache_service.bump_generation(novel_id)
+                print(f"  [Success] 数据库更新完成，执行了 {len(db_operations)} 个操作。")
+            else:
+                print("  [Info] 没有检测到需要更新的设定。")
+        except Exception:
+            # 解析器在生成操作时已按本次变更更新（新增实体、别名），中途失败时丢弃，下次使用时重建
+            alias_service.invalidate(novel_id)
+            raise
+
+        trace.enter('index')
+        alias_service.adopt(novel_id, resolver)
+        suggest_service.refresh_names(novel_id, touched_names)
 
     def rollback_settings(self, novel_id: int, target_chapter_number: int):
         """
         回滚设定：删除 target_chapter_number 之后产生的所有设定变更。
         """
-        chapters = db_service.execute_query(
-            "SELECT id FROM chapters WHERE novel_id = ? AND number = ?", 
-            (novel_id, target_chapter_number)
-        )
-        if not chapters:
+        target_chapter_id = chapter_cache_service.get_chapter_id(novel_id, target_chapter_number)
+        if target_chapter_id is None:
             return
-        target_chapter_id = chapters[0]['id']
         
         print(f"[SettingService] 回滚第 {target_chapter_number} 章 (ID: {target_chapter_id}) 的设定...")
+        touched_names = self._get_names_touched_in_chapters(novel_id, [target_chapter_id])
 
         operations = []
         
+        operations.append({
+            "query": "DELETE FROM entity_aliases WHERE start_chapter_id = ?",
+            "params": (target_chapter_id,)
+        })
         operations.append({
             "query": "DELETE FROM properties WHERE start_chapter_id = ?",
             "params": (target_chapter_id,)
@@ -435,6 +789,10 @@ class SettingService:
             "query": "UPDATE properties SET end_chapter_id = NULL WHERE end_chapter_id = ?",
             "params": (target_chapter_id,)
         })
+        operations.append({
+            "query": "UPDATE entity_aliases SET end_chapter_id = NULL WHERE end_chapter_id = ?",
+            "params": (target_chapter_id,)
+        })
         operations.append({
             "query": "UPDATE entities SET end_chapter_id = NULL WHERE end_chapter_id = ?",
             "params": (target_chapter_id,)
@@ -445,6 +803,8 @@ class SettingService:
         })
         
         db_service.execute_transaction(operations)
+        cache_service.bump_generation(novel_id)
+        suggest_service.refresh_names(novel_id, touched_names)
         print("  [Success] 设定回滚完成。")
 
     def delete_settings_from_chapter(self, novel_id: int, chapter_number: int):
@@ -462,6 +822,10 @@ class SettingService:
         
         operations = []
         for chapter_id in chapter_ids:
+            operations.append({
+                "query": "DELETE FROM entity_aliases WHERE start_chapter_id = ?",
+                "params": (chapter_id,)
+            })
             operations.append({
                 "query": "DELETE FROM entities WHERE start_chapter_id = ?",
                 "params": (chapter_id,)
@@ -482,12 +846,17 @@ class SettingService:
                 "query": "UPDATE properties SET end_chapter_id = NULL WHERE end_chapter_id = ?",
                 "params": (chapter_id,)
             })
+            operations.append({
+                "query": "UPDATE entity_aliases SET end_chapter_id = NULL WHERE end_chapter_id = ?",
+                "params": (chapter_id,)
+            })
             operations.append({
                 "query": "UPDATE relationships SET end_chapter_id = NULL WHERE end_chapter_id = ?",
                 "params": (chapter_id,)
             })
 
         db_service.execute_transaction(operations)
+        cache_service.bump_generation(novel_id)
 
     def get_latest_extracted_chapter(self, novel_id: int) -> int:
         """
@@ -543,11 +912,7 @@ class SettingService:
         
         for chapter_num in range(start_chapter_number, end_chapter_number + 1):
             try:
-                chapter_data = db_service.execute_query(
-                    "SELECT id, content FROM chapters WHERE novel_id = ? AND number = ?",
-                    (novel_id, chapter_num)
-                )
-                if not chapter_data:
+                if chapter_cache_service.get_chapter_id(novel_id, chapter_num) is None:
                     print(f"  [Auto-Import] Chapter {chapter_num} not found, attempting to import.")
                     try:
                         import_result = chapter_service.import_from_local_file(novel_id, chapter_num, chapter_num)
@@ -618,20 +983,39 @@ class SettingService:
 
     def search_entities(self, novel_id: int, query: str) -> List[str]:
         """
-        根据查询词模糊搜索实体名称。
+        根据查询词模糊搜索实体名称（含别名）。
+        使用内存补全索引，按前缀匹配、名称长度、活跃度排序。
         """
         if not query:
             return []
-            
-        sql = """
-            SELECT DISTINCT e.name 
-            FROM entities e
-            JOIN chapters c ON e.start_chapter_id = c.id
-            WHERE c.novel_id = ? AND e.name LIKE ? 
-            ORDER BY length(e.name) ASC LIMIT 20
+        return suggest_service.suggest(novel_id, query, 20)
+
+    def _get_names_touched_in_chapters(self, novel_id: int, chapter_ids: List[int]) -> set:
         """
-        results = db_service.execute_query(sql, (novel_id, f"%{query}%"))
-        return [r['name'] for r in results]
+        获取在指定章节中创建或失效的设定所涉及的实体名称（用于回滚后增量刷新索引）。
+        """
+        names = set()
+        for i in range(0, len(chapter_ids), 500):
+            chunk = chapter_ids[i:i + 500]
+            placeholders = ','.join('?' * len(chunk))
+            rows = db_service.execute_query(
+                f"""
+                SELECT e.name AS name FROM entities e
+                WHERE e.novel_id = ? AND (e.start_chapter_id IN ({placeholders}) OR e.end_chapter_id IN ({placeholders}))
+                UNION
+                SELECT e.name AS name FROM properties p JOIN entities e ON p.entity_id = e.id
+                WHERE e.novel_id = ? AND (p.start_chapter_id IN ({placeholders}) OR p.end_chapter_id IN ({placeholders}))
+                UNION
+                SELECT subject_name AS name FROM relationships
+                WHERE novel_id = ? AND (start_chapter_id IN ({placeholders}) OR end_chapter_id IN ({placeholders}))
+                UNION
+                SELECT object_name AS name FROM relationships
+                WHERE novel_id = ? AND (start_chapter_id IN ({placeholders}) OR end_chapter_id IN ({placeholders}))
+                """,
+                (novel_id, *chunk, *chunk) * 4
+            )
+            names.update(r['name'] for r in rows)
+        return names
 
     def batch_rollback_settings(self, novel_id: int, start_chapter: int, end_chapter: int) -> Dict[str, Any]:
         """
@@ -650,10 +1034,11 @@ class SettingService:
             
         chapter_ids = [c['id'] for c in chapters]
         placeholders = ','.join(['?'] * len(chapter_ids))
+        touched_names = self._get_names_touched_in_chapters(novel_id, chapter_ids)
         
         operations = []
         
-        tables = ['relationships', 'properties', 'entities']
+        tables = ['relationships', 'entity_aliases', 'properties', 'entities']
         
         # 2. 更新结束章节在范围内的设定 (恢复为未结束)
         for table in tables:
@@ -671,6 +1056,8 @@ class SettingService:
             
         try:
             db_service.execute_transaction(operations)
+            cache_service.bump_generation(novel_id)
+            suggest_service.refresh_names(novel_id, touched_names)
             return {"success": True}
         except Exception as e:
             raise e
@@ -0,0 +1,252 @@
+import threading
+from typing import Dict, List, Set, Iterable, Optional, Tuple
+from app.services import db_service
+from app.services.cache_service import cache_service
+from app.services.alias_service import split_aliases
+
+class SuggestIndex:
+    """
+    单本小说的实体名称补全索引。
+    - 前缀字典树：按深度逐层遍历，天然按词长从短到长产出前缀匹配；
+    - 1/2/3-gram 倒排表：用于子串（中缀）匹配，1~3 字查询直接查倒排表，
+      更长的查询取各 trigram 倒排表的交集后校验。
+    每个规范实体名对应若干检索词（名称本身与其所有别名），命中别名时返回规范名称。
+    """
+    END = ''
+
+    def __init__(self):
+        self.terms: Dict[str, Set[str]] = {}       # 规范名称 -> 检索词集合
+        self.activity: Dict[str, int] = {}         # 规范名称 -> 活跃度（属性版本数 + 关系数）
+        self.trie: Dict = {}
+        self.postings: Dict[str, Set[str]] = {}    # n-gram -> 规范名称集合
+        self._sorted_postings: Dict[str, List[str]] = {}
+
+    @staticmethod
+    def _grams(term: str) -> Set[str]:
+        grams = set(term)
+        grams.update(term[i:i + 2] for i in range(len(term) - 1))
+        grams.update(term[i:i + 3] for i in range(len(term) - 2))
+        return grams
+
+    def _rank_key(self, name: str):
+        return (len(name), -self.activity.get(name, 0), name)
+
+    def _add_term(self, name: str, term: str):
+        node = self.trie
+        for ch in term:
+            node = node.setdefault(ch, {})
+        node.setdefault(self.END, set()).add(name)
+        for gram in self._grams(term):
+            self.postings.setdefault(gram, set()).add(name)
+            self._sorted_postings.pop(gram, None)
+
+    def _remove_term(self, name: str, term: str):
+        node = self.trie
+        for ch in term:
+            node = node.get(ch)
+            if node is None:
+                return
+        node.get(self.END, set()).discard(name)
+        # 同一名称的其它检索词可能包含相同 gram
+        other_grams = set()
+        for other in self.terms.get(name, ()):
+            if other != term:
+                other_grams |= self._grams(other)
+        for gram in self._grams(term) - other_grams:
+            names = self.postings.get(gram)
+            if names:
+                names.discard(name)
+                self._sorted_postings.pop(gram, None)
+
+    def set_entry(self, name: str, terms: Iterable[str], activity: int):
+        """新增或替换一个实体的检索词与活跃度"""
+        new_terms = {t for t in terms if t}
+        old_terms = self.terms.get(name, set())
+        for term in old_terms - new_terms:
+            self._remove_term(name, term)
+        self.terms[name] = new_terms
+        for term in new_terms - old_terms:
+            self._add_term(name, term)
+        if self.activity.get(name) != activity:
+            self.activity[name] = activity
+            # 活跃度影响排序，清除相关 gram 的排序缓存
+            for term in new_terms:
+                for gram in self._grams(term):
+                    self._sorted_postings.pop(gram, None)
+
+    def remove_entry(self, name: str):
+        for term in list(self.terms.get(name, ())):
+            self._remove_term(name, term)
+            self.terms[name].discard(term)
+        self.terms.pop(name, None)
+        self.activity.pop(name, None)
+
+    def _prefix_matches(self, query: str, limit: int) -> List[str]:
+        node = self.trie
+        for ch in query:
+            node = node.get(ch)
+            if node is None:
+                return []
+        results: List[str] = []
+        seen = set()
+        level = [node]
+        while level and len(results) < limit:
+            # 同一深度（相同词长）内按活跃度排序
+            found = set()
+            next_level = []
+            for n in level:
+                for key, child in n.items():
+                    if key == self.END:
+                        found.update(child)
+                    else:
+                        next_level.append(child)
+            for name in sorted(found - seen, key=self._rank_key):
+                seen.add(name)
+                results.append(name)
+            level = next_level
+        return results[:limit]
+
+    def _sorted_posting(self, gram: str) -> List[str]:
+        ranked = self._sorted_postings.get(gram)
+        if ranked is None:
+            ranked = sorted(self.postings.get(gram, ()), key=self._rank_key)
+            self._sorted_postings[gram] = ranked
+        return ranked
+
+    def _infix_matches(self, query: str, limit: int, exclude: Set[str]) -> List[str]:
+        if len(query) <= 3:
+            # 1~3 字查询本身就是一个 gram，直接使用排好序的倒排表
+            candidates: Iterable[str] = self._sorted_posting(query)
+        else:
+            grams = sorted({query[i:i + 3] for i in range(len(query) - 2)},
+                           key=lambda g: len(self.postings.get(g, ())))
+            matched = set(self.postings.get(grams[0], ()))
+            for gram in grams[1:]:
+                if not matched:
+                    break
+                matched &= self.postings.get(gram, set())
+            candidates = sorted(
+                (name for name in matched if any(query in t for t in self.terms.get(name, ()))),
+                key=self._rank_key
+            )
+
+        results = []
+        for name in candidates:
+            if name in exclude:
+                continue
+            results.append(name)
+            if len(results) >= limit:
+                break
+        return results
+
+    def suggest(self, query: str, limit: int = 20) -> List[str]:
+        """按 精确/前缀匹配 > 子串匹配 排序，同一档内按名称长度、活跃度排序"""
+        prefix = self._prefix_matches(query, limit)
+        if len(prefix) >= limit:
+            return prefix
+        return prefix + self._infix_matches(query, limit - len(prefix), set(prefix))
+
+
+class SuggestService:
+    """
+    按小说维护内存中的实体补全索引。索引记录其对应的写入代数：
+    提取与回滚会增量刷新受影响的实体并同步代数，其它写操作导致代数不一致时整体重建。
+    """
+    def __init__(self):
+        self._indexes: Dict[int, Tuple[int, SuggestIndex]] = {}
+        self._lock = threading.Lock()
+
+    def _load_entries(self, novel_id: int, names: Optional[List[str]] = None) -> Dict[str, Tuple[Set[str], int]]:
+        """从数据库读取实体的检索词与活跃度；names 为空时读取整本小说"""
+        entries: Dict[str, Tuple[Set[str], int]] = {}
+        chunks = [None] if names is None else [names[i:i + 500] for i in range(0, len(names), 500)]
+        for chunk in chunks:
+            name_filter, params = "", ()
+            if chunk is not None:
+                name_filter = f"AND e.name IN ({','.join('?' * len(chunk))})"
+                params = tuple(chunk)
+
+            for row in db_service.execute_query(
+                f"SELECT DISTINCT e.name FROM entities e WHERE e.novel_id = ? {name_filter}",
+                (novel_id, *params)
+            ):
+                entries[row['name']] = ({row['name']}, 0)
+
+            for row in db_service.execute_query(
+                f"""
+                SELECT e.name, p.key, p.value FROM properties p
+                JOIN entities e ON p.entity_id = e.id
+                WHERE e.novel_id = ? {name_filter}
+                """,
+                (novel_id, *params)
+            ):
+                terms, activity = entries[row['name']]
+                if row['key'] == '别名':
+                    terms.update(split_aliases(row['value']))
+                entries[row['name']] = (terms, activity + 1)
+
+            rel_filter = name_filter.replace('e.name', 'name')
+            for row in db_service.execute_query(
+                f"""
+                SELECT name, COUNT(*) AS cnt FROM (
+                    SELECT subject_name AS name FROM relationships WHERE novel_id = ?
+                    UNION ALL
+                    SELECT object_name AS name FROM relationships WHERE novel_id = ?
+                ) WHERE 1 = 1 {rel_filter} GROUP BY name
+                """,
+                (novel_id, novel_id, *params)
+            ):
+                if row['name'] in entries:
+                    terms, activity = entries[row['name']]
+                    entries[row['name']] = (terms, activity + row['cnt'])
+        return entries
+
+    def _build(self, novel_id: int) -> SuggestIndex:
+        index = SuggestIndex()
+        for name, (terms, activity) in self._load_entries(novel_id).items():
+            index.set_entry(name, terms, activity)
+        return index
+
+    def get_index(self, novel_id: int) -> SuggestIndex:
+        generation = cache_service.get_generation(novel_id)
+        with self._lock:
+            cached = self._indexes.get(novel_id)
+            if cached and cached[0] == generation:
+                return cached[1]
+        index = self._build(novel_id)
+        with self._lock:
+            self._indexes[novel_id] = (generation, index)
+        return index
+
+    def suggest(self, novel_id: int, query: str, limit: int = 20) -> List[str]:
+        if not query:
+            return []
+        index = self.get_index(novel_id)
+        with self._lock:
+            return index.suggest(query, limit)
+
+    def refresh_names(self, novel_id: int, names: Iterable[str]):
+        """
+        写操作完成后增量刷新受影响的实体，并将索引标记为读取前的代数。
+        代数须在读取实体之前取得：读取期间提交的其他写操作会使代数前进，下次查询时整体重建，不会被当作已索引。
+        索引尚未构建时无需处理（下次查询时会整体构建）。
+        """
+        generation = cache_service.get_generation(novel_id)
+        with self._lock:
+            cached = self._indexes.get(novel_id)
+        if not cached:
+            return
+        index = cached[1]
+        names = [n for n in set(names) if n]
+        entries = self._load_entries(novel_id, names) if names else {}
+        with self._lock:
+            for name in names:
+                if name in entries:
+                    terms, activity = entries[name]
+                    index.set_entry(name, terms, activity)
+                else:
+                    index.remove_entry(name)
+            self._indexes[novel_id] = (generation, index)
+
+# 单例
+suggest_service = SuggestService()
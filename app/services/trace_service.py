@@ -0,0 +1,237 @@
+import statistics
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+from app.services import db_service
+
+# 设定提取的阶段，依次为：读取章节、构建上一章快照、序列化 Prompt、模型调用（含重试）、
+# 清理与解析模型输出、比对已有设定生成写操作、执行写入事务、刷新别名/补全索引
+STAGES = ('load', 'snapshot', 'prompt', 'model', 'parse', 'diff', 'write', 'index')
+# 分段并发提取时由各段合并而来的阶段
+SEGMENT_STAGES = ('prompt', 'model', 'parse')
+# 计数字段（segments：章节正文拆分的段数，见 segment_extraction_service）
+COUNTERS = ('prompt_chars', 'response_chars', 'prompt_tokens', 'completion_tokens',
+            'db_operations', 'retries', 'snapshot_entities', 'snapshot_relationships', 'segments')
+# 单章总耗时超过中位数的该倍数时列为离群章节
+OUTLIER_FACTOR = 3.0
+
+
+class ExtractionTrace:
+    """一次章节设定提取的各阶段耗时（毫秒）与计数"""
+    def __init__(self, novel_id: int, chapter_number: int):
+        self.novel_id = novel_id
+        self.chapter_number = chapter_number
+        self.stages: Dict[str, float] = dict.fromkeys(STAGES, 0.0)
+        self.counters: Dict[str, int] = dict.fromkeys(COUNTERS, 0)
+        self.status = 'ok'
+        self.error: Optional[str] = None
+        self.save = True
+        self.start = time.perf_counter()
+        self._running: Optional[str] = None
+        self._running_since = 0.0
+
+    @contextmanager
+    def stage(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] += (time.perf_counter() - t0) * 1000
+
+    def enter(self, name: Optional[str]):
+        """顺序计时：结束正在计时的阶段并开始 name 阶段（None 表示只结束）"""
+        now = time.perf_counter()
+        if self._running is not None:
+            self.stages[self._running] += (now - self._running_since) * 1000
+        self._running, self._running_since = name, now
+
+    def add(self, counter: str, amount: int = 1):
+        self.counters[counter] += amount
+
+    def merge_segments(self, segments: List['ExtractionTrace'], elapsed_ms: float):
+        """
+        并入各段（在其它线程中执行）的记录：计数相加；各段并发执行，
+        prompt / model / parse 的耗时按各段之和的比例分摊实际经过的 elapsed_ms，各阶段之和仍等于总耗时。
+        """
+        for segment in segments:
+            for counter, amount in segment.counters.items():
+                self.counters[counter] += amount
+        busy = {s: sum(segment.stages[s] for segment in segments) for s in SEGMENT_STAGES}
+        total = sum(busy.values())
+        for s in SEGMENT_STAGES:
+            self.stages[s] += elapsed_ms * busy[s] / total if total else 0.0
+
+_current_trace: ContextVar[Optional[ExtractionTrace]] = ContextVar('extraction_trace', default=None)
+
+
+class TraceService:
+    """
+    设定提取流水线的分阶段计时。extract_and_update_settings 在 trace_extraction() 内执行并用 ExtractionTrace.enter()
+    顺序切换阶段；ai_service 通过 stage() 对 Prompt/模型/解析计时，通过 record() 上报 Prompt/响应大小、token 与重试次数；
+    结束时（包括失败）写入 extraction_traces 表一行，供按小说聚合分析慢章节与性能退化。
+    不在提取过程中时 stage() / record() 不做任何事。
+    """
+    @contextmanager
+    def trace_extraction(self, novel_id: int, chapter_number: int) -> Iterator[ExtractionTrace]:
+        trace = ExtractionTrace(novel_id, chapter_number)
+        token = _current_trace.set(trace)
+        try:
+            yield trace
+        except Exception as e:
+            trace.status = 'error'
+            trace.error = str(e)[:500]
+            raise
+        finally:
+            trace.enter(None)
+            _current_trace.reset(token)
+            if trace.save:
+                self._save(trace)
+
+    def current(self) -> Optional[ExtractionTrace]:
+        """当前线程正在进行的提取记录（不在提取过程中时为 None）"""
+        return _current_trace.get()
+
+    @contextmanager
+    def segment_trace(self, parent: Optional[ExtractionTrace]) -> Iterator[Optional[ExtractionTrace]]:
+        """
+        在工作线程中执行提取的一段时使用：计时与计数记入独立的段记录（不单独保存），
+        由发起线程通过 parent.merge_segments() 并入。parent 为 None 时不记录。
+        """
+        if parent is None:
+            yield None
+            return
+        segment = ExtractionTrace(parent.novel_id, parent.chapter_number)
+        segment.save = False
+        token = _current_trace.set(segment)
+        try:
+            yield segment
+        finally:
+            _current_trace.reset(token)
+
+    @contextmanager
+    def stage(self, name: str):
+        trace = _current_trace.get()
+        if trace is None:
+            yield
+        else:
+            with trace.stage(name):
+                yield
+
+    def record(self, counter: str, amount: int = 1):
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(counter, amount)
+
+    def _save(self, trace: ExtractionTrace):
+        total_ms = (time.perf_counter() - trace.start) * 1000
+        columns = ['novel_id', 'chapter_number', 'status', 'error', 'total_ms'] + \
+                  [f'{s}_ms' for s in STAGES] + list(COUNTERS)
+        values = [trace.novel_id, trace.chapter_number, trace.status, trace.error, round(total_ms, 3)] + \
+                 [round(trace.stages[s], 3) for s in STAGES] + [trace.counters[c] for c in COUNTERS]
+        try:
+            db_service.execute_commit(
+                f"INSERT INTO extraction_traces ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                tuple(values)
+            )
+        except Exception as e:
+            # 记录失败不影响提取本身
+            print(f"  [TraceService] 写入提取记录失败: {e}")
+
+    def get_traces(self, novel_id: int, limit: int = 100, offset: int = 0,
+                   chapter_number: Optional[int] = None) -> List[Dict[str, Any]]:
+        """按时间倒序列出提取记录，可按章号过滤"""
+        if chapter_number is not None:
+            return db_service.execute_query(
+                "SELECT * FROM extraction_traces WHERE novel_id = ? AND chapter_number = ? ORDER BY id DESC LIMIT ? OFFSET ?",
+                (novel_id, chapter_number, limit, offset)
+            )
+        return db_service.execute_query(
+            "SELECT * FROM extraction_traces WHERE novel_id = ? ORDER BY id DESC LIMIT ? OFFSET ?",
+            (novel_id, limit, offset)
+        )
+
+    def _stage_stats(self, rows: List[Dict[str, Any]]) -> Dict[str, Dict[str, float]]:
+        """各阶段（及总耗时）的平均值、中位数、p95、最大值与占总耗时的比例"""
+        result = {}
+        grand_total = sum(r['total_ms'] for r in rows) or 1
+        for stage in STAGES + ('total',):
+            values = sorted(r[f'{stage}_ms'] for r in rows)
+            result[stage] = {
+                "avg_ms": round(statistics.fmean(values), 2),
+                "p50_ms": round(statistics.median(values), 2),
+                "p95_ms": round(values[min(len(values) - 1, int(round(0.95 * (len(values) - 1))))], 2),
+                "max_ms": round(values[-1], 2),
+                "share": round(sum(values) / grand_total, 4)
+            }
+        return result
+
+    def get_summary(self, novel_id: int, window: int = 0, top: int = 10) -> Dict[str, Any]:
+        """
+        聚合一部小说的提取记录：
+        - stages：成功记录的各阶段耗时分布与占比；totals：token、重试、写操作等合计；
+        - slowest：总耗时最长的记录及其最慢阶段；outliers：总耗时超过中位数 OUTLIER_FACTOR 倍的记录；
+        - window > 0 时只统计最近 window 条成功记录，并与之前的 window 条比较各阶段中位数（comparison），用于发现退化。
+        """
+        columns = ', '.join(['id', 'chapter_number', 'status', 'total_ms', 'created_at'] +
+                            [f'{s}_ms' for s in STAGES] + list(COUNTERS))
+        counts = db_service.execute_query(
+            "SELECT status, COUNT(*) AS n FROM extraction_traces WHERE novel_id = ? GROUP BY status", (novel_id,)
+        )
+        by_status = {r['status']: r['n'] for r in counts}
+        if window > 0:
+            recent = db_service.execute_query(
+                f"SELECT {columns} FROM extraction_traces WHERE novel_id = ? AND status = 'ok' ORDER BY id DESC LIMIT ?",
+                (novel_id, window * 2)
+            )
+            rows, previous = recent[:window], recent[window:]
+        else:
+            rows = db_service.execute_query(
+                f"SELECT {columns} FROM extraction_traces WHERE novel_id = ? AND status = 'ok' ORDER BY id DESC",
+                (novel_id,)
+            )
+            previous = []
+
+        summary: Dict[str, Any] = {
+            "traces": sum(by_status.values()),
+            "by_status": by_status,
+            "analyzed": len(rows),
+            "stages": {},
+            "totals": {},
+            "slowest": [],
+            "outliers": []
+        }
+        if not rows:
+            return summary
+
+        summary["stages"] = self._stage_stats(rows)
+        summary["totals"] = {c: sum(r[c] for r in rows) for c in COUNTERS}
+
+        def brief(r: Dict[str, Any]) -> Dict[str, Any]:
+            slowest_stage = max(STAGES, key=lambda s: r[f'{s}_ms'])
+            return {"id": r['id'], "chapter_number": r['chapter_number'], "total_ms": r['total_ms'],
+                    "slowest_stage": slowest_stage, "slowest_stage_ms": r[f'{slowest_stage}_ms'],
+                    "created_at": r['created_at']}
+
+        summary["slowest"] = [brief(r) for r in sorted(rows, key=lambda r: r['total_ms'], reverse=True)[:top]]
+        threshold = summary["stages"]["total"]["p50_ms"] * OUTLIER_FACTOR
+        summary["outliers"] = [brief(r) for r in rows if r['total_ms'] > threshold]
+
+        if previous:
+            before = self._stage_stats(previous)
+            summary["comparison"] = {
+                "previous_analyzed": len(previous),
+                "stages": {
+                    stage: {
+                        "previous_p50_ms": before[stage]["p50_ms"],
+                        "recent_p50_ms": summary["stages"][stage]["p50_ms"],
+                        "ratio": round(summary["stages"][stage]["p50_ms"] / before[stage]["p50_ms"], 3)
+                                 if before[stage]["p50_ms"] else None
+                    }
+                    for stage in STAGES + ('total',)
+                }
+            }
+        return summary
+
+# 单例
+trace_service = TraceService()
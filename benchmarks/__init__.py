@@ -0,0 +1,9 @@
+"""
+合成小说基准测试：按固定随机种子生成章节、实体、属性版本与关系，直接写入临时 SQLite 数据库，
+对设定快照、章节变更、提取写入、回滚、知识图谱、最短路径、频繁模式、小说切分与应用冷启动等热点路径计时。
+
+用法（项目根目录）：
+    python -m benchmarks --preset small --output bench.json --baseline benchmarks/baseline.json
+"""
+from .generator import PRESETS, generate_novel, write_novel_text
+from .scenarios import SCENARIOS, run_benchmarks, compare_results
@@ -0,0 +1,86 @@
+import argparse
+import json
+import os
+import sys
+from .generator import PRESETS
+from .scenarios import DEFAULT_THRESHOLD, SCENARIOS, compare_results, run_benchmarks
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='合成小说基准测试')
+    parser.add_argument('--preset', choices=list(PRESETS), default='small', help='数据集规模（默认 small）')
+    parser.add_argument('--runs', type=int, default=5, help='每个场景的计时轮数（另有 1 轮预热）')
+    parser.add_argument('--seed', type=int, default=42, help='数据集随机种子')
+    parser.add_argument('--only', help='只运行指定场景，逗号分隔：' + ', '.join(SCENARIOS))
+    parser.add_argument('--workdir', help='临时数据库目录（默认新建临时目录）')
+    parser.add_argument('--keep-db', action='store_true', help='保留生成的数据库，便于手工分析')
+    parser.add_argument('--output', help='结果 JSON 的写入路径')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='对比的基线 JSON（默认 benchmarks/baseline.json）')
+    parser.add_argument('--save-baseline', action='store_true', help='把本次结果写为基线')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='退化判定倍数（中位数之比）')
+    parser.add_argument('--fail-on-regression', action='store_true', help='存在退化时以状态码 1 退出')
+    args = parser.parse_args(argv)
+
+    only = [name.strip() for name in args.only.split(',') if name.strip()] if args.only else None
+    result = run_benchmarks(args.preset, args.runs, args.seed, args.workdir, only, args.keep_db, log=print)
+
+    if 'startup' in result:
+        _print_startup(result['startup'])
+
+    rows = []
+    if args.save_baseline:
+        _write_json(args.baseline, result)
+        print(f"基线已写入 {args.baseline}")
+    elif not os.path.exists(args.baseline):
+        print(f"基线文件不存在: {args.baseline}，跳过对比")
+    else:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline['meta']['params'] != result['meta']['params'] or baseline['meta']['seed'] != result['meta']['seed']:
+            print(f"基线数据集（{baseline['meta']['preset']}, seed={baseline['meta']['seed']}）与本次不同，跳过对比")
+        else:
+            rows = compare_results(result, baseline, args.threshold)
+            result['comparison'] = rows
+            _print_comparison(rows, baseline, args.threshold)
+
+    if args.output:
+        _write_json(args.output, result)
+        print(f"结果已写入 {args.output}")
+
+    regressions = [row for row in rows if row['status'] == 'regression']
+    return 1 if regressions and args.fail_on_regression else 0
+
+
+def _write_json(path: str, data) -> None:
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.write('\n')
+
+
+def _print_startup(report) -> None:
+    print(f"\n启动导入耗时（-X importtime，共 {report['module_count']} 个模块，{report['total_ms']} ms）:")
+    for row in report['modules']:
+        print(f"  {row['module']:<40} {row['cumulative_ms']:>8.1f} ms")
+    print("按顶层包汇总（自身耗时）:")
+    for row in report['packages']:
+        print(f"  {row['package']:<40} {row['self_ms']:>8.1f} ms   {row['modules']} 个模块")
+    if 'app_modules' in report:
+        print(f"启动时即导入的项目模块（{len(report['app_modules'])} 个，自身耗时共 {report['app_self_ms']} ms，前 10 个）:")
+        for row in report['app_modules'][:10]:
+            print(f"  {row['module']:<40} {row['self_ms']:>8.1f} ms")
+
+
+def _print_comparison(rows, baseline, threshold: float) -> None:
+    print(f"\n与基线对比（{baseline['meta']['created_at']}，阈值 {threshold}x）:")
+    for row in rows:
+        if row['status'] == 'new':
+            print(f"  {row['scenario']:<24} {'-':>10}    {row['current_ms']:>10.2f} ms   new")
+        else:
+            print(f"  {row['scenario']:<24} {row['baseline_ms']:>10.2f} -> {row['current_ms']:>10.2f} ms   "
+                  f"x{row['ratio']:<6} {row['status']}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,188 @@
+import os
+import random
+from typing import Any, Dict, List, Optional
+from app.services import db_service
+from app.services.alias_service import split_aliases
+
+# 预设规模：chapters 章节数，entities 实体数，property_versions 属性版本总数，relationships 关系数，
+# churn 设定在最后一章之前失效（end_chapter_id 非空）的比例，chapter_chars 每章字数，
+# pending_chapters 末尾不生成设定的章节数（供提取场景使用）
+PRESETS: Dict[str, Dict[str, Any]] = {
+    "tiny": {"chapters": 30, "entities": 200, "property_versions": 800, "relationships": 400,
+             "churn": 0.3, "chapter_chars": 1500, "pending_chapters": 1},
+    "small": {"chapters": 200, "entities": 2000, "property_versions": 10000, "relationships": 6000,
+              "churn": 0.3, "chapter_chars": 3000, "pending_chapters": 1},
+    "medium": {"chapters": 800, "entities": 8000, "property_versions": 50000, "relationships": 30000,
+               "churn": 0.3, "chapter_chars": 3000, "pending_chapters": 1},
+    "large": {"chapters": 2000, "entities": 20000, "property_versions": 150000, "relationships": 80000,
+              "churn": 0.3, "chapter_chars": 4000, "pending_chapters": 1},
+}
+
+ENTITY_TYPES = ['人物', '人物', '人物', '地点', '组织', '物品', '功法']
+PROPERTY_KEYS = ['身份', '等级', '状态', '所在地', '性格', '外貌', '武器']
+RELATIONS = ['朋友', '敌人', '师徒', '同门', '从属', '亲属', '恋人', '盟友']
+_SURNAMES = '赵钱孙李周吴郑王冯陈褚卫蒋沈韩杨朱秦尤许何吕施张孔曹严华金魏陶姜'
+_GIVEN = '云风雨雪山河星月天明清玄青白寒霜剑心灵尘墨羽'
+_PHRASES = ['走进了城门', '拔出了长剑', '望向远方的群山', '沉默良久', '低声说道', '在客栈中歇息',
+            '收到一封密信', '突破了瓶颈', '与来人交手', '想起了往事']
+
+
+def _entity_name(i: int, ent_type: str) -> str:
+    """确定性的实体名称，序号保证唯一"""
+    base = _SURNAMES[i % len(_SURNAMES)] + _GIVEN[(i // len(_SURNAMES)) % len(_GIVEN)]
+    suffix = {'人物': '', '地点': '城', '组织': '门', '物品': '令', '功法': '诀'}[ent_type]
+    return f"{base}{suffix}{i}"
+
+
+def _chapter_text(rnd: random.Random, names: List[str], chars: int) -> str:
+    """由实体名与固定短语拼成的正文，约 chars 个字符，每段一行"""
+    parts, size = [], 0
+    while size < chars:
+        sentence = f"{rnd.choice(names)}{rnd.choice(_PHRASES)}。"
+        if rnd.random() < 0.2:
+            sentence += '\n　　'
+        parts.append(sentence)
+        size += len(sentence)
+    return '　　' + ''.join(parts)
+
+
+def _interval(rnd: random.Random, start: int, last: int, churn: float) -> Optional[int]:
+    """按 churn 概率为 [start, last] 内开始的设定选一个结束章节序号，None 表示至今有效"""
+    if start < last and rnd.random() < churn:
+        return rnd.randint(start + 1, last)
+    return None
+
+
+def generate_novel(db_path: str, chapters: int, entities: int, property_versions: int, relationships: int,
+                   churn: float = 0.3, chapter_chars: int = 3000, pending_chapters: int = 1,
+                   seed: int = 42) -> Dict[str, Any]:
+    """
+    在 db_path 生成一部合成小说（已存在的文件会被删除），并把 db_service 指向该数据库。
+    相同参数与种子生成的数据完全相同。设定只写到第 chapters - pending_chapters 章，
+    末尾的章节保留给提取场景。返回生成概况（小说 ID、各表行数等）。
+    """
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    db_service.DB_PATH = db_path
+    db_service.init_db()
+
+    rnd = random.Random(seed)
+    last = max(1, chapters - pending_chapters)  # 最后一个带设定的章节序号
+    types = [rnd.choice(ENTITY_TYPES) for _ in range(entities)]
+    names = [_entity_name(i, t) for i, t in enumerate(types)]
+
+    conn = db_service.get_db_connection()
+    try:
+        novel_id = conn.execute("INSERT INTO novels (title, author) VALUES (?, ?)",
+                                (f"合成小说-{seed}", "benchmark")).lastrowid
+        chapter_ids = [0]  # 章节序号 -> 章节 ID（下标 0 占位）
+        for number in range(1, chapters + 1):
+            chapter_id = conn.execute("INSERT INTO chapters (novel_id, number, title) VALUES (?, ?, ?)",
+                                      (novel_id, number, f"第{number}章")).lastrowid
+            text = _chapter_text(rnd, names, chapter_chars)
+            codec, data = db_service.encode_content(text)
+            conn.execute(
+                "INSERT INTO chapter_contents (chapter_id, codec, data, char_count, raw_bytes) VALUES (?, ?, ?, ?, ?)",
+                (chapter_id, codec, data, len(text), len(text.encode('utf-8')))
+            )
+            chapter_ids.append(chapter_id)
+
+        def cid(number: Optional[int]) -> Optional[int]:
+            return chapter_ids[number] if number is not None else None
+
+        # 实体：出场章节偏向前部，按 churn 比例在之后某章失效
+        spans = []
+        entity_rows = []
+        for i, name in enumerate(names):
+            start = min(last, 1 + int(rnd.random() ** 2 * last))
+            end = _interval(rnd, start, last, churn / 2)
+            spans.append((start, end if end is not None else last + 1))
+            entity_rows.append((novel_id, name, types[i], cid(start), cid(end)))
+        conn.executemany(
+            "INSERT INTO entities (novel_id, name, type, start_chapter_id, end_chapter_id) VALUES (?, ?, ?, ?, ?)",
+            entity_rows
+        )
+        entity_ids = [row[0] for row in conn.execute(
+            "SELECT id FROM entities WHERE novel_id = ? ORDER BY id", (novel_id,))]
+
+        # 属性：先给每个实体分配若干条 (实体, 键) 版本链，再把剩余版本数随机追加到各链上
+        chains: Dict[tuple, int] = {}
+        for i in range(entities):
+            for key in rnd.sample(PROPERTY_KEYS, rnd.randint(1, 3)):
+                chains[(i, key)] = 1
+            if i % 4 == 0:
+                chains[(i, '别名')] = 1
+        chain_keys = list(chains)
+        for _ in range(max(0, property_versions - len(chain_keys))):
+            chains[rnd.choice(chain_keys)] += 1
+
+        property_rows, alias_rows = [], []
+        for (i, key), versions in chains.items():
+            start, stop = spans[i]
+            # 版本起始章节：不重复且有序，落在实体存续区间内
+            starts = sorted(rnd.sample(range(start, stop), min(versions, stop - start)))
+            tail_end = _interval(rnd, starts[-1], stop - 1, churn) if stop > last else stop
+            for v, version_start in enumerate(starts):
+                version_end = starts[v + 1] if v + 1 < len(starts) else tail_end
+                if key == '别名':
+                    value = f"小{names[i][:2]}{v}, 阿{names[i][1]}{i}-{v}"
+                    alias_rows.extend((novel_id, entity_ids[i], alias, cid(version_start), cid(version_end))
+                                      for alias in split_aliases(value))
+                else:
+                    value = f"{key}{v}-{rnd.randint(1, 99)}"
+                property_rows.append((entity_ids[i], key, value, cid(version_start), cid(version_end)))
+        conn.executemany(
+            "INSERT INTO properties (entity_id, key, value, start_chapter_id, end_chapter_id) VALUES (?, ?, ?, ?, ?)",
+            property_rows
+        )
+        conn.executemany(
+            "INSERT INTO entity_aliases (novel_id, entity_id, alias, start_chapter_id, end_chapter_id) VALUES (?, ?, ?, ?, ?)",
+            alias_rows
+        )
+
+        # 关系：两端实体存续区间重叠时才生成，起点落在重叠区间内
+        relationship_rows = []
+        attempts = 0
+        while len(relationship_rows) < relationships and attempts < relationships * 20:
+            attempts += 1
+            a, b = rnd.sample(range(entities), 2)
+            start = max(spans[a][0], spans[b][0])
+            stop = min(spans[a][1], spans[b][1])
+            if start >= stop:
+                continue
+            rel_start = rnd.randint(start, stop - 1)
+            rel_end = _interval(rnd, rel_start, stop - 1, churn) if stop > last else stop
+            relationship_rows.append((novel_id, names[a], names[b], rnd.choice(RELATIONS),
+                                      cid(rel_start), cid(rel_end)))
+        conn.executemany(
+            "INSERT INTO relationships (novel_id, subject_name, object_name, relation, start_chapter_id, end_chapter_id) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            relationship_rows
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+    return {
+        "novel_id": novel_id,
+        "chapters": chapters,
+        "last_extracted_chapter": last,
+        "entities": len(entity_rows),
+        "property_versions": len(property_rows),
+        "aliases": len(alias_rows),
+        "relationships": len(relationship_rows),
+        "db_bytes": os.path.getsize(db_path)
+    }
+
+
+def write_novel_text(path: str, chapters: int, chapter_chars: int = 3000, seed: int = 42) -> int:
+    """写出一份 UTF-8 小说文本（"第N章" 标题 + 正文），供切分场景使用，返回文件字节数"""
+    rnd = random.Random(seed)
+    names = [_entity_name(i, '人物') for i in range(200)]
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('合成小说\n作者：benchmark\n\n')
+        for number in range(1, chapters + 1):
+            f.write(f"第{number}章 {rnd.choice(names)}\n")
+            f.write(_chapter_text(rnd, names, chapter_chars))
+            f.write('\n\n')
+    return os.path.getsize(path)
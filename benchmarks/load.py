@@ -0,0 +1,252 @@
+"""
+负载测试：生成合成小说后启动真实的 HTTP 服务（gunicorn 或 Flask 开发服务器），模型调用替换为固定延迟。
+先只运行只读客户端（idle 阶段），再同时运行持续请求设定提取的客户端（extraction 阶段），
+比较两个阶段只读接口的延迟，用于验证提取进行时只读接口是否仍能及时响应。
+
+用法（项目根目录）：
+    python -m benchmarks.load --server gunicorn --workers 2 --threads 4 --ai-clients 8
+    python -m benchmarks.load --server gunicorn --ai-max-concurrent 0   # 不限制模型调用并发，作对比
+    python -m benchmarks.load --server dev
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from typing import Any, Dict, List
+from .generator import PRESETS, generate_novel
+from .startup import PROJECT_ROOT
+
+DB_ENV = 'NOVEL_BENCH_DB'
+LATENCY_ENV = 'NOVEL_BENCH_AI_LATENCY'
+
+
+def load_app():
+    """
+    服务进程使用的应用工厂（gunicorn: benchmarks.load:load_app()）：连接 NOVEL_BENCH_DB 指向的数据库，
+    设定提取的模型调用替换为等待 NOVEL_BENCH_AI_LATENCY 秒后返回一条属性修改。
+    """
+    from app import create_app
+    from app.services import db_service
+    from app.services.ai_service import ai_service
+
+    db_service.DB_PATH = os.environ[DB_ENV]
+    latency = float(os.environ.get(LATENCY_ENV, '1'))
+
+    def extract(chapter_content: str, existing_settings: Dict[str, Any]) -> Dict[str, Any]:
+        time.sleep(latency)
+        entity = random.choice(existing_settings["entities"])
+        return {"new_settings": {"entities": [{"name": entity["name"], "type": entity["type"],
+                                               "properties": {"状态": f"负载测试{random.randrange(10 ** 6)}"}}],
+                                 "relationships": []},
+                "invalidated_settings": []}
+
+    ai_service.extract_settings_from_text = extract
+    app = create_app()
+    db_service.enable_wal()
+    return app
+
+
+def _free_port() -> int:
+    with contextlib.closing(socket.socket()) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _start_server(args, port: int, db_path: str, log_path: str) -> subprocess.Popen:
+    env = dict(os.environ, **{DB_ENV: db_path, LATENCY_ENV: str(args.ai_latency)})
+    if args.server == 'gunicorn':
+        env.update(NOVEL_BIND=f'127.0.0.1:{port}', NOVEL_WORKERS=str(args.workers),
+                   NOVEL_THREADS=str(args.threads), NOVEL_ACCESS_LOG='')
+        if args.ai_max_concurrent is not None:
+            env['NOVEL_AI_MAX_CONCURRENT'] = str(args.ai_max_concurrent)
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'benchmarks.load:load_app()']
+    else:
+        if args.ai_max_concurrent is not None:
+            env['NOVEL_AI_MAX_CONCURRENT'] = str(args.ai_max_concurrent)
+        command = [sys.executable, '-c',
+                   f"from benchmarks.load import load_app; load_app().run(host='127.0.0.1', port={port}, threaded=True)"]
+    log = open(log_path, 'w')
+    try:
+        return subprocess.Popen(command, cwd=PROJECT_ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+    finally:
+        log.close()
+
+
+def _request(url: str, method: str = 'GET', timeout: float = 120) -> int:
+    request = urllib.request.Request(url, method=method, data=b'{}' if method == 'POST' else None,
+                                     headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        e.read()
+        return e.code
+
+
+def _wait_ready(base: str, server: subprocess.Popen, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"服务进程已退出（状态码 {server.returncode}）")
+        try:
+            if _request(base + '/api/novels', timeout=2) == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("等待服务启动超时")
+
+
+class _Recorder:
+    def __init__(self):
+        self.samples: List[tuple] = []  # (阶段, 类型, 状态码, 耗时 ms)
+        self.phase = 'idle'
+        self._lock = threading.Lock()
+
+    def add(self, kind: str, status: int, elapsed_ms: float):
+        with self._lock:
+            self.samples.append((self.phase, kind, status, elapsed_ms))
+
+
+def _client(urls: List[str], method: str, kind: str, recorder: _Recorder, stop: threading.Event, backoff: float):
+    rnd = random.Random()
+    while not stop.is_set():
+        url = rnd.choice(urls)
+        start = time.perf_counter()
+        try:
+            status = _request(url, method)
+        except OSError:
+            status = 0
+        recorder.add(kind, status, (time.perf_counter() - start) * 1000)
+        if status == 503:
+            stop.wait(backoff)
+
+
+def _percentile(values: List[float], q: float) -> float:
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def _summarize(samples: List[tuple], phase: str, kind: str, duration: float) -> Dict[str, Any]:
+    rows = [s for s in samples if s[0] == phase and s[1] == kind]
+    ok = sorted(s[3] for s in rows if s[2] == 200)
+    result = {"requests": len(rows), "ok": len(ok), "rejected": sum(1 for s in rows if s[2] == 503),
+              "errors": sum(1 for s in rows if s[2] not in (200, 503)),
+              "throughput_rps": round(len(ok) / duration, 2)}
+    if ok:
+        result.update(p50_ms=round(statistics.median(ok), 1), p95_ms=round(_percentile(ok, 0.95), 1),
+                      p99_ms=round(_percentile(ok, 0.99), 1), max_ms=round(ok[-1], 1))
+    return result
+
+
+def run_load_test(args, log=print) -> Dict[str, Any]:
+    workdir = tempfile.mkdtemp(prefix='novel-load-')
+    db_path = os.path.join(workdir, 'load.db')
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            dataset = generate_novel(db_path, seed=args.seed, **PRESETS[args.preset])
+        novel_id, last = dataset["novel_id"], dataset["last_extracted_chapter"]
+        port = _free_port()
+        base = f'http://127.0.0.1:{port}'
+        server = _start_server(args, port, db_path, os.path.join(workdir, 'server.log'))
+        try:
+            _wait_ready(base, server)
+            read_urls = [f'{base}/api/novels/{novel_id}/chapters',
+                         f'{base}/api/novels/{novel_id}/chapters/{last}/settings',
+                         f'{base}/api/novels/{novel_id}/chapters/{last}/knowledge_graph']
+            extract_urls = [f'{base}/api/novels/{novel_id}/chapters/{last + 1}/extract']
+
+            recorder = _Recorder()
+            stop_reads, stop_ai = threading.Event(), threading.Event()
+            readers = [threading.Thread(target=_client, args=(read_urls, 'GET', 'read', recorder, stop_reads, 0))
+                       for _ in range(args.read_clients)]
+            for thread in readers:
+                thread.start()
+            log(f"idle 阶段：{args.read_clients} 个只读客户端，{args.duration} 秒")
+            time.sleep(args.duration)
+
+            recorder.phase = 'extraction'
+            extractors = [threading.Thread(target=_client, args=(extract_urls, 'POST', 'extract', recorder, stop_ai, 0.2))
+                          for _ in range(args.ai_clients)]
+            for thread in extractors:
+                thread.start()
+            log(f"extraction 阶段：另加 {args.ai_clients} 个提取客户端（模型延迟 {args.ai_latency} 秒），{args.duration} 秒")
+            time.sleep(args.duration)
+            recorder.phase = 'drain'
+            stop_reads.set()
+            stop_ai.set()
+            for thread in readers + extractors:
+                thread.join()
+        finally:
+            server.terminate()
+            try:
+                server.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                server.kill()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "config": {key: getattr(args, key) for key in
+                   ('server', 'preset', 'seed', 'workers', 'threads', 'ai_max_concurrent', 'read_clients',
+                    'ai_clients', 'ai_latency', 'duration')},
+        "phases": {
+            "idle": {"read": _summarize(recorder.samples, 'idle', 'read', args.duration)},
+            "extraction": {"read": _summarize(recorder.samples, 'extraction', 'read', args.duration),
+                           "extract": _summarize(recorder.samples, 'extraction', 'extract', args.duration)}
+        }
+    }
+
+
+def _print_result(result: Dict[str, Any]):
+    def line(name: str, stats: Dict[str, Any]):
+        latency = (f"p50 {stats['p50_ms']:>8.1f}  p95 {stats['p95_ms']:>8.1f}  p99 {stats['p99_ms']:>8.1f}  "
+                   f"max {stats['max_ms']:>8.1f} ms" if stats['ok'] else '-')
+        print(f"  {name:<20} {stats['throughput_rps']:>7.1f} req/s  ok {stats['ok']:>5}  "
+              f"503 {stats['rejected']:>4}  err {stats['errors']:>3}   {latency}")
+    print()
+    line('idle/read', result['phases']['idle']['read'])
+    line('extraction/read', result['phases']['extraction']['read'])
+    line('extraction/extract', result['phases']['extraction']['extract'])
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.load', description='多 worker 部署的负载测试')
+    parser.add_argument('--server', choices=['gunicorn', 'dev'], default='gunicorn',
+                        help='gunicorn（使用 gunicorn.conf.py）或 Flask 开发服务器')
+    parser.add_argument('--preset', choices=list(PRESETS), default='tiny', help='数据集规模（默认 tiny）')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn worker 进程数')
+    parser.add_argument('--threads', type=int, default=4, help='每个 worker 的线程数')
+    parser.add_argument('--ai-max-concurrent', type=int, default=None,
+                        help='每个 worker 的模型调用并发上限（默认取 gunicorn.conf.py 的线程数一半，0 表示不限制）')
+    parser.add_argument('--read-clients', type=int, default=4, help='只读客户端数')
+    parser.add_argument('--ai-clients', type=int, default=8, help='提取客户端数')
+    parser.add_argument('--ai-latency', type=float, default=1.0, help='模拟的模型调用耗时（秒）')
+    parser.add_argument('--duration', type=float, default=10, help='每个阶段的时长（秒）')
+    parser.add_argument('--output', help='结果 JSON 的写入路径')
+    args = parser.parse_args(argv)
+
+    result = run_load_test(args)
+    _print_result(result)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+            f.write('\n')
+        print(f"结果已写入 {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
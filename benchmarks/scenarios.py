@@ -0,0 +1,375 @@
+import contextlib
+import copy
+import itertools
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from app.services.ai_service import ai_service
+from app.services.alias_service import split_aliases
+from app.services.cache_service import cache_service
+from app.services.chapter_service import chapter_service
+from app.services.conflict_filter_service import conflict_filter_service
+from app.services.conflict_scan_service import conflict_scan_service
+from app.services.graph_query_service import graph_query_service
+from app.services.graph_service import graph_service
+from app.services.segment_extraction_service import segment_extraction_service, split_segments
+from app.services.setting_service import setting_service
+from .generator import PRESETS, generate_novel, write_novel_text
+from .startup import import_time_report, run_boot
+
+# 名称 -> (说明, 工厂函数)。工厂函数接收 ctx，完成准备工作后返回
+# {"run": 被计时的函数, "before_each": 每轮计时前执行（可选）, "teardown": 结束后执行（可选）}
+SCENARIOS: "OrderedDict[str, tuple]" = OrderedDict()
+# 中位数超过基线的该倍数视为退化，低于 1 / 该倍数视为改进
+DEFAULT_THRESHOLD = 1.25
+# frequent_patterns 场景使用的关系条数上限
+FREQUENT_PATTERNS_MAX_RELATIONSHIPS = 300
+# conflict_scan 场景检测的章节数与模拟的模型调用耗时（秒）
+CONFLICT_SCAN_CHAPTERS = 40
+CONFLICT_SCAN_LATENCY = 0.02
+# segment_extract 场景拼接的长章节字数，以及模拟的模型调用耗时（每千字秒数，随 Prompt 长度增长）
+LONG_CHAPTER_CHARS = 24000
+EXTRACT_LATENCY_PER_KCHAR = 0.01
+
+
+def _scenario(name: str, description: str):
+    def register(factory: Callable[[Dict[str, Any]], Dict[str, Callable]]):
+        SCENARIOS[name] = (description, factory)
+        return factory
+    return register
+
+
+@_scenario("settings_at_chapter", "get_settings_at_chapter：最后一章的完整快照")
+def _settings_at_chapter(ctx):
+    return {"run": lambda: setting_service.get_settings_at_chapter(ctx["novel_id"], ctx["last_extracted_chapter"])}
+
+
+@_scenario("settings_at_chapter_mid", "get_settings_at_chapter：中间章节的快照（部分设定尚未出现或已失效）")
+def _settings_at_chapter_mid(ctx):
+    return {"run": lambda: setting_service.get_settings_at_chapter(ctx["novel_id"], ctx["last_extracted_chapter"] // 2)}
+
+
+@_scenario("chapter_changes", "get_chapter_changes：依次查询 10 个章节的变更")
+def _chapter_changes(ctx):
+    last = ctx["last_extracted_chapter"]
+    numbers = sorted({max(1, last * i // 10) for i in range(1, 11)})
+
+    def run():
+        for number in numbers:
+            setting_service.get_chapter_changes(ctx["novel_id"], number)
+    return {"run": run}
+
+
+@_scenario("snapshot_sweep", "iter_snapshots：依次生成全部已提取章节的快照（批量冲突检测的快照准备）")
+def _snapshot_sweep(ctx):
+    def run():
+        for _ in setting_service.iter_snapshots(ctx["novel_id"], 0, ctx["last_extracted_chapter"]):
+            pass
+    return {"run": run}
+
+
+@_scenario("conflict_scan", f"conflict_scan_service.scan：并发检测 {CONFLICT_SCAN_CHAPTERS} 章，"
+                            f"模型调用替换为 {int(CONFLICT_SCAN_LATENCY * 1000)} ms 的等待")
+def _conflict_scan(ctx):
+    last = ctx["last_extracted_chapter"]
+    start = max(1, last - CONFLICT_SCAN_CHAPTERS + 1)
+
+    def detect(previous_settings: Dict[str, Any], chapter_content: str) -> Dict[str, Any]:
+        time.sleep(CONFLICT_SCAN_LATENCY)
+        return {"conflicts": []}
+
+    def run():
+        for _ in conflict_scan_service.scan(ctx["novel_id"], start, last):
+            pass
+
+    def restore():
+        del ai_service.detect_conflicts  # 删除实例属性，恢复类方法
+
+    ai_service.detect_conflicts = detect
+    return {"run": run, "teardown": restore}
+
+
+@_scenario("conflict_prefilter", f"conflict_filter_service.screen：本地预筛最后 {CONFLICT_SCAN_CHAPTERS} 章"
+                                 f"（快照与正文预先读取，只计预筛）")
+def _conflict_prefilter(ctx):
+    last = ctx["last_extracted_chapter"]
+    start = max(1, last - CONFLICT_SCAN_CHAPTERS + 1)
+    chapters = [(snapshot, chapter_service.get_chapter_content(ctx["novel_id"], number + 1)['content'])
+                for number, snapshot in setting_service.iter_snapshots(ctx["novel_id"], start - 1, last - 1)]
+
+    def run():
+        for snapshot, content in chapters:
+            conflict_filter_service.screen(snapshot, content, ctx["novel_id"])
+    return {"run": run}
+
+
+@_scenario("segment_extract", f"segment_extraction_service.extract：约 {LONG_CHAPTER_CHARS} 字的长章节分段并发提取并合并，"
+                              f"模型调用替换为每千字 {int(EXTRACT_LATENCY_PER_KCHAR * 1000)} ms 的等待")
+def _segment_extract(ctx):
+    settings = setting_service.get_settings_at_chapter(ctx["novel_id"], ctx["last_extracted_chapter"])
+    parts, length = [], 0
+    for number in itertools.count(1):
+        chapter = chapter_service.get_chapter_content(ctx["novel_id"], number)
+        if chapter is None or length >= LONG_CHAPTER_CHARS:
+            break
+        parts.append(chapter['content'])
+        length += len(chapter['content'])
+    content = '\n'.join(parts)
+    # 各段返回按快照构造的确定性结果，合并的工作量与真实输出相近
+    results = {segment: _stub_extraction(settings, random.Random(ctx["seed"] + i))
+               for i, segment in enumerate(split_segments(content))}
+
+    def extract(chapter_content: str, existing_settings: Dict[str, Any]) -> Dict[str, Any]:
+        time.sleep(len(chapter_content) / 1000 * EXTRACT_LATENCY_PER_KCHAR)
+        return copy.deepcopy(results.get(chapter_content) or {})
+
+    def restore():
+        del ai_service.extract_settings_from_text  # 删除实例属性，恢复类方法
+
+    ai_service.extract_settings_from_text = extract
+    return {"run": lambda: segment_extraction_service.extract(content, settings), "teardown": restore}
+
+
+def _stub_extraction(settings: Dict[str, Any], rnd: random.Random) -> Dict[str, Any]:
+    """
+    按上一章快照构造确定性的模型输出：修改部分已有实体的属性（部分以别名指代）、新增实体与关系、
+    修改已有关系，并使部分关系与属性失效。规模随快照大小增长。
+    """
+    entities = settings["entities"]
+    relationships = settings["relationships"]
+    k = max(5, len(entities) // 50)
+
+    new_entities = []
+    for entity in rnd.sample(entities, min(k, len(entities))):
+        aliases = split_aliases(entity["properties"].get("别名"))
+        name = aliases[0] if aliases and rnd.random() < 0.3 else entity["name"]
+        properties = {key: f"{value}*" for key, value in entity["properties"].items()
+                      if key != '别名' and rnd.random() < 0.5}
+        properties["状态"] = f"新状态{rnd.randint(1, 9)}"
+        new_entities.append({"name": name, "type": entity["type"], "properties": properties})
+    for j in range(max(1, k // 5)):
+        new_entities.append({"name": f"新角色{j}", "type": "人物",
+                             "properties": {"身份": "过客", "别名": f"无名氏{j}, 路人{j}"}})
+
+    names = [e["name"] for e in entities] + [f"新角色{j}" for j in range(max(1, k // 5))]
+    new_relationships = [{"subject": a, "object": b, "relation": rnd.choice(['朋友', '敌人', '盟友'])}
+                         for a, b in (rnd.sample(names, 2) for _ in range(k))]
+    sampled = rnd.sample(relationships, min(k // 2, len(relationships)))
+    half = len(sampled) // 2
+    new_relationships += [{"subject": r["subject"], "object": r["object"], "relation": r["relation"] + "*"}
+                          for r in sampled[:half]]
+    invalidated = [{"type": "relationship", "subject": r["subject"], "object": r["object"], "relation": r["relation"]}
+                   for r in sampled[half:]]
+    for entity in rnd.sample(entities, min(max(1, k // 5), len(entities))):
+        key = next(iter(entity["properties"]), None)
+        if key:
+            invalidated.append({"type": "property", "entity": entity["name"], "key": key})
+
+    return {"new_settings": {"entities": new_entities, "relationships": new_relationships},
+            "invalidated_settings": invalidated}
+
+
+def _with_stubbed_ai(ctx) -> Callable[[], None]:
+    """把提取调用替换为固定结果，返回恢复原函数的回调"""
+    pending = ctx["last_extracted_chapter"] + 1
+    settings = setting_service.get_settings_at_chapter(ctx["novel_id"], pending - 1)
+    result = _stub_extraction(settings, random.Random(ctx["seed"]))
+    ai_service.extract_settings_from_text = lambda content, old_settings: copy.deepcopy(result)
+
+    def restore():
+        del ai_service.extract_settings_from_text  # 删除实例属性，恢复类方法
+        setting_service.rollback_settings(ctx["novel_id"], pending)
+    return restore
+
+
+@_scenario("extract_apply", "extract_and_update_settings：读取上一章快照并写入固定的提取结果（不调用模型）")
+def _extract_apply(ctx):
+    pending = ctx["last_extracted_chapter"] + 1
+    return {
+        "run": lambda: setting_service.extract_and_update_settings(ctx["novel_id"], pending),
+        "before_each": lambda: setting_service.rollback_settings(ctx["novel_id"], pending),
+        "teardown": _with_stubbed_ai(ctx)
+    }
+
+
+@_scenario("rollback", "rollback_settings：回滚一次提取写入的设定")
+def _rollback(ctx):
+    pending = ctx["last_extracted_chapter"] + 1
+    return {
+        "run": lambda: setting_service.rollback_settings(ctx["novel_id"], pending),
+        "before_each": lambda: setting_service.extract_and_update_settings(ctx["novel_id"], pending),
+        "teardown": _with_stubbed_ai(ctx)
+    }
+
+
+@_scenario("knowledge_graph", "get_knowledge_graph：最后一章的完整知识图谱")
+def _knowledge_graph(ctx):
+    return {"run": lambda: graph_service.get_knowledge_graph(ctx["novel_id"], ctx["last_extracted_chapter"])}
+
+
+def _path_pairs(ctx, count: int) -> List[tuple]:
+    graph = graph_query_service.get_graph(ctx["novel_id"], ctx["last_extracted_chapter"])
+    rnd = random.Random(ctx["seed"])
+    return [tuple(rnd.sample(range(graph.node_count), 2)) for _ in range(count)] if graph.node_count > 1 else []
+
+
+@_scenario("shortest_path", "shortest_path：图已缓存时查询 200 对实体的最短路径")
+def _shortest_path(ctx):
+    pairs = _path_pairs(ctx, 200)
+
+    def run():
+        for source, target in pairs:
+            graph_query_service.shortest_path(ctx["novel_id"], ctx["last_extracted_chapter"], source, target)
+    return {"run": run}
+
+
+@_scenario("shortest_path_cold", "shortest_path：写入代数变化后首次查询（包含快照读取与建图）")
+def _shortest_path_cold(ctx):
+    source, target = (_path_pairs(ctx, 1) or [(0, 0)])[0]
+    return {
+        "run": lambda: graph_query_service.shortest_path(ctx["novel_id"], ctx["last_extracted_chapter"], source, target),
+        "before_each": lambda: cache_service.bump_generation(ctx["novel_id"])
+    }
+
+
+@_scenario("frequent_patterns", f"extract_frequent_patterns：最后一章快照中前 {FREQUENT_PATTERNS_MAX_RELATIONSHIPS} 条关系"
+                               "及其涉及实体上的频繁关系模式挖掘")
+def _frequent_patterns(ctx):
+    from app.api.novel_routes import extract_frequent_patterns
+    settings = setting_service.get_settings_at_chapter(ctx["novel_id"], ctx["last_extracted_chapter"])
+    # 现有实现按名称线性查找实体类型，耗时约为 模式数 × 关系数 × 实体数，全量快照无法在合理时间内跑完，
+    # 因此只取部分关系；改为线性算法后可提高该上限（并重新生成基线）
+    relationships = settings["relationships"][:FREQUENT_PATTERNS_MAX_RELATIONSHIPS]
+    names = {r["subject"] for r in relationships} | {r["object"] for r in relationships}
+    subset = {"entities": [e for e in settings["entities"] if e["name"] in names], "relationships": relationships}
+    return {"run": lambda: extract_frequent_patterns(subset, 5)}
+
+
+@_scenario("novel_splitter", "split_novel_by_chapters：切分与数据集章节数相同的 UTF-8 小说文本")
+def _novel_splitter(ctx):
+    from utils.novel_splitter import split_novel_by_chapters
+    path = os.path.join(ctx["workdir"], "novel.txt")
+    write_novel_text(path, ctx["chapters"], ctx["chapter_chars"], ctx["seed"])
+    return {"run": lambda: split_novel_by_chapters(path), "teardown": lambda: os.remove(path)}
+
+
+@_scenario("startup", "新进程导入应用并执行 create_app（worker 冷启动，含解释器启动）")
+def _startup(ctx):
+    return {"run": lambda: run_boot(ctx["db_path"])}
+
+
+def _summarize(samples: List[float]) -> Dict[str, Any]:
+    ordered = sorted(samples)
+    p95_index = min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))
+    return {
+        "runs_ms": [round(s, 3) for s in samples],
+        "min_ms": round(ordered[0], 3),
+        "median_ms": round(statistics.median(ordered), 3),
+        "p95_ms": round(ordered[p95_index], 3),
+        "mean_ms": round(statistics.fmean(ordered), 3)
+    }
+
+
+def run_benchmarks(preset: str = "small", runs: int = 5, seed: int = 42, workdir: Optional[str] = None,
+                   only: Optional[Iterable[str]] = None, keep_db: bool = False,
+                   log: Callable[[str], None] = lambda message: None) -> Dict[str, Any]:
+    """
+    生成数据集并依次运行各场景：每个场景先预热一轮（不计时），再计时 runs 轮。
+    场景内部的 print 输出被丢弃。返回可直接写成 JSON 的结果。
+    """
+    spec = dict(PRESETS[preset])
+    names = list(only) if only else list(SCENARIOS)
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        raise ValueError(f"未知场景: {', '.join(unknown)}")
+
+    own_workdir = workdir is None
+    workdir = workdir or tempfile.mkdtemp(prefix="novel-bench-")
+    db_path = os.path.join(workdir, f"bench-{preset}-{seed}.db")
+
+    with open(os.devnull, 'w') as devnull:
+        t0 = time.perf_counter()
+        with contextlib.redirect_stdout(devnull):
+            dataset = generate_novel(db_path, seed=seed, **spec)
+        dataset["generate_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        log(f"数据集 {preset}: {dataset['entities']} 实体 / {dataset['property_versions']} 属性版本 / "
+            f"{dataset['relationships']} 关系，生成耗时 {dataset['generate_ms']} ms")
+
+        ctx = dict(dataset, seed=seed, workdir=workdir, db_path=db_path, chapter_chars=spec["chapter_chars"])
+        results = OrderedDict()
+        for name in names:
+            description, factory = SCENARIOS[name]
+            with contextlib.redirect_stdout(devnull):
+                hooks = factory(ctx)
+                before_each = hooks.get("before_each")
+                samples = []
+                try:
+                    for i in range(runs + 1):
+                        if before_each:
+                            before_each()
+                        start = time.perf_counter()
+                        hooks["run"]()
+                        elapsed = (time.perf_counter() - start) * 1000
+                        if i:  # 第 0 轮为预热
+                            samples.append(elapsed)
+                finally:
+                    if hooks.get("teardown"):
+                        hooks["teardown"]()
+            results[name] = dict(description=description, **_summarize(samples))
+            log(f"  {name:<24} median {results[name]['median_ms']:>10.2f} ms   p95 {results[name]['p95_ms']:>10.2f} ms")
+
+        # 启动场景附带一次 -X importtime 的导入耗时分解
+        startup = import_time_report(db_path) if "startup" in names else None
+
+    if not keep_db:
+        os.remove(db_path)
+        if own_workdir:
+            os.rmdir(workdir)
+
+    return {
+        "meta": {
+            "preset": preset,
+            "params": spec,
+            "seed": seed,
+            "runs": runs,
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z")
+        },
+        "dataset": dataset,
+        "scenarios": results,
+        **({"startup": startup} if startup else {})
+    }
+
+
+def compare_results(current: Dict[str, Any], baseline: Dict[str, Any],
+                    threshold: float = DEFAULT_THRESHOLD) -> List[Dict[str, Any]]:
+    """
+    按中位数对比本次结果与基线，status 为 regression / improvement / ok / new（基线中没有的场景）。
+    数据集参数不同时对比没有意义，调用方应先检查 meta.params。
+    """
+    rows = []
+    base_scenarios = baseline.get("scenarios", {})
+    for name, result in current["scenarios"].items():
+        base = base_scenarios.get(name)
+        if base is None:
+            rows.append({"scenario": name, "baseline_ms": None, "current_ms": result["median_ms"],
+                         "ratio": None, "status": "new"})
+            continue
+        ratio = result["median_ms"] / base["median_ms"] if base["median_ms"] else float('inf')
+        if ratio > threshold:
+            status = "regression"
+        elif ratio < 1 / threshold:
+            status = "improvement"
+        else:
+            status = "ok"
+        rows.append({"scenario": name, "baseline_ms": base["median_ms"], "current_ms": result["median_ms"],
+                     "ratio": round(ratio, 3), "status": status})
+    return rows
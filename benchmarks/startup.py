@@ -0,0 +1,75 @@
+import os
+import re
+import subprocess
+import sys
+from collections import defaultdict
+from typing import Any, Dict, List
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 新进程中模拟 worker 启动：导入应用并执行 create_app（使用基准数据库，避免改动项目数据库）
+_BOOT_CODE = (
+    "from app.services import db_service\n"
+    "db_service.DB_PATH = {db_path!r}\n"
+    "from app import create_app\n"
+    "create_app()\n"
+)
+# -X importtime 的输出行：import time: <self us> | <cumulative us> | <缩进><模块名>
+_IMPORT_LINE_RE = re.compile(r'^import time:\s*(\d+)\s*\|\s*(\d+)\s*\|(\s*)(\S+)\s*$')
+
+
+def boot_command(db_path: str, importtime: bool = False) -> List[str]:
+    options = ['-X', 'importtime'] if importtime else []
+    return [sys.executable, *options, '-c', _BOOT_CODE.format(db_path=db_path)]
+
+
+def run_boot(db_path: str, importtime: bool = False) -> subprocess.CompletedProcess:
+    """在新进程中启动一次应用，失败时抛出 CalledProcessError"""
+    return subprocess.run(boot_command(db_path, importtime), cwd=PROJECT_ROOT, check=True,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+
+
+def import_time_report(db_path: str, top: int = 15) -> Dict[str, Any]:
+    """
+    以 -X importtime 启动一次应用并汇总导入耗时（单位 ms）：
+    - modules：累计耗时（含其导入的子模块，因此父子模块会重复计入）最长的模块；
+    - packages：按顶层包汇总的自身耗时，用于定位拖慢启动的依赖；
+    - app_modules：启动时即导入的本项目模块（蓝图及其依赖的 services）按自身耗时排序，
+      app_self_ms 为这些模块自身耗时之和。
+    只统计一次，受文件系统缓存影响，看相对大小即可。
+    """
+    stderr = run_boot(db_path, importtime=True).stderr
+    entries = []
+    for line in stderr.splitlines():
+        match = _IMPORT_LINE_RE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            entries.append((module, int(self_us), int(cumulative_us), len(indent)))
+
+    # 缩进最浅的为顶层导入（由 -c 代码或解释器启动直接触发），其累计耗时互不重叠
+    base_indent = min((indent for *_, indent in entries), default=0)
+    roots = [e for e in entries if e[3] == base_indent]
+    packages = defaultdict(lambda: {"self_ms": 0.0, "modules": 0})
+    for module, self_us, _, _ in entries:
+        package = packages[module.split('.')[0]]
+        package["self_ms"] += self_us / 1000
+        package["modules"] += 1
+
+    app_entries = [e for e in entries if e[0] == 'app' or e[0].startswith('app.')]
+
+    return {
+        "total_ms": round(sum(e[2] for e in roots) / 1000, 1),
+        "module_count": len(entries),
+        "app_self_ms": round(sum(e[1] for e in app_entries) / 1000, 1),
+        "app_modules": [
+            {"module": module, "self_ms": round(self_us / 1000, 1)}
+            for module, self_us, _, _ in sorted(app_entries, key=lambda e: e[1], reverse=True)
+        ],
+        "modules": [
+            {"module": module, "cumulative_ms": round(cumulative_us / 1000, 1), "self_ms": round(self_us / 1000, 1)}
+            for module, self_us, cumulative_us, _ in sorted(entries, key=lambda e: e[2], reverse=True)[:top]
+        ],
+        "packages": [
+            {"package": name, "self_ms": round(stats["self_ms"], 1), "modules": stats["modules"]}
+            for name, stats in sorted(packages.items(), key=lambda item: item[1]["self_ms"], reverse=True)[:top]
+        ]
+    }
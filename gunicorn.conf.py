@@ -0,0 +1,45 @@
+"""
+gunicorn 配置（生产部署）：
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+多进程 + 每进程多线程（gthread）。模型调用是长时间的网络等待，只读接口是毫秒级的数据库查询，
+两类请求在同一 worker 的线程池中处理，通过 NOVEL_AI_MAX_CONCURRENT 给模型调用请求划出
+独立的名额（默认为线程数的一半），其余线程始终留给只读接口。各项均可用环境变量覆盖，说明见 docs/deployment.md。
+"""
+import os
+import random
+
+bind = os.environ.get('NOVEL_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('NOVEL_WORKERS', min(2 * (os.cpu_count() or 1) + 1, 8)))
+worker_class = 'gthread'
+threads = int(os.environ.get('NOVEL_THREADS', 8))
+
+# 每个 worker 的模型调用并发上限；create_app 读取该环境变量，这里只设置默认值
+os.environ.setdefault('NOVEL_AI_MAX_CONCURRENT', str(max(1, threads // 2)))
+
+# 在 master 中导入应用并初始化数据库一次，worker 通过 fork 共享已导入的模块，启动更快。
+# 注意：预加载时 kill -HUP 只重启 worker、不会加载新代码，更新代码需按 docs/deployment.md 平滑替换 master
+preload_app = True
+
+# gthread worker 由主循环发送心跳，长时间的模型调用不会触发该超时；这里只用于回收卡死的 worker
+timeout = int(os.environ.get('NOVEL_TIMEOUT', 120))
+# 重启 / 停止时等待进行中的请求（如批量提取中的单章）完成的时间
+graceful_timeout = int(os.environ.get('NOVEL_GRACEFUL_TIMEOUT', 300))
+keepalive = 5
+# 处理一定数量的请求后平滑替换 worker，限制长期运行的内存增长；抖动避免所有 worker 同时重启
+max_requests = int(os.environ.get('NOVEL_MAX_REQUESTS', 2000))
+max_requests_jitter = max_requests // 10
+
+accesslog = os.environ.get('NOVEL_ACCESS_LOG', '-') or None
+errorlog = '-'
+loglevel = os.environ.get('NOVEL_LOG_LEVEL', 'info')
+
+
+def post_fork(server, worker):
+    """fork 出的 worker 不能沿用 master 中的数据库连接与 API key 起点"""
+    from app.services.ai_service import ai_service
+    from app.services.cache_service import cache_service
+    cache_service.reset()
+    # 预加载时所有 worker 继承同一个起始 key，重新随机以分散到整个 key 池
+    ai_service.current_key_index = random.randrange(len(ai_service.api_keys))
@@ -2,6 +2,11 @@
 -- SQLite version
 
 -- Drop tables if they exist to ensure a clean slate
+DROP TABLE IF EXISTS `chapters_fts`;
+DROP VIEW IF EXISTS `chapter_texts`;
+DROP TABLE IF EXISTS `chapter_contents`;
+DROP TABLE IF EXISTS `conflicts`;
+DROP TABLE IF EXISTS `entity_aliases`;
 DROP TABLE IF EXISTS `relationships`;
 DROP TABLE IF EXISTS `properties`;
 DROP TABLE IF EXISTS `entities`;
@@ -21,7 +26,6 @@ CREATE TABLE `chapters` (
     `novel_id` INTEGER NOT NULL,
     `number` INTEGER NOT NULL,
     `title` TEXT NOT NULL,
-    `content` TEXT,
     `conflict_result` TEXT,
     FOREIGN KEY (`novel_id`) REFERENCES `novels`(`id`) ON DELETE CASCADE,
     UNIQUE (`novel_id`, `number`)
@@ -66,3 +70,23 @@ CREATE TABLE `relationships` (
     FOREIGN KEY (`start_chapter_id`) REFERENCES `chapters`(`id`),
     FOREIGN KEY (`end_chapter_id`) REFERENCES `chapters`(`id`)
 );
+
+-- Chapter bodies are stored compressed in chapter_contents (one row per chapter,
+-- decoded on demand through the chapter_texts view); both are created by
+-- db_service.migrate_db(), which also moves legacy chapters.content into it.
+
+-- Full-text index over chapters (chapters_fts, FTS5 trigram) is created by
+-- db_service.migrate_db() when the SQLite build supports FTS5.
+
+-- Alias table (entity_aliases: one row per alias of the `别名` property, with the
+-- same chapter interval as the property version) is created by db_service.migrate_db().
+
+-- Extraction traces (extraction_traces: one row per extract_and_update_settings run
+-- with per-stage durations and counters) are created by db_service.migrate_db().
+
+-- Cache generations (cache_generations: per-novel write counters shared by all
+-- worker processes for cache invalidation) are created by db_service.migrate_db().
+
+-- Conflicts (conflicts: one row per conflict found by detect_conflicts, indexed by
+-- entity, referenced start chapter and chapter; chapters.conflict_result keeps the
+-- raw result) are created by db_service.migrate_db().
@@ -0,0 +1,10 @@
+"""
+生产环境的 WSGI 入口：gunicorn -c gunicorn.conf.py wsgi:app
+开发调试仍使用 run.py（Flask 开发服务器）。
+"""
+from app import create_app
+from app.services import db_service
+
+app = create_app()
+# 多个 worker 进程共用数据库：WAL 模式下提取写入期间其它进程仍可读取
+db_service.enable_wal()